@@ -0,0 +1,46 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Shared benchmark fixtures."""
+import os
+import shutil
+
+import pytest
+
+from tests.fakemirror import FakeMirror, SigningKey
+from ubuntu_iso_download.ratelimit import parse_rate
+
+DIRECTORY = "ubuntu/releases/focal/release"
+FILENAME = "ubuntu-20.04.3-live-server-amd64.iso"
+SIZE = parse_rate(os.getenv("UBUNTU_ISO_BENCH_SIZE", "2G"))
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Keep caches out of the user's home directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
+@pytest.fixture(scope="session")
+def signing_key(tmp_path_factory):
+    """Return a test signing key, skipping if gpg is not installed."""
+    if not shutil.which("gpg"):
+        pytest.skip("gpg is not installed")
+
+    return SigningKey(str(tmp_path_factory.mktemp("gnupg")))
+
+
+@pytest.fixture(scope="session")
+def mirror(tmp_path_factory, signing_key):
+    """Serve one release with a sparse ISO of UBUNTU_ISO_BENCH_SIZE bytes.
+
+    The signing key is installed as the Ubuntu keyring of a fake snap,
+    which is where ISO looks for it when $SNAP is set.
+    """
+    root = tmp_path_factory.mktemp("mirror")
+    keyrings = root / "snap" / "usr" / "share" / "keyrings"
+    keyrings.mkdir(parents=True)
+    (keyrings / "ubuntu-archive-keyring.gpg").write_bytes(signing_key.keyring)
+
+    with FakeMirror(str(root / "tree")) as mirror:
+        mirror.add_release(DIRECTORY, {FILENAME: SIZE}, signing_key)
+        mirror.snap = str(root / "snap")
+        yield mirror
@@ -0,0 +1,126 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""End-to-end download benchmarks against a local fake mirror.
+
+Run with 'make benchmark'. The ISO size defaults to 2G and is set with
+$UBUNTU_ISO_BENCH_SIZE (e.g. 500M for a quick run).
+"""
+import os
+import resource
+import time
+
+import pytest
+
+from tests.fakemirror import release_data
+from ubuntu_iso_download.iso import ISO
+from ubuntu_iso_download.metrics import JsonLines, Metrics
+from ubuntu_iso_download.pipeline import Pipeline, file_digests
+
+from .conftest import DIRECTORY, FILENAME, SIZE
+
+pytest.importorskip("pytest_benchmark")
+
+MIB = 1024 * 1024
+
+
+class Progress:
+    """Progress bar that records when the first byte arrived."""
+
+    def __init__(self, total):
+        """Initialize progress."""
+        self.total = total
+        self.first_byte = None
+
+    def update(self, length):
+        """Record the first update."""
+        if self.first_byte is None:
+            self.first_byte = time.monotonic()
+
+    def close(self):
+        """Close progress."""
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_iso(mirror, monkeypatch, tmp_path, **options):
+    """Return an ISO of the benchmark release and the progress bars."""
+    monkeypatch.setenv("SNAP", mirror.snap)
+    monkeypatch.chdir(tmp_path)
+
+    bars = []
+    iso = ISO(mirror.flavor(DIRECTORY), "focal", ubuntu=release_data(), **options)
+    iso.progress = lambda size, filename: bars.append(Progress(size)) or bars[-1]
+    return iso, bars
+
+
+def run_download(iso):
+    """Download the ISO from scratch."""
+    if os.path.exists(FILENAME):
+        os.remove(FILENAME)
+    return iso.download()
+
+
+@pytest.mark.parametrize("connections", [1, 4])
+def test_download_throughput(benchmark, mirror, monkeypatch, tmp_path, connections):
+    """Throughput and peak RSS of ISO.download()."""
+    iso, _ = make_iso(mirror, monkeypatch, tmp_path, connections=connections)
+    baseline = peak_rss()
+
+    benchmark.pedantic(run_download, args=(iso,), rounds=3, iterations=1)
+
+    benchmark.extra_info["size_mib"] = SIZE / MIB
+    benchmark.extra_info["throughput_mib_s"] = SIZE / MIB / benchmark.stats.stats.mean
+    benchmark.extra_info["peak_rss_mib"] = peak_rss() / MIB
+    # the ISO is streamed, never held in memory
+    assert peak_rss() - baseline < min(SIZE // 2, 256 * MIB)
+
+
+def test_time_to_first_byte(benchmark, mirror, monkeypatch, tmp_path):
+    """Time from calling ISO.download() to the first byte of the ISO.
+
+    This covers fetching and verifying SHA256SUMS, probing the ISO, and
+    the first response, against a mirror answering after 50ms.
+    """
+    iso, bars = make_iso(mirror, monkeypatch, tmp_path)
+    mirror.latency = 0.05
+
+    def first_byte():
+        start = time.monotonic()
+        run_download(iso)
+        return bars[-1].first_byte - start
+
+    try:
+        seconds = benchmark.pedantic(first_byte, rounds=3, iterations=1)
+    finally:
+        mirror.latency = 0
+
+    benchmark.extra_info["time_to_first_byte_s"] = seconds
+
+
+@pytest.mark.parametrize("algorithms", [(), ("sha256",), ("sha256", "sha512")])
+def test_hash_overhead(benchmark, mirror, algorithms):
+    """Reading the ISO through the pipeline with and without hashing."""
+    path = os.path.join(mirror.root, DIRECTORY, FILENAME)
+
+    def read():
+        with open(path, "rb", buffering=0) as iso:
+            return Pipeline(algorithms=algorithms).run(iso.readinto)
+
+    digests = benchmark.pedantic(read, rounds=3, iterations=1)
+
+    benchmark.extra_info["throughput_mib_s"] = SIZE / MIB / benchmark.stats.stats.mean
+    if algorithms:
+        assert digests["sha256"] == file_digests(path)["sha256"]
+
+
+@pytest.mark.parametrize("metrics_file", [False, True])
+def test_metrics_overhead(benchmark, mirror, monkeypatch, tmp_path, metrics_file):
+    """Throughput of ISO.download() with and without a metrics file."""
+    hooks = [JsonLines(str(tmp_path / "metrics.jsonl"))] if metrics_file else []
+    iso, _ = make_iso(mirror, monkeypatch, tmp_path, metrics=Metrics(hooks))
+
+    benchmark.pedantic(run_download, args=(iso,), rounds=3, iterations=1)
+
+    benchmark.extra_info["throughput_mib_s"] = SIZE / MIB / benchmark.stats.stats.mean
@@ -0,0 +1,48 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Start-up benchmarks of the command line.
+
+Run with 'make benchmark'. Wall-clock times depend on the machine, so
+they are measured here rather than asserted by the test suite.
+"""
+import subprocess
+import sys
+
+import pytest
+
+from tests.imports import import_times, run_python
+
+pytest.importorskip("pytest_benchmark")
+
+# microseconds; importing the main module takes about 40ms on a laptop
+# and over 200ms when requests and the release data are loaded eagerly
+BUDGET = 100 * 1000
+
+
+def test_import_time(benchmark):
+    """Cumulative time to import the main module, from -X importtime."""
+    _, report = run_python("import ubuntu_iso_download.__main__")
+    microseconds = import_times(report)["ubuntu_iso_download.__main__"]
+
+    benchmark.pedantic(
+        run_python,
+        args=("import ubuntu_iso_download.__main__",),
+        rounds=5,
+        iterations=1,
+    )
+
+    benchmark.extra_info["import_ms"] = microseconds / 1000
+    assert microseconds < BUDGET
+
+
+def run_help():
+    """Run --help in a fresh interpreter."""
+    subprocess.run(
+        [sys.executable, "-m", "ubuntu_iso_download", "--help"],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def test_help_time(benchmark):
+    """Wall-clock time of --help in a fresh interpreter."""
+    benchmark.pedantic(run_help, rounds=5, iterations=1)
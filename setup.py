@@ -64,7 +64,7 @@ setup(
         "Topic :: Software Development :: Testing",
     ],
     keywords=["ubuntu", "download", "iso"],
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "tests", "tests.*"]),
     include_package_data=True,
     entry_points={
         "console_scripts": ["ubuntu-iso-download=ubuntu_iso_download.__main__:launch"]
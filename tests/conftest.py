@@ -0,0 +1,22 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Shared fixtures of the test helper tests."""
+import shutil
+
+import pytest
+
+from .fakemirror import SigningKey
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Keep caches out of the user's home directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
+@pytest.fixture(scope="session")
+def signing_key(tmp_path_factory):
+    """Return a test signing key, skipping if gpg is not installed."""
+    if not shutil.which("gpg"):
+        pytest.skip("gpg is not installed")
+
+    return SigningKey(str(tmp_path_factory.mktemp("gnupg")))
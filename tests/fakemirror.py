@@ -0,0 +1,430 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download stand-in mirror, for tests only.
+
+A local HTTP server with a synthetic cdimage/releases tree, for tests
+and benchmarks that must not depend on the network. ISOs are sparse
+files of any size with a little data scattered through them, so a
+multi-GB ISO costs almost no disk space, and each release directory
+gets a SHA256SUMS file and a SHA256SUMS.gpg signed with a throwaway
+test key.
+
+The server can misbehave on purpose: add latency before every answer,
+throttle the bytes sent, drop connections part way through a body, or
+ignore Range requests. It runs on its own thread:
+
+    with FakeMirror(root) as mirror:
+        mirror.add_release("ubuntu/releases/focal/release", {name: size})
+        ...download from mirror.url...
+
+or from the command line:
+
+    python3 -m tests.fakemirror /tmp/mirror --size 4G
+
+from the top of a source checkout. It is not part of the package.
+"""
+
+import argparse
+import hashlib
+import http.server
+import logging
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+
+from ubuntu_iso_download.pipeline import file_digests
+from ubuntu_iso_download.ratelimit import TokenBucket, parse_rate
+from ubuntu_iso_download.url import URL
+
+CHUNK_SIZE = 64 * 1024
+MARKER_INTERVAL = 256 * 1024 * 1024
+
+
+def release_data(codename="focal", name="Focal Fossa", version="20.04.3 LTS"):
+    """Return release data with a single supported release.
+
+    The data is built in place instead of being fetched from
+    changelogs.ubuntu.com.
+
+    Args:
+        codename: string, release codename
+        name: string, full release name
+        version: string, version with ' LTS' for an LTS release
+    """
+    from ubuntu_release_info import data as UbuntuReleaseInfo
+    from ubuntu_release_info.release import Release
+
+    data = UbuntuReleaseInfo.Data.__new__(UbuntuReleaseInfo.Data)
+    data._log = logging.getLogger(UbuntuReleaseInfo.__name__)
+    data.releases = {codename: Release(codename, name, version, True, "LTS" in version)}
+    return data
+
+
+def make_iso(path, size, seed=""):
+    """Create a sparse ISO and return its SHA-256.
+
+    Most of the file is a hole. A small block derived from the seed is
+    written every MARKER_INTERVAL bytes, so ISOs of the same size still
+    differ and a wrong offset changes the digest.
+
+    Args:
+        path: string, path of the ISO to create
+        size: integer, size in bytes
+        seed: string, makes the content of this ISO unique
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as iso:
+        iso.truncate(size)
+        for offset in range(0, size, MARKER_INTERVAL):
+            marker = hashlib.sha256(("%s:%s" % (seed, offset)).encode()).digest()
+            iso.seek(offset)
+            iso.write((marker * 128)[: size - offset])
+
+    return file_digests(path)["sha256"]
+
+
+class SigningKey:
+    """Throwaway RSA signing key in its own GPG home."""
+
+    def __init__(self, home):
+        """Generate the key.
+
+        Args:
+            home: string, GPG home directory to keep the key in
+        """
+        import gnupg
+
+        self.gpg = gnupg.GPG(gnupghome=home)
+        key = self.gpg.gen_key(
+            self.gpg.gen_key_input(
+                key_type="RSA",
+                key_length=2048,
+                name_real="Test CD Image Signing Key",
+                name_email="cdimage@example.com",
+                no_protection=True,
+            )
+        )
+        self.fingerprint = str(key)
+        self.keyring = self.gpg.export_keys(self.fingerprint, armor=False)
+
+    def sign(self, data, armor=True):
+        """Return a detached signature of data."""
+        signature = self.gpg.sign(
+            data, keyid=self.fingerprint, detach=True, binary=not armor
+        )
+        return signature.data
+
+
+class MirrorServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded HTTP server that ignores clients going away."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """Silence errors from aborted connections."""
+
+
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the files of the mirror tree with its faults applied."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        """Silence request logging."""
+
+    def do_HEAD(self):
+        """Send headers only."""
+        self._send(body=False)
+
+    def do_GET(self):
+        """Send headers and content."""
+        self._send(body=True)
+
+    def _send(self, body):
+        """Send the requested file or byte range."""
+        mirror = self.server.mirror
+        mirror.record(self.command, self.path, self.headers)
+        if mirror.latency:
+            time.sleep(mirror.latency)
+
+        path = mirror.local_path(self.path)
+        if not path:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        stat = os.stat(path)
+        etag = '"%x-%x"' % (stat.st_size, stat.st_mtime_ns)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        status = 200
+        start, end = 0, stat.st_size
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and mirror.ranges:
+            status = 206
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)) + 1, stat.st_size)
+
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        if mirror.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header(
+                "Content-Range", "bytes %s-%s/%s" % (start, end - 1, stat.st_size)
+            )
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+
+        if body:
+            self._send_body(path, start, end, mirror.take_drop())
+
+    def _send_body(self, path, start, end, drop_after):
+        """Send a byte range of a file, cutting it short if asked to."""
+        sent = 0
+        with open(path, "rb") as content:
+            content.seek(start)
+            while start + sent < end:
+                size = min(CHUNK_SIZE, end - start - sent)
+                if drop_after is not None:
+                    size = min(size, drop_after - sent)
+                    if size <= 0:
+                        self._drop()
+                        return
+
+                chunk = content.read(size)
+                self.server.mirror.throttle.consume(len(chunk))
+                self.wfile.write(chunk)
+                sent += len(chunk)
+
+    def _drop(self):
+        """Close the connection in the middle of a response."""
+        self.wfile.flush()
+        self.close_connection = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class FakeMirror:
+    """Local mirror of a synthetic cdimage/releases tree."""
+
+    def __init__(
+        self,
+        root,
+        latency=0,
+        rate=0,
+        ranges=True,
+        drops=0,
+        drop_after=0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        """Initialize mirror.
+
+        Args:
+            root: string, directory holding the tree
+            latency: float, seconds to wait before every answer
+            rate: integer, bytes per second sent over all connections,
+                0 for no limit
+            ranges: boolean, honor Range requests
+            drops: integer, number of responses to cut short
+            drop_after: integer, bytes of a body sent before cutting it
+            host: string, address to listen on
+            port: integer, port to listen on, any free port by default
+        """
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.throttle = TokenBucket(rate)
+        self.ranges = ranges
+        self.drops = drops
+        self.drop_after = drop_after
+        self.requests = []
+        self.isos = {}
+
+        self._lock = threading.Lock()
+        self._server = MirrorServer((host, port), MirrorHandler)
+        self._server.mirror = self
+        self._thread = None
+        self.url = "http://%s:%s" % (host, self._server.server_port)
+
+    def __enter__(self):
+        """Start serving."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop serving."""
+        self.stop()
+
+    def start(self):
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        """Serve on the calling thread until interrupted."""
+        self._server.serve_forever()
+
+    def record(self, command, path, headers):
+        """Remember a request."""
+        with self._lock:
+            self.requests.append((command, path, dict(headers)))
+
+    def take_drop(self):
+        """Return the bytes to send before dropping, or None."""
+        with self._lock:
+            if not self.drops:
+                return None
+            self.drops -= 1
+            return self.drop_after
+
+    def local_path(self, url_path):
+        """Return the file for a URL path, or None if there is none.
+
+        Args:
+            url_path: string, path of the request
+        """
+        relative = os.path.normpath(url_path.split("?", 1)[0].lstrip("/"))
+        path = os.path.join(self.root, relative)
+        if relative.startswith("..") or not os.path.isfile(path):
+            return None
+        return path
+
+    def add_release(self, directory, isos, key=None):
+        """Create a release directory with ISOs and signed hashes.
+
+        Args:
+            directory: string, path below the root, e.g.
+                ubuntu/releases/focal/release
+            isos: dictionary of ISO filename to size in bytes
+            key: SigningKey object to sign SHA256SUMS with, unsigned
+                when None
+
+        Returns:
+            string, URL of the release directory
+
+        """
+        path = os.path.join(self.root, directory)
+        lines = []
+        for filename, size in sorted(isos.items()):
+            digest = make_iso(os.path.join(path, filename), size, filename)
+            self.isos["%s/%s" % (directory, filename)] = digest
+            lines.append("%s *%s\n" % (digest, filename))
+
+        os.makedirs(path, exist_ok=True)
+        sums = "".join(lines).encode("utf-8")
+        with open(os.path.join(path, "SHA256SUMS"), "wb") as hashes:
+            hashes.write(sums)
+        if key:
+            with open(os.path.join(path, "SHA256SUMS.gpg"), "wb") as signature:
+                signature.write(key.sign(sums))
+
+        return "%s/%s" % (self.url, directory)
+
+    def flavor(self, directory, variety="live-server"):
+        """Return a URL class for the ISOs of a release directory.
+
+        Pass it to ISO as the flavor to download from this mirror,
+        SHA256SUMS and signature included.
+
+        Args:
+            directory: string, release directory below the root
+            variety: string, variety of the ISO to pick
+        """
+        base = "%s/%s" % (self.url, directory)
+        return type(
+            "MirrorURL",
+            (URL,),
+            {
+                "name": "Fake Mirror",
+                "flavor": "ubuntu",
+                "variety": variety,
+                "url": property(lambda url: base),
+            },
+        )
+
+
+def main(argv=None):
+    """Generate a release tree and serve it until interrupted."""
+    parser = argparse.ArgumentParser(
+        "tests.fakemirror",
+        description="serve a synthetic cdimage/releases tree for testing",
+    )
+    parser.add_argument("root", help="directory to generate the tree in")
+    parser.add_argument("--port", type=int, default=8000, help="port to serve on")
+    parser.add_argument(
+        "--size", type=parse_rate, default="1G", help="ISO size (default: 1G)"
+    )
+    parser.add_argument(
+        "--release", default="focal", help="release codename (default: focal)"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="seconds before every answer"
+    )
+    parser.add_argument(
+        "--rate", type=parse_rate, default=0, help="bytes per second (e.g. 20M)"
+    )
+    parser.add_argument(
+        "--drops", type=int, default=0, help="number of responses to cut short"
+    )
+    parser.add_argument(
+        "--drop-after",
+        type=parse_rate,
+        default="1M",
+        help="bytes sent before cutting a response short (default: 1M)",
+    )
+    parser.add_argument(
+        "--no-ranges", action="store_true", help="ignore Range requests"
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+
+    os.makedirs(args.root, exist_ok=True)
+    mirror = FakeMirror(
+        args.root,
+        latency=args.latency,
+        rate=args.rate,
+        ranges=not args.no_ranges,
+        drops=args.drops,
+        drop_after=args.drop_after,
+        host="0.0.0.0",
+        port=args.port,
+    )
+    home = os.path.join(mirror.root, ".gnupg")
+    os.makedirs(home, mode=0o700, exist_ok=True)
+    key = SigningKey(home)
+    with open(os.path.join(mirror.root, "keyring.gpg"), "wb") as keyring:
+        keyring.write(key.keyring)
+
+    directory = "ubuntu/releases/%s/release" % args.release
+    isos = {
+        "%s-%s-amd64.iso" % (args.release, variety): args.size
+        for variety in ("live-server", "desktop")
+    }
+    logging.info("Generating %s", directory)
+    mirror.add_release(directory, isos, key)
+
+    logging.info("Serving %s on port %s", mirror.root, args.port)
+    try:
+        mirror.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download import checks, for tests and benchmarks.
+
+Runs code in a fresh interpreter with -X importtime, so what a module
+pulls in and how long that takes can be checked without the modules
+already loaded by the test run.
+"""
+
+import subprocess
+import sys
+
+
+def run_python(code):
+    """Run code in a fresh interpreter with -X importtime.
+
+    Returns:
+        tuple of standard output and the import time report
+
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return result.stdout, result.stderr
+
+
+def import_times(report):
+    """Return the cumulative import time of each module in microseconds."""
+    times = {}
+    for line in report.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times
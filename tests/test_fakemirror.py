@@ -0,0 +1,154 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test fakemirror module."""
+import concurrent.futures
+import hashlib
+import os
+import time
+
+import pytest
+import requests
+
+from ubuntu_iso_download.cache import HashFileCache
+from ubuntu_iso_download.checksums import Checksums
+from ubuntu_iso_download.iso import ISO
+from ubuntu_iso_download.metrics import Metrics
+
+from .fakemirror import MARKER_INTERVAL, FakeMirror, make_iso, release_data
+
+DIRECTORY = "ubuntu/releases/focal/release"
+FILENAME = "ubuntu-20.04.3-live-server-amd64.iso"
+SIZE = 3 * 1024 * 1024 + 17
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    """Run a fake mirror for the duration of a test."""
+    with FakeMirror(str(tmp_path / "mirror")) as mirror:
+        yield mirror
+
+
+def test_make_iso(tmp_path):
+    """ISOs are sparse and differ by seed."""
+    path = str(tmp_path / "x.iso")
+    size = 2 * MARKER_INTERVAL + 5
+    digest = make_iso(path, size, "x")
+
+    assert os.path.getsize(path) == size
+    assert os.stat(path).st_blocks * 512 < size // 100
+    assert digest == hashlib.sha256(open(path, "rb").read()).hexdigest()
+    assert make_iso(str(tmp_path / "y.iso"), size, "y") != digest
+
+
+def test_release(mirror, signing_key):
+    """Releases get ISOs, SHA256SUMS, and a signature."""
+    url = mirror.add_release(DIRECTORY, {FILENAME: SIZE}, signing_key)
+
+    sums = requests.get(url + "/SHA256SUMS").content
+    assert (
+        Checksums.parse(sums).digest(FILENAME)
+        == mirror.isos["%s/%s" % (DIRECTORY, FILENAME)]
+    )
+    assert requests.get(url + "/SHA256SUMS.gpg").ok
+    assert requests.get(url + "/missing.iso").status_code == 404
+    assert requests.get(mirror.url + "/../etc/passwd").status_code == 404
+
+
+def test_ranges(mirror):
+    """Range requests are honored unless turned off."""
+    url = mirror.add_release(DIRECTORY, {FILENAME: SIZE})
+    headers = {"Range": "bytes=10-19"}
+
+    response = requests.get(url + "/" + FILENAME, headers=headers)
+    assert response.status_code == 206
+    assert len(response.content) == 10
+
+    mirror.ranges = False
+    response = requests.get(url + "/" + FILENAME, headers=headers)
+    assert response.status_code == 200
+    assert "Accept-Ranges" not in response.headers
+    assert len(response.content) == SIZE
+
+
+def test_drops(mirror):
+    """Responses are cut short the given number of times."""
+    url = mirror.add_release(DIRECTORY, {FILENAME: SIZE})
+    mirror.drops = 1
+    mirror.drop_after = 1000
+
+    with pytest.raises(requests.RequestException):
+        requests.get(url + "/" + FILENAME).content
+    assert len(requests.get(url + "/" + FILENAME).content) == SIZE
+
+
+def test_throttle_and_latency(mirror):
+    """Latency and throttling slow the answers down."""
+    url = mirror.add_release(DIRECTORY, {FILENAME: SIZE})
+    mirror.latency = 0.2
+    mirror.throttle.set_rate(4 * 1024 * 1024)
+
+    start = time.monotonic()
+    requests.get(url + "/" + FILENAME).content
+    assert time.monotonic() - start >= 0.2 + 0.5
+
+
+def test_iso_download(mirror, signing_key, tmp_path, monkeypatch):
+    """An ISO is found, downloaded, and verified end to end."""
+    mirror.add_release(DIRECTORY, {FILENAME: SIZE}, signing_key)
+    keyring = tmp_path / "snap" / "usr" / "share" / "keyrings"
+    keyring.mkdir(parents=True)
+    (keyring / "ubuntu-archive-keyring.gpg").write_bytes(signing_key.keyring)
+    monkeypatch.setenv("SNAP", str(tmp_path / "snap"))
+    monkeypatch.chdir(tmp_path)
+
+    records = []
+    iso = ISO(
+        mirror.flavor(DIRECTORY),
+        "focal",
+        ubuntu=release_data(),
+        connections=2,
+        metrics=Metrics([records.append]),
+    )
+    local_iso = iso.download()
+
+    assert local_iso == FILENAME
+    digest = hashlib.sha256(open(local_iso, "rb").read()).hexdigest()
+    assert digest == mirror.isos["%s/%s" % (DIRECTORY, FILENAME)]
+
+    phases = {record["phase"]: record for record in records}
+    assert sorted(phases) == ["download", "gpg", "hash"]
+    assert phases["download"]["bytes"] == SIZE
+    assert phases["download"]["release"] == "focal"
+    for name in ("probe", "first_byte", "read", "write", "hash"):
+        assert phases["download"]["%s_seconds" % name] > 0
+
+
+def test_iso_arches(mirror, signing_key, tmp_path, monkeypatch):
+    """ISOs of several arches share one verified hash file."""
+    arches = ["arm64", "ppc64el", "s390x"]
+    filenames = ["ubuntu-20.04.3-live-server-%s.iso" % arch for arch in arches]
+    mirror.add_release(DIRECTORY, dict.fromkeys(filenames, SIZE), signing_key)
+    keyring = tmp_path / "snap" / "usr" / "share" / "keyrings"
+    keyring.mkdir(parents=True)
+    (keyring / "ubuntu-archive-keyring.gpg").write_bytes(signing_key.keyring)
+    monkeypatch.setenv("SNAP", str(tmp_path / "snap"))
+    monkeypatch.chdir(tmp_path)
+
+    hash_files = HashFileCache()
+    isos = [
+        ISO(
+            mirror.flavor(DIRECTORY),
+            "focal",
+            arch=arch,
+            ubuntu=release_data(),
+            hash_files=hash_files,
+            show_progress=False,
+        )
+        for arch in arches
+    ]
+    with concurrent.futures.ThreadPoolExecutor(len(isos)) as executor:
+        local_isos = list(executor.map(lambda iso: iso.download(), isos))
+
+    assert local_isos == filenames
+    paths = [path for _, path, _ in mirror.requests]
+    assert paths.count("/%s/SHA256SUMS" % DIRECTORY) == 1
+    assert paths.count("/%s/SHA256SUMS.gpg" % DIRECTORY) == 1
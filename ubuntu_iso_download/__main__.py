@@ -1,28 +1,234 @@
 # This file is part of ubuntu-iso-download. See LICENSE for license infomation.
-"""Ubuntu ISO Download main module."""
+"""Ubuntu ISO Download main module.
+
+Only what the argument parser and the dry-run lookup need is imported
+up front. requests, python-gnupg, tqdm, PyYAML, and the release data
+are imported on the code paths that download, keeping '--help' and
+'--dry-run' fast for scripts that run the tool many times.
+"""
 
 import argparse
+import functools
+import hashlib
+import json
 import logging
+import os
 import sys
+import time
 
 from . import url
-from .iso import ISO
-
-URLS = {
-    "desktop": url.Desktop,
-    "server": url.Server,
-    "netboot": url.Netboot,
-    "budgie": url.Budgie,
-    "kubuntu": url.Kubuntu,
-    "kylin": url.Kylin,
-    "lubuntu": url.Lubuntu,
-    "mate": url.Mate,
-    "studio": url.Studio,
-    "xubuntu": url.Xubuntu,
-}
+from .cache import HashFileCache
+from .errors import ISOError
+from .gpg import BACKENDS
+from .index import TargetIndex
+from .metrics import Collector, JsonLines, Metrics
+from .ratelimit import Bandwidth, parse_rate
+from .settings import POOL_SIZE, TIMEOUT
+from .store import Store
+
+URLS = url.FLAVORS
+
+DIGESTS = sorted(
+    name for name in hashlib.algorithms_guaranteed if not name.startswith("shake_")
+)
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value):
+    """Parse a size like 500M or 20G into bytes.
+
+    Args:
+        value: string, number with an optional K, M, G, or T suffix
+
+    Returns:
+        integer, number of bytes
+
+    """
+    value = value.strip().upper().rstrip("B")
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ""
+    try:
+        return int(float(value[: len(value) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: '%s'" % value)
+
+
+def parse_rate_argument(value):
+    """Parse a rate like 50M into bytes per second for argparse.
+
+    Args:
+        value: string, number with an optional K, M, or G suffix
 
+    Returns:
+        integer, bytes per second
 
-def parse_args():
+    """
+    try:
+        return parse_rate(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def parse_priority(value):
+    """Parse a 'flavor=weight' priority for argparse.
+
+    Args:
+        value: string, flavor name and weight
+
+    Returns:
+        tuple of flavor name and float weight
+
+    """
+    flavor, _, weight = value.partition("=")
+    try:
+        return flavor, float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid priority: '%s'" % value)
+
+
+def add_download_arguments(parser):
+    """Add the arguments shared by every command that downloads ISOs.
+
+    Args:
+        parser: argparse parser to add to
+    """
+    parser.add_argument(
+        "--debug", action="store_true", help="additional logging output"
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help=(
+            "print the outcome as JSON on standard output, without progress"
+            " bars; only warnings and errors are logged, to standard error"
+        ),
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help="number of parallel connections used to download the ISO",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="retries with backoff of failed requests (default: 3)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=TIMEOUT[1],
+        help="seconds to wait for a server to send data (default: %s)" % TIMEOUT[1],
+    )
+    parser.add_argument(
+        "--limit-rate",
+        type=parse_rate_argument,
+        default=0,
+        metavar="RATE",
+        help="total download rate in bytes per second (e.g. 50M)",
+    )
+    parser.add_argument(
+        "--limit-rate-per-iso",
+        type=parse_rate_argument,
+        default=0,
+        metavar="RATE",
+        help="download rate of each ISO in bytes per second (e.g. 10M)",
+    )
+    parser.add_argument(
+        "--stripe",
+        action="store_true",
+        help="download from every healthy mirror at once instead of the fastest",
+    )
+    parser.add_argument(
+        "--digest",
+        action="append",
+        choices=DIGESTS,
+        default=[],
+        help="also compute and report this digest of the ISO (repeatable)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="append the time and bytes of each download phase as JSON lines",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.getenv("UBUNTU_ISO_CACHE", ""),
+        help=(
+            "shared ISO store; ISOs are kept there by SHA-256 and linked or"
+            " copied to the current directory (default: $UBUNTU_ISO_CACHE)"
+        ),
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=parse_size,
+        default=0,
+        help="evict least recently used ISOs above this size (e.g. 50G)",
+    )
+    parser.add_argument(
+        "--gpg",
+        choices=BACKENDS,
+        default="gnupg",
+        help=(
+            "signature verification backend: gpg with a cached keyring or"
+            " in-process pure Python (default: gnupg)"
+        ),
+    )
+
+
+def iso_options(args):
+    """Return the ISO keyword arguments for parsed download arguments.
+
+    Args:
+        args: parsed arguments from add_download_arguments
+    """
+    store = None
+    if args.cache_dir:
+        store = Store(args.cache_dir, max_size=args.cache_size)
+
+    # one session for every ISO, so a batch shares its connection pool
+    from .session import create_session
+
+    session = create_session(
+        pool_size=max(POOL_SIZE, getattr(args, "jobs", 1) * args.connections),
+        retries=args.retries,
+        timeout=(TIMEOUT[0], args.timeout),
+    )
+
+    return {
+        "connections": args.connections,
+        "stripe": args.stripe,
+        "store": store,
+        "gpg": args.gpg,
+        "session": session,
+        "digests": args.digest,
+        "bandwidth": Bandwidth(args.limit_rate),
+        "rate": args.limit_rate_per_iso,
+        "metrics": Metrics([JsonLines(args.metrics_file)] if args.metrics_file else []),
+        "show_progress": not args.json,
+        "hash_files": HashFileCache(),
+    }
+
+
+def error_result(error):
+    """Return the JSON description of an error.
+
+    Args:
+        error: exception that ended the command
+    """
+    return {
+        "status": "error",
+        "error": {"type": type(error).__name__, "message": str(error)},
+    }
+
+
+def print_json(result):
+    """Print a result as one line of JSON."""
+    print(json.dumps(result, sort_keys=True))
+
+
+def parse_args(argv=None):
     """Set up command-line arguments."""
     parser = argparse.ArgumentParser("ubuntu-iso")
 
@@ -36,54 +242,561 @@ def parse_args():
             " number (e.g. 20.04, 18.04.3) (default: latest LTS release)"
         ),
     )
+    parser.add_argument(
+        "--arch",
+        action="append",
+        choices=url.ARCHES,
+        default=[],
+        help=(
+            "architecture of the ISO (default: amd64); repeat to get"
+            " several architectures concurrently"
+        ),
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         help="do not download and only show link to ISO",
     )
-    parser.add_argument(
-        "--debug", action="store_true", help="additional logging output"
-    )
+    add_download_arguments(parser)
     parser.add_argument(
         "--mirror",
-        default="",
+        action="append",
+        default=[],
         help=(
             "mirror for supported desktop, server, and netboot releases;"
             " for desktop and server see"
             " https://launchpad.net/ubuntu/+cdmirrors and"
-            " https://launchpad.net/ubuntu/+archivemirrors for netboot"
+            " https://launchpad.net/ubuntu/+archivemirrors for netboot;"
+            " repeat to pick the fastest of several mirrors"
+        ),
+    )
+    parser.add_argument(
+        "--seed",
+        help=(
+            "older local copy of the ISO, e.g. yesterday's daily image, to"
+            " update with zsync by fetching only the blocks that changed"
+        ),
+    )
+    parser.add_argument(
+        "--mirror-list",
+        help="file with one candidate mirror URL per line",
+    )
+
+    args = parser.parse_args(argv)
+    args.arch = sorted(set(args.arch), key=args.arch.index) or ["amd64"]
+    if args.seed and len(args.arch) > 1:
+        parser.error("--seed is an older copy of a single --arch")
+
+    return args
+
+
+def parse_batch_args(argv):
+    """Set up command-line arguments of the batch command."""
+    parser = argparse.ArgumentParser(
+        "ubuntu-iso batch",
+        description="download several ISOs concurrently",
+    )
+
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="ISOs as flavor[:release[:arch]] (e.g. server:focal:amd64)",
+    )
+    parser.add_argument(
+        "--manifest", help="YAML list of flavor, release, arch, and mirror entries"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=4, help="maximum concurrent downloads"
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=2,
+        help="maximum concurrent downloads from one host",
+    )
+    parser.add_argument(
+        "--priority",
+        type=parse_priority,
+        action="append",
+        default=[],
+        metavar="FLAVOR=WEIGHT",
+        help=(
+            "share of the --limit-rate bandwidth of a flavor relative to"
+            " the others, which have weight 1 (e.g. server=2)"
         ),
     )
+    add_download_arguments(parser)
+
+    args = parser.parse_args(argv)
+    if not args.targets and not args.manifest:
+        parser.error("give targets or a --manifest")
 
-    return parser.parse_args()
+    return args
 
 
-def setup_logging(debug):
+def setup_logging(debug, json_output=False):
     """Set up logging.
 
+    With JSON output the log goes to standard error, and holds only
+    warnings and errors unless debugging, so standard output carries
+    nothing but the JSON.
+
     Args:
         debug: boolean, if additional logging
+        json_output: boolean, if the results are printed as JSON
     """
+    level = logging.DEBUG if debug else logging.INFO
+    if json_output and not debug:
+        level = logging.WARNING
+
     logging.basicConfig(
-        stream=sys.stdout,
+        stream=sys.stderr if json_output else sys.stdout,
         format="%(message)s",
-        level=logging.DEBUG if debug else logging.INFO,
+        level=level,
+    )
+
+
+def launch_batch(argv):
+    """Launch the batch command.
+
+    Args:
+        argv: list of command-line arguments after 'batch'
+    """
+    args = parse_batch_args(argv)
+    setup_logging(args.debug, args.json)
+
+    from .batch import Batch, Entry, load_manifest
+
+    try:
+        entries = [Entry.parse(target) for target in args.targets]
+        if args.manifest:
+            entries += load_manifest(args.manifest)
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        if args.json:
+            print_json(error_result(error))
+        else:
+            logging.error("Oops: invalid batch targets: %s", error)
+        sys.exit(1)
+
+    batch = Batch(
+        entries,
+        jobs=args.jobs,
+        per_host=args.per_host,
+        priorities=dict(args.priority),
+        **iso_options(args)
     )
+    success = batch.run()
+    if args.json:
+        for entry in batch.entries:
+            print_json(entry.result())
+    else:
+        print(batch.summary())
+
+    if not success:
+        sys.exit(1)
+
+
+def parse_index_args(argv):
+    """Set up command-line arguments of the index command."""
+    parser = argparse.ArgumentParser(
+        "ubuntu-iso index",
+        description=(
+            "resolve every flavor, release, and arch once and cache the"
+            " result for lookups and dry runs without release data"
+        ),
+    )
+
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="show only these flavor[:release[:arch]] targets",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="print the URL and filename of every target, a bulk dry run",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="additional logging output"
+    )
+
+    return parser.parse_args(argv)
+
+
+def launch_index(argv):
+    """Launch the index command.
+
+    Args:
+        argv: list of command-line arguments after 'index'
+    """
+    args = parse_index_args(argv)
+    setup_logging(args.debug)
+
+    from .batch import Entry
+
+    index = TargetIndex()
+    if not (args.list or args.targets) or not index.load():
+        logging.info("Indexed %s targets in %s", index.build(), index.path)
+
+    keys = index.targets()
+    if args.targets:
+        try:
+            keys = [Entry.parse(target) for target in args.targets]
+        except ValueError as error:
+            logging.error("Oops: invalid index targets: %s", error)
+            sys.exit(1)
+    elif not args.list:
+        return
+
+    missing = False
+    for key in keys:
+        flavor, release, arch = str(key).split(":")
+        target = index.lookup(flavor, "" if release == "lts" else release, arch)
+        if target:
+            print("%s  %s/%s" % (key, target["url"], target["filename"]))
+        else:
+            print("%s  not available" % key)
+            missing = True
+
+    if missing:
+        sys.exit(1)
+
+
+def parse_verify_args(argv):
+    """Set up command-line arguments of the verify command."""
+    parser = argparse.ArgumentParser(
+        "ubuntu-iso verify",
+        description=(
+            "check a directory of ISOs against the signed hash files,"
+            " matching each ISO by filename"
+        ),
+    )
+
+    parser.add_argument("directory", help="directory to search for ISOs")
+    parser.add_argument(
+        "--hash-file",
+        action="append",
+        default=[],
+        metavar="URL",
+        help=(
+            "also check against this SHA256SUMS, signed by a SHA256SUMS.gpg"
+            " next to it, e.g. for older point releases (repeatable)"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="ISOs hashed at once (default: one per core)",
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="read with O_DIRECT, bypassing the page cache, where supported",
+    )
+    parser.add_argument(
+        "--drop-cache",
+        action="store_true",
+        help="drop the ISOs from the page cache once read",
+    )
+    parser.add_argument(
+        "--gpg",
+        choices=BACKENDS,
+        default="gnupg",
+        help="signature verification backend (default: gnupg)",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="print one JSON line per ISO"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="additional logging output"
+    )
+
+    return parser.parse_args(argv)
+
+
+def launch_verify(argv):
+    """Launch the verify command.
+
+    Args:
+        argv: list of command-line arguments after 'verify'
+    """
+    args = parse_verify_args(argv)
+    setup_logging(args.debug, args.json)
+
+    from .verify import Library
+
+    library = Library(
+        args.directory,
+        hash_files=args.hash_file,
+        gpg=args.gpg,
+        jobs=args.jobs,
+        direct=args.direct,
+        drop_cache=args.drop_cache,
+    )
+    start = time.monotonic()
+    try:
+        results = library.run()
+    except ISOError as error:
+        if args.json:
+            print_json(error_result(error))
+        else:
+            logging.error("Oops: %s", error)
+        sys.exit(1)
+    seconds = time.monotonic() - start
+
+    for result in results:
+        if args.json:
+            print_json(result)
+        else:
+            print("%-8s  %s" % (result["status"].upper(), result["path"]))
+
+    size = sum(result["size"] for result in results if result["actual"])
+    logging.info(
+        "Hashed %s of %s ISOs, %.1f GiB in %.1fs (%.0f MiB/s)",
+        len([result for result in results if result["actual"]]),
+        len(results),
+        size / 1024**3,
+        seconds,
+        size / 1024**2 / max(seconds, 1e-6),
+    )
+
+    if any(result["status"] in ("mismatch", "error") for result in results):
+        sys.exit(1)
+
+
+def parse_watch_args(argv):
+    """Set up command-line arguments of the watch command."""
+    parser = argparse.ArgumentParser(
+        "ubuntu-iso watch",
+        description=(
+            "keep the newest verified ISO of each target in a directory,"
+            " fetching only what changed"
+        ),
+    )
+
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="ISOs as flavor[:release[:arch]] (e.g. server:focal:amd64)",
+    )
+    parser.add_argument(
+        "--manifest", help="YAML list of flavor, release, arch, and mirror entries"
+    )
+    parser.add_argument(
+        "--directory", default=".", help="directory to keep the ISOs in"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=3600,
+        help="seconds between polls (default: 3600)",
+    )
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=6 * 3600,
+        help=(
+            "seconds a target may take per poll, downloads included, before"
+            " it is given up until the next poll (default: 21600)"
+        ),
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=2,
+        help="maximum concurrent downloads from one host",
+    )
+    parser.add_argument(
+        "--gpg",
+        choices=BACKENDS,
+        default="gnupg",
+        help="signature verification backend (default: gnupg)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="append one JSON line per phase of each ISO to PATH",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="additional logging output"
+    )
+
+    args = parser.parse_args(argv)
+    if not args.targets and not args.manifest:
+        parser.error("give targets or a --manifest")
+
+    return args
+
+
+def launch_watch(argv):
+    """Launch the watch command.
+
+    Args:
+        argv: list of command-line arguments after 'watch'
+    """
+    args = parse_watch_args(argv)
+    setup_logging(args.debug)
+
+    from .batch import Entry, load_manifest
+    from .watch import Watch
+
+    try:
+        entries = [Entry.parse(target) for target in args.targets]
+        if args.manifest:
+            entries += load_manifest(args.manifest)
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        logging.error("Oops: invalid watch targets: %s", error)
+        sys.exit(1)
+
+    watch = Watch(
+        entries,
+        args.directory,
+        interval=args.interval,
+        per_host=args.per_host,
+        timeout=args.timeout,
+        gpg=args.gpg,
+        metrics=Metrics([JsonLines(args.metrics_file)] if args.metrics_file else []),
+    )
+    try:
+        success = watch.run(1 if args.once else None)
+    except KeyboardInterrupt:
+        return
+
+    if not success:
+        sys.exit(1)
+
+
+COMMANDS = {
+    "batch": launch_batch,
+    "index": launch_index,
+    "verify": launch_verify,
+    "watch": launch_watch,
+}
+
+
+def resolve_and_download(args, result, options, position=None):
+    """Resolve, download, and verify one ISO of the main command.
+
+    Args:
+        args: parsed arguments from parse_args
+        result: dictionary with the arch, to add the outcome to
+        options: ISO keyword arguments shared by every arch
+        position: integer, progress bar line when several ISOs download
+            at once
+    """
+    from .iso import ISO
+    from .mirror import read_mirror_list
+
+    mirrors = list(args.mirror)
+    if args.mirror_list:
+        try:
+            mirrors += read_mirror_list(args.mirror_list)
+        except OSError as error:
+            raise ISOError("unable to read mirror list: %s" % error)
+
+    collector = Collector()
+    options = dict(options, metrics=Metrics(options["metrics"].hooks + [collector]))
+    iso = ISO(
+        URLS[args.flavor],
+        args.release,
+        mirror=mirrors,
+        seed=args.seed,
+        arch=result["arch"],
+        **options
+    )
+    iso.position = position
+    result.update(title=str(iso), release=iso.release.codename, url=iso.target.url)
+    if not args.json:
+        print("%s (%s)" % (iso, iso.arch) if position is not None else iso)
+
+    if args.dry_run:
+        if not args.json:
+            print(iso.target.url)
+        return
+
+    filename, target_hash = iso.hash()
+    result.update(filename=filename, sha256=target_hash)
+    try:
+        local_iso = iso.download(filename, target_hash)
+    finally:
+        result["timings"] = collector.seconds()
+
+    result.update(
+        url=iso.target.url,
+        path=local_iso,
+        size=os.path.getsize(local_iso),
+        digests=iso.digests,
+    )
+
+
+def get_arch(args, options, result, position=None):
+    """Run resolve_and_download, turning an error into the result."""
+    try:
+        resolve_and_download(args, result, options, position)
+    except ISOError as error:
+        result.update(error_result(error))
+        if not args.json:
+            logging.error("Oops: %s: %s", result["arch"], error)
 
 
 def launch():
     """Launch ubuntu-iso-download."""
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
     args = parse_args()
-    setup_logging(args.debug)
+    setup_logging(args.debug, args.json)
+    results = [
+        {
+            "status": "ok",
+            "flavor": args.flavor,
+            "release": args.release or "",
+            "arch": arch,
+            "dry_run": args.dry_run,
+        }
+        for arch in args.arch
+    ]
 
-    iso = ISO(URLS[args.flavor], args.release, mirror=args.mirror)
-    print(iso)
+    if args.dry_run and not (args.mirror or args.mirror_list):
+        # resolved from the cached index without any release data
+        index = TargetIndex()
+        targets = [index.lookup(args.flavor, args.release, arch) for arch in args.arch]
+        if all(targets):
+            for result, target in zip(results, targets):
+                if args.json:
+                    print_json(dict(result, **target))
+                elif len(results) > 1:
+                    print("%s (%s)" % (target["title"], result["arch"]))
+                    print(target["url"])
+                else:
+                    print(target["title"])
+                    print(target["url"])
+            sys.exit()
 
-    if args.dry_run:
-        print(iso.target.url)
-        sys.exit()
+    # one session and hash file cache for every arch, downloading at once
+    options = iso_options(args)
+    if len(results) == 1:
+        get_arch(args, options, results[0])
+    else:
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(len(results)) as executor:
+            list(
+                executor.map(
+                    functools.partial(get_arch, args, options),
+                    results,
+                    range(len(results)),
+                )
+            )
+
+    if args.json:
+        for result in results:
+            print_json(result)
 
-    iso.download()
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download asyncio interface.
+
+AsyncISO offers hash(), select_mirror(), download(), and verify() as
+coroutines for use inside an asyncio application. Each one runs the
+matching method of the synchronous ISO in an executor, so the event
+loop never blocks and there is only one download engine: resuming
+partial files, segments over several connections and mirrors, zsync
+updates from a seed, the ISO store, rate limits, extra digests, and the
+retries and timeouts of the session all apply as they do for ISO.
+
+The ISO is not thread-safe, so the calls of one AsyncISO run one at a
+time. A call whose coroutine is cancelled, e.g. by a timeout, keeps
+running in its thread until the next request of the download gives
+up, and later calls wait for it.
+
+    iso = await AsyncISO.create(url.Server, "focal")
+    filename, sha256 = await iso.hash()
+    await iso.download()
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+
+from .iso import ISO
+
+
+class AsyncISO:
+    """Asynchronous interface to an ISO."""
+
+    def __init__(self, iso, executor=None):
+        """Initialize async ISO.
+
+        Args:
+            iso: resolved ISO object
+            executor: concurrent.futures executor to run the ISO in, the
+                default executor of the event loop when None
+        """
+        self._log = logging.getLogger(__name__)
+        self.iso = iso
+        self.executor = executor
+        self.filename = ""
+        self.target_hash = ""
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Return string representation of ISO."""
+        return repr(self.iso)
+
+    @classmethod
+    async def create(cls, flavor, release, executor=None, **options):
+        """Resolve an ISO without blocking the event loop.
+
+        Args:
+            flavor: URL class of the flavor
+            release: string, codename or numeric Ubuntu release value
+            executor: concurrent.futures executor to run the ISO in
+            options: additional keyword arguments for ISO
+
+        Returns:
+            AsyncISO object
+
+        """
+        loop = asyncio.get_event_loop()
+        iso = await loop.run_in_executor(
+            executor, functools.partial(ISO, flavor, release, **options)
+        )
+        return cls(iso, executor)
+
+    async def _blocking(self, function, *args):
+        """Run a method of the ISO in the executor, one at a time."""
+
+        def call():
+            with self._lock:
+                return function(*args)
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, call)
+
+    async def hash(self):
+        """Download and verify the hash for the ISO.
+
+        The hash file is revalidated on every call, so a long-lived
+        AsyncISO sees a new ISO; while the hash file is unchanged this
+        costs a conditional request and no signature check.
+
+        Returns:
+            tuple of strings, ISO filename and its SHA-256 digest
+
+        """
+        self.filename, self.target_hash = await self._blocking(self.iso.hash, True)
+        return self.filename, self.target_hash
+
+    async def select_mirror(self):
+        """Point the ISO at the fastest mirror that has it.
+
+        Returns:
+            URL object the ISO is downloaded from
+
+        """
+        if not self.target_hash:
+            await self.hash()
+
+        return await self._blocking(self.iso.select_mirror, self.filename)
+
+    async def download(self, destination=None, seed=None):
+        """Download the ISO and verify it, see ISO.download().
+
+        Args:
+            destination: string, path to save to instead of the local
+                ISO filename
+            seed: string, path to an older copy of the ISO to update
+                from with zsync; the ISO is downloaded in full if that
+                is not possible
+
+        Returns:
+            string, path to the verified local ISO
+
+        """
+        if not self.target_hash:
+            await self.hash()
+
+        return await self._blocking(
+            self.iso.download, self.filename, self.target_hash, destination, seed
+        )
+
+    async def verify(self, filename=None):
+        """Return whether a local file matches the signed hash.
+
+        Args:
+            filename: string, path to the file, the local ISO by default
+        """
+        if not self.target_hash:
+            await self.hash()
+
+        filename = filename or self.iso.local_filename(self.filename)
+        return await self._blocking(self.iso.is_verified, filename, self.target_hash)
@@ -0,0 +1,321 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download batch mode.
+
+Downloads many flavor, release, and architecture combinations in one
+run. Targets come from the command line ('flavor[:release[:arch]]') or a
+YAML manifest with one entry per ISO:
+
+    - flavor: server
+      release: focal
+      arch: amd64
+      mirror: http://mirror.example.com/ubuntu-releases
+      priority: 2
+      limit_rate: 20M
+
+All entries are resolved and their SHA256SUMS verified concurrently, then
+the ISOs are downloaded with a bounded number of downloads overall and
+per host. The release data is only fetched once for the whole batch, and
+all ISOs share one HTTP session and its connection pool. An entry may
+list several mirrors, in which case the fastest one is picked while
+resolving so the per-host limit applies to it.
+
+With a total rate limit, concurrent downloads share the bandwidth in
+proportion to their priority. An entry can also carry a rate limit of
+its own.
+"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+from .iso import ISO
+from .ratelimit import Bandwidth, parse_rate
+from .session import POOL_SIZE, create_session
+from .url import FLAVORS
+
+
+class Entry:
+    """One ISO of a batch and the outcome of getting it."""
+
+    def __init__(
+        self, flavor, release=None, arch="amd64", mirror="", priority=None, rate=None
+    ):
+        """Initialize entry.
+
+        Args:
+            flavor: string, flavor name
+            release: string, codename or release number, None for LTS
+            arch: string, architecture
+            mirror: string or list of strings, mirror base URLs
+            priority: float, bandwidth weight, None for the batch default
+            rate: integer, bytes per second for this ISO, None for the
+                batch default
+        """
+        if flavor not in FLAVORS:
+            raise ValueError("unknown flavor: %s" % flavor)
+
+        self.flavor = flavor
+        self.release = str(release) if release else None
+        self.arch = arch or "amd64"
+        self.mirror = mirror or ""
+        self.priority = priority
+        self.rate = rate
+
+        self.iso = None
+        self.filename = ""
+        self.target_hash = ""
+        self.local_iso = ""
+        self.status = "pending"
+        self.seconds = 0.0
+        self.error = None
+
+    def __repr__(self):
+        """Return string representation of entry."""
+        return "%s:%s:%s" % (self.flavor, self.release or "lts", self.arch)
+
+    @classmethod
+    def parse(cls, target):
+        """Create an entry from 'flavor[:release[:arch]]'.
+
+        Args:
+            target: string, target from the command line
+        """
+        return cls(*target.split(":", 2))
+
+    def result(self):
+        """Return the outcome of the entry as a JSON-ready dictionary."""
+        result = {
+            "target": repr(self),
+            "status": self.status,
+            "filename": self.filename,
+            "sha256": self.target_hash,
+            "path": self.local_iso,
+            "seconds": self.seconds,
+        }
+        if self.iso:
+            result["url"] = self.iso.target.url
+        if self.local_iso and os.path.isfile(self.local_iso):
+            result["size"] = os.path.getsize(self.local_iso)
+        if self.error is not None:
+            result["error"] = {
+                "type": type(self.error).__name__,
+                "message": str(self.error),
+            }
+
+        return result
+
+    @property
+    def hosts(self):
+        """Return the hosts the ISO is downloaded from, once selected.
+
+        That is the selected mirror, followed by any mirrors striped
+        across.
+        """
+        targets = [self.iso.target] + list(self.iso.stripes)
+        hosts = [urllib.parse.urlparse(target.url).netloc for target in targets]
+        return sorted(set(hosts), key=hosts.index)
+
+
+def load_manifest(path):
+    """Return the entries of a YAML manifest.
+
+    The manifest is either a list of entries or a mapping with the list
+    under 'isos'.
+
+    Args:
+        path: string, path to the manifest
+    """
+    import yaml
+
+    with open(path, "r") as manifest:
+        data = yaml.safe_load(manifest) or []
+
+    if isinstance(data, dict):
+        data = data.get("isos", [])
+
+    return [
+        Entry(
+            item["flavor"],
+            item.get("release"),
+            item.get("arch", "amd64"),
+            item.get("mirror", ""),
+            item.get("priority"),
+            parse_rate(item["limit_rate"]) if "limit_rate" in item else None,
+        )
+        for item in data
+    ]
+
+
+class Batch:
+    """Resolve and download a list of entries concurrently."""
+
+    def __init__(self, entries, jobs=4, per_host=2, priorities=None, **options):
+        """Initialize batch.
+
+        Args:
+            entries: list of Entry objects
+            jobs: integer, maximum concurrent downloads overall
+            per_host: integer, maximum concurrent downloads per host
+            priorities: dictionary of flavor name to bandwidth weight
+                for entries without a priority of their own
+            options: additional keyword arguments for each ISO
+        """
+        self._log = logging.getLogger(__name__)
+        self.entries = entries
+        self.jobs = max(1, jobs)
+        self.per_host = max(1, per_host)
+        self.priorities = priorities or {}
+        self.options = options
+        self.options.setdefault(
+            "session",
+            create_session(
+                pool_size=max(POOL_SIZE, self.jobs * options.get("connections", 1))
+            ),
+        )
+
+        self.options.setdefault("bandwidth", Bandwidth())
+
+        self._running = {}
+        self._active = 0
+        self._free = threading.Condition()
+
+    def run(self):
+        """Resolve and download all entries.
+
+        Returns:
+            boolean, if every entry succeeded
+
+        """
+        self.resolve()
+        self.download()
+        return all(entry.status == "ok" for entry in self.entries)
+
+    def resolve(self):
+        """Resolve every entry and fetch its verified hash concurrently."""
+        from ubuntu_release_info import data as UbuntuReleaseInfo
+
+        ubuntu = UbuntuReleaseInfo.Data()
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            for entry in self.entries:
+                executor.submit(self._resolve, entry, ubuntu)
+
+    def download(self):
+        """Download every resolved entry.
+
+        An entry only takes one of the jobs once its host has a free
+        slot, so entries waiting on a busy host never keep the jobs from
+        downloading from other hosts.
+        """
+        pending = [entry for entry in self.entries if entry.status == "resolved"]
+        for position, entry in enumerate(pending):
+            entry.iso.position = position
+
+        self._running = {}
+        self._active = 0
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            while pending:
+                entry, hosts = self._next(pending)
+                executor.submit(self._download, entry, hosts)
+
+    def summary(self):
+        """Return a table of the outcome of every entry."""
+        rows = [("TARGET", "STATUS", "SIZE", "TIME", "ISO")]
+        for entry in self.entries:
+            size = ""
+            if entry.local_iso and os.path.isfile(entry.local_iso):
+                size = "%.1f MiB" % (os.path.getsize(entry.local_iso) / 1024**2)
+            rows.append(
+                (
+                    repr(entry),
+                    entry.status,
+                    size,
+                    "%.1fs" % entry.seconds,
+                    entry.local_iso or entry.filename,
+                )
+            )
+
+        widths = [max(len(row[column]) for row in rows) for column in range(5)]
+        return "\n".join(
+            "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+            for row in rows
+        )
+
+    def _next(self, pending):
+        """Wait for a free job and host slots, take them, and return them.
+
+        The mirror of every entry is selected while resolving and kept
+        by ISO.download(), so the slots are taken on the hosts actually
+        downloaded from, striped mirrors included.
+
+        Args:
+            pending: list of entries not started yet, in batch order; the
+                entry returned is removed from it
+
+        Returns:
+            tuple of the entry and the list of hosts it holds a slot on
+
+        """
+        with self._free:
+            while True:
+                if self._active < self.jobs:
+                    for entry in pending:
+                        hosts = entry.hosts
+                        if all(
+                            self._running.get(host, 0) < self.per_host for host in hosts
+                        ):
+                            pending.remove(entry)
+                            self._active += 1
+                            for host in hosts:
+                                self._running[host] = self._running.get(host, 0) + 1
+                            return entry, hosts
+                self._free.wait()
+
+    def _resolve(self, entry, ubuntu):
+        """Create the ISO of an entry and fetch its expected hash."""
+        options = dict(self.options)
+        options["priority"] = entry.priority
+        if entry.priority is None:
+            options["priority"] = self.priorities.get(entry.flavor, 1)
+        if entry.rate is not None:
+            options["rate"] = entry.rate
+
+        try:
+            entry.iso = ISO(
+                FLAVORS[entry.flavor],
+                entry.release,
+                mirror=entry.mirror,
+                arch=entry.arch,
+                ubuntu=ubuntu,
+                **options
+            )
+            entry.filename, entry.target_hash = entry.iso.hash()
+            if entry.target_hash:
+                entry.iso.select_mirror(entry.filename)
+        except Exception as error:
+            self._log.warning("Oops: resolving %s failed: %s", entry, error)
+            entry.status = "failed"
+            entry.error = error
+            return
+
+        entry.status = "resolved" if entry.target_hash else "failed"
+
+    def _download(self, entry, hosts):
+        """Download the ISO of an entry, then free its job and host slots."""
+        start = time.monotonic()
+        try:
+            entry.local_iso = entry.iso.download(entry.filename, entry.target_hash)
+            entry.status = "ok"
+        except Exception as error:
+            self._log.warning("Oops: downloading %s failed: %s", entry, error)
+            entry.status = "failed"
+            entry.error = error
+        finally:
+            with self._free:
+                self._active -= 1
+                for host in hosts:
+                    self._running[host] -= 1
+                self._free.notify()
+        entry.seconds = time.monotonic() - start
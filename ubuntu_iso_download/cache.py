@@ -0,0 +1,333 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download local caches.
+
+Small bits of state that let repeated runs skip work are kept under the
+user's cache directory ($XDG_CACHE_HOME/ubuntu-iso-download, normally
+~/.cache/ubuntu-iso-download).
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .errors import DownloadError
+
+SIGNATURES_KEPT = 256
+
+
+def cache_dir():
+    """Return the cache directory, creating it if needed."""
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    path = os.path.join(base, "ubuntu-iso-download")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def read_json(path, default):
+    """Return the JSON content of path or default if unreadable."""
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def write_bytes(path, data):
+    """Atomically write data to path."""
+    temp = "%s.%s.%s.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(temp, "wb") as file:
+        file.write(data)
+    os.replace(temp, path)
+
+
+def write_json(path, data):
+    """Atomically write data as JSON to path."""
+    write_bytes(path, json.dumps(data).encode("utf-8"))
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive lock on path for a read-modify-write.
+
+    The lock is a flock on a '.lock' file next to path, so it holds
+    between threads as well as processes.
+
+    Args:
+        path: string, file to lock
+    """
+    with open("%s.lock" % path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class VerifiedCache:
+    """SHA-256 digests of local files, keyed on their identity.
+
+    A file is identified by its real path together with its size,
+    modification time, and inode. If any of those change the entry no
+    longer applies and the file has to be hashed again.
+    """
+
+    def __init__(self, path=None):
+        """Initialize cache.
+
+        Args:
+            path: string, location of the cache file
+        """
+        self.path = path or os.path.join(cache_dir(), "verified.json")
+
+    @staticmethod
+    def _identity(filename):
+        """Return the path and stat key of a file."""
+        stat = os.stat(filename)
+        return os.path.realpath(filename), [
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        ]
+
+    def lookup(self, filename):
+        """Return the recorded SHA-256 of an unchanged file.
+
+        Args:
+            filename: string, path to local file
+
+        Returns:
+            string, SHA-256 digest or None if unknown or changed
+
+        """
+        try:
+            path, key = self._identity(filename)
+        except OSError:
+            return None
+
+        entry = read_json(self.path, {}).get(path)
+        if entry and entry.get("key") == key:
+            return entry.get("sha256")
+
+        return None
+
+    def store(self, filename, sha256):
+        """Record the SHA-256 of a file.
+
+        Args:
+            filename: string, path to local file
+            sha256: string, SHA-256 digest of the file
+        """
+        path, key = self._identity(filename)
+        with locked(self.path):
+            entries = {
+                known: entry
+                for known, entry in read_json(self.path, {}).items()
+                if os.path.exists(known)
+            }
+            entries[path] = {"key": key, "sha256": sha256}
+            write_json(self.path, entries)
+
+
+class MetadataCache:
+    """On-disk HTTP cache for small files like SHA256SUMS.
+
+    Each file is stored with the ETag and Last-Modified headers it was
+    served with and revalidated on the next request with If-None-Match
+    and If-Modified-Since. A 304 answer reuses the stored copy, and any
+    other answer that is not a success is an error.
+    """
+
+    def __init__(self, path=None, session=None):
+        """Initialize cache.
+
+        Args:
+            path: string, directory to keep cached files in
+            session: requests Session to fetch with
+        """
+        self._log = logging.getLogger(__name__)
+        if session is None:
+            from .session import get_session
+
+            session = get_session()
+        self.session = session
+        self.path = path or os.path.join(cache_dir(), "metadata")
+        os.makedirs(self.path, exist_ok=True)
+
+    def _paths(self, url):
+        """Return the paths of the cached body and headers of a URL."""
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.path, key)
+        return base, "%s.json" % base
+
+    def conditional_headers(self, url):
+        """Return the request headers to revalidate a cached URL.
+
+        Args:
+            url: string, URL to fetch
+
+        Returns:
+            dictionary, empty when nothing usable is cached
+
+        """
+        body_path, headers_path = self._paths(url)
+        cached = read_json(headers_path, {})
+
+        headers = {}
+        if cached and os.path.isfile(body_path):
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        return headers
+
+    def load(self, url):
+        """Return the cached content of a URL.
+
+        Args:
+            url: string, URL that was fetched
+        """
+        body_path, _ = self._paths(url)
+        with open(body_path, "rb") as body:
+            return body.read()
+
+    def save(self, url, content, headers):
+        """Store the content of a URL if it can be revalidated later.
+
+        Args:
+            url: string, URL that was fetched
+            content: bytes, content of the response
+            headers: mapping, response headers
+        """
+        etag = headers.get("ETag", "")
+        last_modified = headers.get("Last-Modified", "")
+        if not etag and not last_modified:
+            return
+
+        body_path, headers_path = self._paths(url)
+        write_bytes(body_path, content)
+        write_json(
+            headers_path, {"url": url, "etag": etag, "last_modified": last_modified}
+        )
+
+    def get(self, url):
+        """Return the content of a URL, revalidating any cached copy.
+
+        Args:
+            url: string, URL to fetch
+
+        Returns:
+            bytes, content of the URL
+
+        Raises:
+            DownloadError: the server answered with an error
+
+        """
+        headers = self.conditional_headers(url)
+        response = self.session.get(url, headers=headers)
+        if response.status_code == 304 and headers:
+            self._log.debug("Not modified, using cached %s", url)
+            return self.load(url)
+
+        if not response.ok:
+            raise DownloadError("HTTP %s for %s" % (response.status_code, url))
+
+        self.save(url, response.content, response.headers)
+        return response.content
+
+
+class SignatureCache:
+    """Memo of successful GPG verifications.
+
+    A verification is identified by the SHA-256 of the keyring, the
+    signed data, and the detached signature together, so the same
+    inputs never need gpg again. Failures are not remembered.
+
+    The keys are stored with the time they were last used, and only the
+    most recent ones are kept so the file stays small.
+    """
+
+    def __init__(self, path=None, size=SIGNATURES_KEPT):
+        """Initialize cache.
+
+        Args:
+            path: string, location of the cache file
+            size: integer, number of verifications to keep
+        """
+        self.path = path or os.path.join(cache_dir(), "signatures.json")
+        self.size = size
+        self._known = set()
+
+    @staticmethod
+    def key(keyring, data, signature):
+        """Return the memo key for a verification."""
+        return ":".join(
+            hashlib.sha256(value).hexdigest() for value in (keyring, data, signature)
+        )
+
+    def _read(self):
+        """Return the stored keys and their times, {} for an old list."""
+        keys = read_json(self.path, {})
+        return keys if isinstance(keys, dict) else {}
+
+    def __contains__(self, key):
+        """Return whether a verification succeeded before."""
+        if key in self._known:
+            return True
+        if key in self._read():
+            self._known.add(key)
+            return True
+        return False
+
+    def add(self, key):
+        """Remember a successful verification."""
+        self._known.add(key)
+        with locked(self.path):
+            keys = self._read()
+            keys[key] = time.time()
+            while len(keys) > self.size:
+                del keys[min(keys, key=keys.get)]
+            write_json(self.path, keys)
+
+
+class HashFileCache:
+    """In-process memo of verified hash files, shared by ISOs.
+
+    The ISOs of one run often come from the same release directory, such
+    as every port of a server release. Each hash file is fetched and
+    verified by the first ISO to need it while the others wait, then
+    handed to all of them. Failures are not remembered.
+    """
+
+    def __init__(self):
+        """Initialize cache."""
+        self._files = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, fetch):
+        """Return a verified hash file, fetching it once per URL.
+
+        Args:
+            url: string, URL of the hash file
+            fetch: callable taking the URL and returning the verified
+                content, or raising
+
+        Returns:
+            bytes, content of the hash file
+
+        """
+        with self._lock:
+            lock = self._locks.setdefault(url, threading.Lock())
+
+        with lock:
+            if url not in self._files:
+                self._files[url] = fetch(url)
+            return self._files[url]
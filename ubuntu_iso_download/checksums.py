@@ -0,0 +1,222 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download SHA256SUMS index.
+
+A SHA256SUMS file lists every image of a release directory, one per
+line, either as 'digest *filename' (binary mode) or, for the netboot
+images, as 'digest  ./path/filename'. The file is parsed once into an
+index keyed by the variety, architecture, and version encoded in each
+ISO filename:
+
+    ubuntu-20.04.3-live-server-amd64.iso
+    xubuntu-20.04.3-desktop-amd64.iso
+    focal-live-server-amd64.iso          (daily builds, no version)
+    ./netboot/mini.iso                   (variety only)
+
+so a single verified file answers the lookup of every variety and
+architecture in that directory. Parsed files are kept by content, so
+looking up another target in the same file costs nothing.
+"""
+
+import functools
+import os
+import re
+
+VERSIONED = re.compile(
+    r"^(?P<name>.+?)-(?P<version>\d+\.\d+(?:\.\d+)*(?:-beta|-rc)?)"
+    r"-(?P<variety>.+)-(?P<arch>[^-]+)$"
+)
+DAILY = re.compile(r"^(?P<name>[^-]+)-(?P<variety>.+)-(?P<arch>[^-]+)$")
+
+
+def clean_filename(filename):
+    """Return a filename without its '*' or './' prefix."""
+    filename = filename.lstrip("*")
+    while filename.startswith("./"):
+        filename = filename[2:]
+    return filename
+
+
+class Checksum:
+    """One file of a SHA256SUMS file."""
+
+    def __init__(self, digest, filename):
+        """Initialize checksum and parse the filename.
+
+        Args:
+            digest: string, SHA-256 hex digest
+            filename: string, path relative to the hash file, without
+                the '*' or './' prefix
+        """
+        self.digest = digest
+        self.filename = filename
+        self.name = ""
+        self.version = ""
+        self.variety = ""
+        self.arch = None
+        self.position = 0
+
+        stem, extension = os.path.splitext(os.path.basename(filename))
+        if extension != ".iso":
+            return
+
+        match = VERSIONED.match(stem) or DAILY.match(stem)
+        if match:
+            fields = match.groupdict()
+            self.name = fields["name"]
+            self.version = fields.get("version") or ""
+            self.variety = fields["variety"]
+            self.arch = fields["arch"]
+        else:
+            self.variety = stem
+
+    def __repr__(self):
+        """Return string representation of checksum."""
+        return "%s  %s" % (self.digest, self.filename)
+
+    @property
+    def version_key(self):
+        """Return a sort key ordering versions numerically."""
+        release = self.version.split("-")[0]
+        numbers = tuple(int(part) for part in release.split(".") if part)
+        # a final release sorts after its betas and release candidates
+        return numbers, self.version == release
+
+    @property
+    def depth(self):
+        """Return the number of directories in the filename."""
+        return self.filename.count("/")
+
+
+class Checksums:
+    """Indexed content of a SHA256SUMS file."""
+
+    def __init__(self, checksums):
+        """Initialize index.
+
+        Args:
+            checksums: list of Checksum objects
+        """
+        self.checksums = list(checksums)
+        self.files = {checksum.filename: checksum for checksum in self.checksums}
+        self.index = {}
+        for position, checksum in enumerate(self.checksums):
+            checksum.position = position
+            if checksum.variety:
+                key = (checksum.variety, checksum.arch)
+                self.index.setdefault(key, []).append(checksum)
+
+    def __iter__(self):
+        """Iterate over every file in the order of the hash file."""
+        return iter(self.checksums)
+
+    def __len__(self):
+        """Return the number of files."""
+        return len(self.checksums)
+
+    @classmethod
+    def parse(cls, data):
+        """Parse the content of a hash file.
+
+        Lines that are not 'digest filename' pairs are skipped.
+
+        Args:
+            data: bytes or string, content of the hash file
+
+        Returns:
+            Checksums object
+
+        """
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+
+        checksums = []
+        for line in data.splitlines():
+            fields = line.strip().split(None, 1)
+            if len(fields) != 2 or len(fields[0]) != 64:
+                continue
+
+            checksums.append(Checksum(fields[0].lower(), clean_filename(fields[1])))
+
+        return cls(checksums)
+
+    def select(self, variety=None, arch=None, version=None):
+        """Return the ISOs matching a variety, architecture, and version.
+
+        Args:
+            variety: string, e.g. live-server or desktop, None for any
+            arch: string, e.g. amd64, None for any; files without an
+                architecture in their name match every architecture
+            version: string, e.g. 20.04.3, None for any
+
+        Returns:
+            list of Checksum objects
+
+        """
+        if variety is not None and arch is not None:
+            # fast path, a direct lookup in the index
+            candidates = self.index.get((variety, arch), []) + self.index.get(
+                (variety, None), []
+            )
+        else:
+            candidates = [
+                checksum
+                for (key_variety, key_arch), checksums in self.index.items()
+                if variety in (None, key_variety)
+                and (arch is None or key_arch in (None, arch))
+                for checksum in checksums
+            ]
+
+        return [
+            checksum
+            for checksum in candidates
+            if version is None or checksum.version == version
+        ]
+
+    def find(self, variety, arch=None, version=None):
+        """Return the ISO of a variety and architecture.
+
+        When the directory holds several versions, such as a point
+        release next to its predecessor, the latest is returned.
+        Between equal versions the file closest to the top of the
+        directory wins, then the last one listed.
+
+        Args:
+            variety: string, e.g. live-server or desktop
+            arch: string, e.g. amd64
+            version: string, exact version to look for, None for latest
+
+        Returns:
+            Checksum object, or None if there is no such ISO
+
+        """
+        candidates = self.select(variety, arch, version)
+        if not candidates:
+            return None
+
+        return max(
+            candidates,
+            key=lambda checksum: (
+                checksum.version_key,
+                -checksum.depth,
+                checksum.position,
+            ),
+        )
+
+    def digest(self, filename):
+        """Return the SHA-256 of a file listed, or '' if not listed.
+
+        Args:
+            filename: string, path relative to the hash file
+        """
+        checksum = self.files.get(clean_filename(filename))
+        return checksum.digest if checksum else ""
+
+
+@functools.lru_cache(maxsize=32)
+def parse_checksums(data):
+    """Return the parsed index of a hash file, parsing it only once.
+
+    Args:
+        data: bytes, content of the hash file
+    """
+    return Checksums.parse(data)
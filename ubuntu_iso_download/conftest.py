@@ -0,0 +1,127 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Shared test fixtures."""
+import hashlib
+import http.server
+import re
+import shutil
+import socketserver
+import threading
+
+import pytest
+
+from tests.fakemirror import SigningKey
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded HTTP server that ignores clients going away."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """Silence errors from aborted connections."""
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serve in-memory files with optional Range support."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        """Silence request logging."""
+
+    def do_HEAD(self):
+        """Send headers only."""
+        self._send(body=False)
+
+    def do_GET(self):
+        """Send headers and content."""
+        self._send(body=True)
+
+    def _send(self, body):
+        """Send the requested file or byte range."""
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        self.server.clients.add(self.client_address)
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = '"%s"' % hashlib.sha256(content).hexdigest()[:16]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        status = 200
+        start, end = 0, len(content)
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and self.server.ranges:
+            status = 206
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)) + 1, len(content))
+
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header(
+                "Content-Range", "bytes %s-%s/%s" % (start, end - 1, len(content))
+            )
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+
+        if body:
+            self.wfile.write(content[start:end])
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Keep caches out of the user's home directory."""
+    path = tmp_path / "cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(path))
+    return path
+
+
+@pytest.fixture
+def http_server():
+    """Run a local HTTP server for the duration of a test.
+
+    Files are served from the 'files' dictionary on the server, keyed by
+    path, and Range support can be turned off with 'ranges'. The next
+    'failures' requests are answered with a 503 and 'clients' collects
+    the address of every connection.
+    """
+    server = Server(("127.0.0.1", 0), Handler)
+    server.files = {}
+    server.ranges = True
+    server.requests = []
+    server.clients = set()
+    server.failures = 0
+    server.url = "http://127.0.0.1:%s" % server.server_port
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def signing_key(tmp_path_factory):
+    """Return a test signing key, skipping if gpg is not installed."""
+    if not shutil.which("gpg"):
+        pytest.skip("gpg is not installed")
+
+    return SigningKey(str(tmp_path_factory.mktemp("gnupg")))
@@ -0,0 +1,710 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download segmented download engine.
+
+An ISO is either pulled over a single streaming connection or, when the
+server advertises 'Accept-Ranges: bytes', split into segments that are
+fetched over several connections at once with HTTP Range requests. Each
+segment is written straight into a preallocated file at its offset
+without sharing a file position with the other connections.
+
+Data is written to a '.part' file next to the ISO. When the server
+supports ranges a '.part.json' journal records which byte ranges are on
+disk along with the ETag, Last-Modified, and expected SHA-256 of the
+remote ISO, so an interrupted download continues where it stopped. If
+the remote ISO changed in the meantime the partial file is discarded.
+
+Given the URLs of the same ISO on other mirrors, the missing ranges are
+instead striped across all of them at once. Each mirror takes pieces
+from a shared queue, sized so it needs a few seconds for one at its
+measured throughput, so faster mirrors end up doing more of the work.
+Whatever a mirror fails to deliver, because it errored or stalled, goes
+back on the queue for the others, and a mirror that keeps failing is
+dropped.
+
+The SHA-256 digest is built while the data lands: bytes written at the
+current hash offset are hashed immediately and anything that arrived out
+of order is read back once the transfer completes.
+
+Where the time goes is kept in the stats of the download: the HEAD
+probe, the wait for the first response, and the time spent reading from
+the network, writing to disk, hashing, and held back by the rate limit.
+"""
+
+import bisect
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+import urllib3
+
+from .errors import DownloadError
+from .metrics import Timings
+from .output import OutputFile
+from .pipeline import Pipeline
+from .session import get_session
+
+CHUNK_SIZE = 1024 * 1024
+JOURNAL_INTERVAL = 1.0
+
+PIECE_SIZE = 4 * CHUNK_SIZE
+MIN_PIECE_SIZE = CHUNK_SIZE
+MAX_PIECE_SIZE = 64 * CHUNK_SIZE
+PIECE_SECONDS = 4.0
+STALL_TIMEOUT = 30
+MAX_SOURCE_ERRORS = 3
+
+
+class RangeSet:
+    """Sorted, non-overlapping set of byte ranges."""
+
+    def __init__(self, ranges=None):
+        """Initialize from a list of (start, end) pairs, end exclusive."""
+        self.ranges = []
+        for start, end in ranges or []:
+            self.add(start, end)
+
+    def __iter__(self):
+        """Iterate over (start, end) pairs."""
+        return iter(self.ranges)
+
+    def add(self, start, end):
+        """Add a range, merging it with any it touches.
+
+        Args:
+            start: integer, first byte
+            end: integer, end of range, exclusive
+        """
+        if start >= end:
+            return
+
+        merged = []
+        for current in self.ranges:
+            if current[1] < start or current[0] > end:
+                merged.append(current)
+            else:
+                start = min(start, current[0])
+                end = max(end, current[1])
+
+        merged.append((start, end))
+        self.ranges = sorted(merged)
+
+    def missing(self, size):
+        """Return the ranges not yet covered up to size.
+
+        Args:
+            size: integer, total size in bytes
+
+        Returns:
+            list of (start, end) tuples, end exclusive
+
+        """
+        gaps = []
+        offset = 0
+        for start, end in self.ranges:
+            if start > offset:
+                gaps.append((offset, min(start, size)))
+            offset = max(offset, end)
+
+        if offset < size:
+            gaps.append((offset, size))
+
+        return gaps
+
+    @property
+    def prefix(self):
+        """Return the length of the contiguous range from offset zero."""
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1]
+
+        return 0
+
+    @property
+    def total(self):
+        """Return the number of bytes covered."""
+        return sum(end - start for start, end in self.ranges)
+
+
+class Journal:
+    """Sidecar record of a partial download."""
+
+    def __init__(self, path, remote, done=None):
+        """Initialize journal.
+
+        Args:
+            path: string, location of the journal file
+            remote: dictionary, size, etag, last_modified, and sha256
+                of the remote ISO
+            done: RangeSet, byte ranges already on disk
+        """
+        self.path = path
+        self.remote = remote
+        self.done = done or RangeSet()
+        self._saved = 0
+
+    @classmethod
+    def load(cls, path):
+        """Read a journal from disk.
+
+        Args:
+            path: string, location of the journal file
+
+        Returns:
+            Journal object or None if missing or unreadable
+
+        """
+        try:
+            with open(path, "r") as journal:
+                data = json.load(journal)
+            return cls(path, data["remote"], RangeSet(data["done"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def matches(self, remote):
+        """Return whether the journal describes the same remote ISO.
+
+        Any value known on both sides has to be equal; the size always
+        has to be equal.
+
+        Args:
+            remote: dictionary, current remote ISO description
+        """
+        for key, value in remote.items():
+            recorded = self.remote.get(key)
+            if key == "size" or (value and recorded):
+                if value != recorded:
+                    return False
+
+        return True
+
+    def save(self, force=False):
+        """Write the journal, at most once per JOURNAL_INTERVAL.
+
+        Args:
+            force: boolean, write regardless of the interval
+        """
+        now = time.monotonic()
+        if not force and now - self._saved < JOURNAL_INTERVAL:
+            return
+
+        self._saved = now
+        temp = "%s.tmp" % self.path
+        with open(temp, "w") as journal:
+            json.dump({"remote": self.remote, "done": list(self.done)}, journal)
+        os.replace(temp, self.path)
+
+    def remove(self):
+        """Remove the journal from disk."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class StreamHash:
+    """SHA-256, and any extra digests, of a file written out of order."""
+
+    def __init__(self, algorithms=("sha256",)):
+        """Initialize the hash at offset zero.
+
+        Args:
+            algorithms: list of strings, hashlib digest names
+        """
+        self.offset = 0
+        self.algorithms = ["sha256"] + [name for name in algorithms if name != "sha256"]
+        self._hashes = [hashlib.new(name) for name in self.algorithms]
+        self._lock = threading.Lock()
+
+    def update(self, offset, data):
+        """Hash data if it continues exactly where the hash left off.
+
+        Args:
+            offset: integer, file offset the data was written at
+            data: bytes, data written at that offset
+        """
+        with self._lock:
+            if offset == self.offset:
+                for hashed in self._hashes:
+                    hashed.update(data)
+                self.offset += len(data)
+
+    def catch_up(self, output, end):
+        """Hash data already on disk from the current offset to end.
+
+        The data is read through a memory map without copying it.
+
+        Args:
+            output: OutputFile object or string, path to the file
+            end: integer, offset to hash up to, exclusive
+        """
+        with self._lock:
+            if self.offset >= end:
+                return
+
+            if isinstance(output, str):
+                with OutputFile(output) as file:
+                    self._hash_regions(file, end)
+            else:
+                self._hash_regions(output, end)
+
+    def _hash_regions(self, output, end):
+        """Hash the regions of output from the current offset to end."""
+        for view in output.regions(self.offset, end):
+            for hashed in self._hashes:
+                hashed.update(view)
+            self.offset += len(view)
+
+    def hexdigest(self, output, size):
+        """Hash whatever was not seen in order and return the digest.
+
+        Args:
+            output: OutputFile object or string, path to the completed
+                file
+            size: integer, total size of the file
+
+        Returns:
+            SHA256 digest
+
+        """
+        self.catch_up(output, size)
+        return self._hashes[0].hexdigest()
+
+    def hexdigests(self):
+        """Return a dictionary of algorithm name to hex digest."""
+        return {
+            name: hashed.hexdigest()
+            for name, hashed in zip(self.algorithms, self._hashes)
+        }
+
+
+class Source:
+    """A mirror taking part in a striped download."""
+
+    def __init__(self, url):
+        """Initialize source.
+
+        Args:
+            url: string, URL of the ISO on the mirror
+        """
+        self.url = url
+        self.throughput = 0.0
+        self.errors = 0
+
+    @property
+    def alive(self):
+        """Return whether the mirror is still used."""
+        return self.errors < MAX_SOURCE_ERRORS
+
+    def piece_size(self):
+        """Return the size of the next piece to fetch from the mirror."""
+        if not self.throughput:
+            return PIECE_SIZE
+
+        size = int(self.throughput * PIECE_SECONDS)
+        size -= size % CHUNK_SIZE
+        return min(MAX_PIECE_SIZE, max(MIN_PIECE_SIZE, size))
+
+    def record(self, length, seconds):
+        """Fold a completed piece into the measured throughput.
+
+        Args:
+            length: integer, bytes fetched
+            seconds: float, time taken
+        """
+        throughput = length / max(seconds, 1e-6)
+        if self.throughput:
+            throughput = (self.throughput + throughput) / 2
+        self.throughput = throughput
+        self.errors = 0
+
+
+class Download:
+    """Single or multi-connection, resumable download of one ISO."""
+
+    def __init__(
+        self,
+        url,
+        filename,
+        connections=1,
+        progress=None,
+        expected_hash="",
+        mirrors=None,
+        session=None,
+        digests=(),
+        limiter=None,
+    ):
+        """Initialize download.
+
+        Args:
+            url: string, URL of the ISO
+            filename: string, local path to write to
+            connections: integer, number of parallel connections, per
+                mirror when striping
+            progress: callable, factory taking the total size in bytes
+                and returning a tqdm-like object
+            expected_hash: string, SHA-256 from the signed hash file,
+                used to detect a respun ISO when resuming
+            mirrors: list of strings, URLs of the same ISO on other
+                mirrors to stripe the download across
+            session: requests Session to download with
+            digests: list of strings, hashlib names of extra digests to
+                compute along with the SHA-256
+            limiter: object with a consume(bytes) method that sleeps to
+                hold the download to a rate and returns the seconds
+                slept, such as a ratelimit Share
+        """
+        self._log = logging.getLogger(__name__)
+        self.url = url
+        self.filename = filename
+        self.connections = max(1, connections)
+        self.progress_factory = progress
+        self.expected_hash = expected_hash
+        self.mirrors = [mirror for mirror in mirrors or [] if mirror != url]
+        self.session = session or get_session()
+        self.limiter = limiter
+        self.size = 0
+        self.digests = {}
+        self.timings = Timings()
+
+        self.partial = "%s.part" % filename
+        self.journal = None
+
+        self._hash = StreamHash(digests)
+        self._lock = threading.Lock()
+        self._progress = None
+        self._output = None
+        self._stop = threading.Event()
+        self._work = threading.Condition()
+        self._todo = []
+        self._busy = 0
+
+    def run(self):
+        """Download the ISO and return its SHA-256 digest."""
+        remote = self.probe()
+        if remote["size"] and remote["ranges"]:
+            digest = self._run_ranges(remote)
+        else:
+            self._log.debug("Server does not support ranges, using one stream")
+            self._discard()
+            digest = self._run_stream()
+
+        os.replace(self.partial, self.filename)
+        return digest
+
+    @property
+    def stats(self):
+        """Return the bytes received and seconds spent by phase.
+
+        The seconds of reading, writing, and hashing are summed over
+        the connections and threads doing them.
+        """
+        return dict(self.timings.totals)
+
+    def probe(self):
+        """Describe the remote ISO.
+
+        Returns:
+            dictionary with size in bytes (0 if unknown), whether byte
+            ranges are supported, and the ETag and Last-Modified headers
+
+        """
+        with self.timings.timed("probe_seconds"):
+            response = self.session.head(self.url, allow_redirects=True)
+        if not response.ok:
+            return {"size": 0, "ranges": False}
+
+        headers = response.headers
+        return {
+            "size": int(headers.get("Content-Length", 0)),
+            "ranges": headers.get("Accept-Ranges", "").lower() == "bytes",
+            "etag": headers.get("ETag", ""),
+            "last_modified": headers.get("Last-Modified", ""),
+        }
+
+    def segments(self, gaps):
+        """Split missing byte ranges into work for each connection.
+
+        Args:
+            gaps: list of (start, end) tuples still to download
+
+        Returns:
+            list of (start, end) tuples, end exclusive
+
+        """
+        missing = sum(end - start for start, end in gaps)
+        length = max(1, -(-missing // self.connections))
+
+        segments = []
+        for gap_start, gap_end in gaps:
+            for start in range(gap_start, gap_end, length):
+                segments.append((start, min(start + length, gap_end)))
+
+        return segments
+
+    def _discard(self):
+        """Remove any partial file and journal."""
+        Journal(self.partial + ".json", {}).remove()
+        try:
+            os.remove(self.partial)
+        except OSError:
+            pass
+
+    def _open_journal(self, remote):
+        """Load a matching journal or start a new partial file."""
+        description = {
+            "size": remote["size"],
+            "etag": remote["etag"],
+            "last_modified": remote["last_modified"],
+            "sha256": self.expected_hash,
+        }
+
+        journal = Journal.load(self.partial + ".json")
+        if journal and os.path.isfile(self.partial) and journal.matches(description):
+            self._log.info(
+                "Resuming download, %s of %s bytes already present",
+                journal.done.total,
+                remote["size"],
+            )
+            journal.remote = description
+            return journal
+
+        if journal:
+            self._log.info("Remote ISO changed, discarding partial download")
+
+        self._discard()
+        journal = Journal(self.partial + ".json", description)
+        journal.save(force=True)
+        return journal
+
+    def _run_stream(self):
+        """Download over a single streaming connection."""
+        start = time.perf_counter()
+        response = self.session.get(self.url, stream=True)
+        self.timings.setdefault("first_byte_seconds", time.perf_counter() - start)
+        if not response.ok:
+            raise DownloadError("HTTP %s for %s" % (response.status_code, self.url))
+
+        self.size = int(response.headers["Content-Length"])
+        self._start_progress()
+
+        # network reads, disk writes, and each digest on their own thread
+        response.raw.decode_content = True
+        with OutputFile(self.partial, self.size) as output:
+            pipeline = Pipeline(
+                output, algorithms=self._hash.algorithms, timings=self.timings
+            )
+            try:
+                self.digests = pipeline.run(response.raw.readinto, self._received)
+            except urllib3.exceptions.HTTPError as error:
+                raise DownloadError("Download of %s failed: %s" % (self.url, error))
+            finally:
+                self._stop_progress()
+
+        if pipeline.offset != self.size:
+            raise DownloadError("Short read of %s" % self.url)
+
+        return self.digests["sha256"]
+
+    def _run_ranges(self, remote):
+        """Download the missing ranges in parallel into the partial file."""
+        self.size = remote["size"]
+        self.journal = self._open_journal(remote)
+        with OutputFile(self.partial, self.size) as self._output:
+            self._hash.catch_up(self._output, self.journal.done.prefix)
+
+            self._start_progress()
+            self._advance(self.journal.done.total)
+            try:
+                if self.mirrors:
+                    self._stripe()
+                else:
+                    self._split()
+            finally:
+                with self._lock:
+                    self.journal.save(force=True)
+                self._stop_progress()
+
+            with self.timings.timed("hash_seconds"):
+                digest = self._hash.hexdigest(self._output, self.size)
+            self.digests = self._hash.hexdigests()
+
+        self.journal.remove()
+        return digest
+
+    def _split(self):
+        """Fetch the missing ranges in one segment per connection."""
+        segments = self.segments(self.journal.done.missing(self.size))
+        self._log.debug(
+            "Downloading %s segments over %s connections",
+            len(segments),
+            self.connections,
+        )
+        self._wait(self._fetch_segment, [(start, end) for start, end in segments])
+
+    def _stripe(self):
+        """Fetch the missing ranges from all mirrors at once."""
+        sources = [Source(url) for url in [self.url] + self.mirrors]
+        self._todo = self.journal.done.missing(self.size)
+        self._log.debug(
+            "Striping %s bytes across %s mirrors",
+            self.size - self.journal.done.total,
+            len(sources),
+        )
+        self._wait(
+            self._stripe_worker,
+            [(source,) for source in sources for _ in range(self.connections)],
+        )
+
+        if self.journal.done.missing(self.size):
+            raise DownloadError("All mirrors failed for %s" % self.url)
+
+    def _wait(self, function, calls):
+        """Run calls of function in parallel, stopping all on a failure.
+
+        Args:
+            function: callable to run
+            calls: list of argument tuples, one per call
+        """
+        workers = min(len(calls), self.connections * (1 + len(self.mirrors)))
+        with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as executor:
+            futures = [executor.submit(function, *args) for args in calls]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except BaseException:
+                self._stop.set()
+                raise
+
+    def _take(self, size):
+        """Return the next piece of at most size bytes, or None when done.
+
+        Waits while the queue is empty but pieces are still in flight,
+        since a failing piece may come back.
+        """
+        with self._work:
+            while not self._todo and self._busy and not self._stop.is_set():
+                self._work.wait(0.5)
+            if not self._todo or self._stop.is_set():
+                return None
+
+            start, end = self._todo.pop(0)
+            if end - start > size:
+                self._todo.insert(0, (start + size, end))
+                end = start + size
+            self._busy += 1
+            return start, end
+
+    def _stripe_worker(self, source):
+        """Fetch pieces from one mirror until the queue is empty.
+
+        Args:
+            source: Source object of the mirror
+        """
+        while source.alive:
+            piece = self._take(source.piece_size())
+            if not piece:
+                return
+
+            start, end = piece
+            began = time.monotonic()
+            try:
+                self._fetch_segment(start, end, source.url, STALL_TIMEOUT)
+                source.record(end - start, time.monotonic() - began)
+            except (DownloadError, requests.RequestException) as error:
+                if self._stop.is_set():
+                    return
+                self._log.debug("Requeuing %s-%s: %s", start, end - 1, error)
+                with self._lock:
+                    gaps = self.journal.done.missing(end)
+                with self._work:
+                    source.errors += 1
+                    for gap_start, gap_end in gaps:
+                        if gap_end > start:
+                            bisect.insort(self._todo, (max(gap_start, start), gap_end))
+            finally:
+                with self._work:
+                    self._busy -= 1
+                    self._work.notify_all()
+
+        self._log.warning("Dropping mirror %s after repeated errors", source.url)
+
+    def _fetch_segment(self, start, end, url=None, timeout=None):
+        """Fetch one byte range and write it at its offset.
+
+        Args:
+            start: integer, first byte of the segment
+            end: integer, end of the segment, exclusive
+            url: string, mirror to fetch from instead of the ISO URL
+            timeout: float, seconds without data before giving up
+        """
+        url = url or self.url
+        headers = {"Range": "bytes=%s-%s" % (start, end - 1)}
+        validator = self.journal.remote["etag"] or self.journal.remote["last_modified"]
+        if validator and url == self.url:
+            headers["If-Range"] = validator
+
+        began = time.perf_counter()
+        response = self.session.get(url, headers=headers, stream=True, timeout=timeout)
+        self.timings.setdefault("first_byte_seconds", time.perf_counter() - began)
+        if response.status_code != 206:
+            raise DownloadError(
+                "HTTP %s for range %s-%s of %s"
+                % (response.status_code, start, end - 1, url)
+            )
+
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        if total.isdigit() and int(total) != self.size:
+            raise DownloadError("Size mismatch for %s" % url)
+
+        offset = start
+        chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+        for chunk in self.timings.iterate("read_seconds", chunks):
+            if self._stop.is_set():
+                raise DownloadError("Download cancelled")
+
+            remaining = end - offset
+            chunk = chunk[:remaining]
+            with self.timings.timed("write_seconds"):
+                self._output.write(offset, chunk)
+            with self.timings.timed("hash_seconds"):
+                self._hash.update(offset, chunk)
+            self._received(len(chunk))
+            with self._lock:
+                self.journal.done.add(offset, offset + len(chunk))
+                self.journal.save()
+            offset += len(chunk)
+            if offset >= end:
+                break
+
+        if offset != end:
+            raise DownloadError(
+                "Short read for range %s-%s of %s" % (start, end - 1, url)
+            )
+
+    def _start_progress(self):
+        """Create the progress bar, if any."""
+        if self.progress_factory:
+            self._progress = self.progress_factory(self.size)
+
+    def _advance(self, length):
+        """Feed written bytes to the progress bar."""
+        if self._progress:
+            with self._lock:
+                self._progress.update(length)
+
+    def _received(self, length):
+        """Account for bytes received from the network."""
+        self._advance(length)
+        self.timings.add("bytes", length)
+        if self.limiter:
+            self.timings.add("throttle_seconds", self.limiter.consume(length))
+
+    def _stop_progress(self):
+        """Close the progress bar, if any."""
+        if self._progress:
+            self._progress.close()
+            self._progress = None
@@ -0,0 +1,38 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download exceptions.
+
+The library raises these instead of exiting, so it can be driven from
+another program; the command line turns them into an 'Oops' message or
+a JSON status and a non-zero exit code. Catch ISOError for all of them:
+
+    ISOError
+        UnsupportedError    no such flavor, release, and arch combination
+        SignatureError      the hash file signature or key is bad
+        HashNotFoundError   the hash file lists no matching ISO
+        DownloadError       the ISO could not be downloaded
+            HashMismatchError   the downloaded ISO has the wrong hash
+"""
+
+
+class ISOError(Exception):
+    """Base class of the errors raised while getting an ISO."""
+
+
+class UnsupportedError(ISOError):
+    """Raised when a flavor does not exist for a release or arch."""
+
+
+class SignatureError(ISOError):
+    """Raised when the signature of the hash file cannot be verified."""
+
+
+class HashNotFoundError(ISOError):
+    """Raised when the hash file has no entry for the ISO."""
+
+
+class DownloadError(ISOError):
+    """Raised when an ISO cannot be downloaded."""
+
+
+class HashMismatchError(DownloadError):
+    """Raised when a downloaded ISO does not match its signed hash."""
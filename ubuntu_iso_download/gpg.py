@@ -0,0 +1,400 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download GPG signature verification.
+
+Two verifiers check a detached signature against a public keyring:
+
+ * 'gnupg' drives the gpg binary through python-gnupg. The keyring is
+   imported once into a GPG home kept under the cache directory, so later
+   verifications, in this process or the next, only run 'gpg --verify'.
+ * 'python' parses the OpenPGP packets itself and checks RSA signatures
+   in pure Python without forking gpg at all. It only establishes that a
+   signature was made by a key in the keyring; key expiry and revocation
+   are not evaluated.
+
+Verifiers are created once per keyring and backend for each process.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from .cache import cache_dir
+from .errors import SignatureError
+
+BACKENDS = ("gnupg", "python")
+KEYRING = "usr/share/keyrings/ubuntu-archive-keyring.gpg"
+
+# RFC 4880 hash algorithm IDs and their EMSA-PKCS1-v1_5 DigestInfo prefix
+HASHES = {
+    2: ("sha1", bytes.fromhex("3021300906052b0e03021a05000414")),
+    8: ("sha256", bytes.fromhex("3031300d060960864801650304020105000420")),
+    9: ("sha384", bytes.fromhex("3041300d060960864801650304020205000430")),
+    10: ("sha512", bytes.fromhex("3051300d060960864801650304020305000440")),
+    11: ("sha224", bytes.fromhex("302d300d06096086480165030402040500041c")),
+}
+RSA_ALGORITHMS = (1, 3)
+
+_VERIFIERS = {}
+_LOCK = threading.Lock()
+
+
+class OpenPGPError(Exception):
+    """Raised on malformed OpenPGP data."""
+
+
+def read_keyring():
+    """Return the public keyring with the Ubuntu CD image signing key.
+
+    The keyring is taken from the snap when running as one and from the
+    ubuntu-keyring package otherwise.
+
+    Raises:
+        SignatureError: the keyring is missing
+    """
+    path = os.path.join(os.getenv("SNAP") or "/", KEYRING)
+    if not os.path.isfile(path):
+        raise SignatureError("public GPG key not found at: %s" % path)
+
+    with open(path, "rb") as keyring:
+        return keyring.read()
+
+
+def verify_memoized(backend, keyring, data, signature, memo):
+    """Verify a detached signature unless it was verified before.
+
+    Args:
+        backend: string, 'gnupg' or 'python'
+        keyring: bytes, public keyring
+        data: bytes, signed data
+        signature: bytes, detached signature of data
+        memo: SignatureCache object of successful verifications
+
+    Returns:
+        boolean, if verification succeeds
+
+    """
+    key = memo.key(keyring, data, signature)
+    if key in memo:
+        logging.getLogger(__name__).debug("Using memoized GPG verification")
+        return True
+
+    verified = get_verifier(backend, keyring).verify(data, signature)
+    if verified:
+        memo.add(key)
+
+    return verified
+
+
+def get_verifier(backend, keyring):
+    """Return the process-wide verifier for a backend and keyring.
+
+    Args:
+        backend: string, 'gnupg' or 'python'
+        keyring: bytes, public keyring
+
+    Returns:
+        verifier object with a verify(data, signature) method
+
+    """
+    key = (backend, hashlib.sha256(keyring).hexdigest())
+    with _LOCK:
+        if key not in _VERIFIERS:
+            if backend == "python":
+                _VERIFIERS[key] = PythonVerifier(keyring)
+            elif backend == "gnupg":
+                _VERIFIERS[key] = GnuPGVerifier(keyring)
+            else:
+                raise ValueError("unknown GPG backend: %s" % backend)
+
+        return _VERIFIERS[key]
+
+
+class GnuPGVerifier:
+    """Verify signatures with gpg against a pre-imported keyring."""
+
+    def __init__(self, keyring, home=None):
+        """Initialize verifier, importing the keyring if needed.
+
+        Args:
+            keyring: bytes, public keyring
+            home: string, GPG home to use instead of one in the cache
+        """
+        self._log = logging.getLogger(__name__)
+        digest = hashlib.sha256(keyring).hexdigest()
+        self.home = home or os.path.join(cache_dir(), "gnupg", digest[:16])
+        os.makedirs(self.home, mode=0o700, exist_ok=True)
+
+        # imported here so the python backend never loads python-gnupg
+        import gnupg
+
+        self.gpg = gnupg.GPG(gnupghome=self.home)
+        marker = os.path.join(self.home, "imported")
+        if not os.path.isfile(marker) or open(marker).read() != digest:
+            self._log.debug("Importing keyring into %s", self.home)
+            self.gpg.import_keys(keyring)
+            with open(marker, "w") as imported:
+                imported.write(digest)
+
+    def verify(self, data, signature):
+        """Return whether signature is a valid signature of data.
+
+        Args:
+            data: bytes, signed data
+            signature: bytes, detached signature, armored or binary
+        """
+        with tempfile.NamedTemporaryFile(dir=self.home, suffix=".sig") as sig_file:
+            sig_file.write(signature)
+            sig_file.flush()
+            return bool(self.gpg.verify_data(sig_file.name, data))
+
+
+class PythonVerifier:
+    """Verify RSA signatures against a keyring without running gpg."""
+
+    def __init__(self, keyring):
+        """Initialize verifier by reading the RSA keys of a keyring.
+
+        Args:
+            keyring: bytes, public keyring, armored or binary
+        """
+        self._log = logging.getLogger(__name__)
+        self.keys = {}
+        for tag, body in packets(dearmor(keyring)):
+            if tag in (6, 14):
+                key = parse_public_key(body)
+                if key:
+                    self.keys[key["key_id"]] = key
+
+    def verify(self, data, signature):
+        """Return whether signature is a valid signature of data.
+
+        At least one signature packet has to be made by a key in the
+        keyring and none made by a key in the keyring may be bad.
+
+        Args:
+            data: bytes, signed data
+            signature: bytes, detached signature, armored or binary
+        """
+        good = False
+        try:
+            for tag, body in packets(dearmor(signature)):
+                if tag != 2:
+                    continue
+
+                sig = parse_signature(body)
+                key = self.keys.get(sig["issuer"]) if sig else None
+                if not key:
+                    continue
+
+                if not verify_rsa(key, sig, data):
+                    self._log.debug("Bad signature from %s", sig["issuer"].hex())
+                    return False
+                good = True
+        except OpenPGPError as error:
+            self._log.debug("Unable to parse signature: %s", error)
+            return False
+
+        return good
+
+
+def dearmor(data):
+    """Return the binary content of possibly ASCII-armored data.
+
+    Args:
+        data: bytes, armored or binary OpenPGP data
+    """
+    if not data.lstrip().startswith(b"-----BEGIN PGP"):
+        return data
+
+    body = []
+    headers = True
+    for line in data.decode("ascii", "replace").strip().splitlines()[1:]:
+        line = line.strip()
+        if line.startswith("-----END PGP"):
+            break
+        if headers:
+            headers = bool(line)
+        elif line.startswith("="):
+            break
+        else:
+            body.append(line)
+
+    try:
+        return base64.b64decode("".join(body))
+    except ValueError as error:
+        raise OpenPGPError("invalid armor: %s" % error)
+
+
+def read_int(data, offset, size):
+    """Return the big-endian integer of size bytes at offset."""
+    end = offset + size
+    if end > len(data):
+        raise OpenPGPError("truncated data")
+    return int.from_bytes(data[offset:end], "big")
+
+
+def packets(data):
+    """Yield (tag, body) for each OpenPGP packet in data.
+
+    Args:
+        data: bytes, binary OpenPGP data
+    """
+    offset = 0
+    while offset < len(data):
+        header = data[offset]
+        if not header & 0x80:
+            raise OpenPGPError("invalid packet header at %s" % offset)
+
+        if header & 0x40:
+            tag = header & 0x3F
+            first = read_int(data, offset + 1, 1)
+            if first < 192:
+                length, offset = first, offset + 2
+            elif first < 224:
+                length = ((first - 192) << 8) + read_int(data, offset + 2, 1) + 192
+                offset += 3
+            elif first == 255:
+                length, offset = read_int(data, offset + 2, 4), offset + 6
+            else:
+                raise OpenPGPError("partial body lengths are not supported")
+        else:
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            if length_type == 3:
+                length, offset = len(data) - offset - 1, offset + 1
+            else:
+                size = 1 << length_type
+                length, offset = read_int(data, offset + 1, size), offset + 1 + size
+
+        end = offset + length
+        if end > len(data):
+            raise OpenPGPError("truncated packet")
+
+        yield tag, data[offset:end]
+        offset = end
+
+
+def read_mpi(data, offset):
+    """Return a multiprecision integer and the offset after it."""
+    bits = read_int(data, offset, 2)
+    size = (bits + 7) // 8
+    return read_int(data, offset + 2, size), offset + 2 + size
+
+
+def parse_public_key(body):
+    """Return the RSA key in a version 4 public (sub)key packet.
+
+    Args:
+        body: bytes, packet body
+
+    Returns:
+        dictionary with fingerprint, key_id, n, and e, or None for keys
+        this verifier cannot use
+
+    """
+    if len(body) < 6 or body[0] != 4 or body[5] not in RSA_ALGORITHMS:
+        return None
+
+    n, offset = read_mpi(body, 6)
+    e, offset = read_mpi(body, offset)
+    fingerprint = hashlib.sha1(
+        b"\x99" + len(body[:offset]).to_bytes(2, "big") + body[:offset]
+    ).digest()
+    return {"fingerprint": fingerprint, "key_id": fingerprint[-8:], "n": n, "e": e}
+
+
+def parse_subpackets(data):
+    """Yield (type, body) for each signature subpacket in data."""
+    offset = 0
+    while offset < len(data):
+        first = data[offset]
+        if first < 192:
+            length, offset = first, offset + 1
+        elif first < 255:
+            length = ((first - 192) << 8) + read_int(data, offset + 1, 1) + 192
+            offset += 2
+        else:
+            length, offset = read_int(data, offset + 1, 4), offset + 5
+
+        end = offset + length
+        if not length or end > len(data):
+            raise OpenPGPError("invalid subpacket")
+
+        kind = data[offset] & 0x7F
+        offset += 1
+        yield kind, data[offset:end]
+        offset = end
+
+
+def parse_signature(body):
+    """Return the parts of a version 4 RSA signature packet.
+
+    Args:
+        body: bytes, packet body
+
+    Returns:
+        dictionary with type, hash, issuer, trailer, left16, and value,
+        or None for signatures this verifier cannot use
+
+    """
+    if len(body) < 6 or body[0] != 4 or body[2] not in RSA_ALGORITHMS:
+        return None
+
+    hashed_end = 6 + read_int(body, 4, 2)
+    unhashed_start = hashed_end + 2
+    unhashed_end = unhashed_start + read_int(body, hashed_end, 2)
+
+    issuer = None
+    subpackets = list(parse_subpackets(body[6:hashed_end]))
+    subpackets += list(parse_subpackets(body[unhashed_start:unhashed_end]))
+    for kind, value in subpackets:
+        if kind == 33 and len(value) == 21:
+            issuer = value[-8:]
+        elif kind == 16 and len(value) == 8 and issuer is None:
+            issuer = value
+
+    left16 = read_int(body, unhashed_end, 2).to_bytes(2, "big")
+    value, _ = read_mpi(body, unhashed_end + 2)
+    return {
+        "type": body[1],
+        "hash": body[3],
+        "issuer": issuer,
+        "trailer": body[:hashed_end],
+        "left16": left16,
+        "value": value,
+    }
+
+
+def verify_rsa(key, sig, data):
+    """Return whether an RSA signature of data is valid for key.
+
+    Args:
+        key: dictionary, parsed public key
+        sig: dictionary, parsed signature
+        data: bytes, signed data
+    """
+    if sig["hash"] not in HASHES or sig["type"] not in (0x00, 0x01):
+        return False
+
+    if sig["type"] == 0x01:
+        data = data.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+
+    name, prefix = HASHES[sig["hash"]]
+    trailer = sig["trailer"]
+    hashed = hashlib.new(name)
+    hashed.update(data)
+    hashed.update(trailer + b"\x04\xff" + len(trailer).to_bytes(4, "big"))
+    digest = hashed.digest()
+    if digest[:2] != sig["left16"] or sig["value"] >= key["n"]:
+        return False
+
+    size = (key["n"].bit_length() + 7) // 8
+    padding = size - len(prefix) - len(digest) - 3
+    if padding < 8:
+        return False
+
+    expected = b"\x00\x01" + b"\xff" * padding + b"\x00" + prefix + digest
+    return pow(sig["value"], key["e"], key["n"]).to_bytes(size, "big") == expected
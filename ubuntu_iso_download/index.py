@@ -0,0 +1,178 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download target index.
+
+Resolving a target normally means downloading and parsing the Ubuntu
+meta-release data and running the per-flavor rules in url.py. The
+index does that once for every flavor, supported release, and
+architecture, and keeps the resulting URL, variety, and expected ISO
+filename in the cache directory. A lookup afterwards is a dictionary
+access, with no release data on the way, which is what dry runs use.
+
+Releases are indexed under their codename, full version, and short
+version (e.g. focal, 20.04.3, and 20.04), and the latest LTS under the
+empty string. The filename is the one cdimage normally uses; the actual
+name is still taken from the signed SHA256SUMS when downloading.
+"""
+
+import copy
+import os
+import time
+
+from . import url
+from .cache import cache_dir, read_json, write_json
+from .errors import UnsupportedError
+
+INDEX_VERSION = 2
+INDEX_TTL = 24 * 3600
+ARCHES = url.ARCHES
+FIELDS = ("title", "url", "variety", "filename")
+
+
+def expected_filename(target):
+    """Return the usual ISO filename of a URL object.
+
+    Args:
+        target: URL object
+    """
+    if target.variety == "mini":
+        return "netboot/mini.iso"
+
+    if target.release.is_dev:
+        return "%s-%s-%s.iso" % (target.release.codename, target.variety, target.arch)
+
+    return "%s-%s-%s-%s.iso" % (
+        target.flavor,
+        target.release.version,
+        target.variety,
+        target.arch,
+    )
+
+
+def build_index(ubuntu=None, arches=ARCHES):
+    """Resolve every flavor, supported release, and architecture.
+
+    Combinations a flavor does not support are left out.
+
+    Args:
+        ubuntu: ubuntu_release_info Data object, fetched by default
+        arches: list of strings, architectures to index
+
+    Returns:
+        dictionary with the release aliases and the resolved targets
+
+    """
+    if ubuntu is None:
+        from ubuntu_release_info import data as UbuntuReleaseInfo
+
+        ubuntu = UbuntuReleaseInfo.Data()
+    releases = {"": ubuntu.lts.codename}
+    targets = {}
+
+    for release in ubuntu.supported:
+        releases[release.codename] = release.codename
+        releases[release.version] = release.codename
+        releases[".".join(release.version.split(".")[:2])] = release.codename
+
+        for flavor, url_class in url.FLAVORS.items():
+            for arch in arches:
+                try:
+                    # flavors may adjust the release, so never share it
+                    target = url_class(copy.copy(release), arch=arch)
+                except UnsupportedError:
+                    continue
+
+                targets["%s:%s:%s" % (flavor, release.codename, arch)] = [
+                    str(target),
+                    target.url,
+                    target.variety,
+                    expected_filename(target),
+                ]
+
+    return {
+        "version": INDEX_VERSION,
+        "time": time.time(),
+        "releases": releases,
+        "targets": targets,
+    }
+
+
+class TargetIndex:
+    """Cached index of resolved flavor, release, and arch targets."""
+
+    def __init__(self, path=None, ttl=INDEX_TTL):
+        """Initialize index.
+
+        Args:
+            path: string, location of the index file
+            ttl: integer, seconds before the index is rebuilt
+        """
+        self.path = path or os.path.join(cache_dir(), "index.json")
+        self.ttl = ttl
+        self.data = None
+
+    def load(self):
+        """Return the cached index, or None if missing or stale."""
+        if self.data is None:
+            data = read_json(self.path, {})
+            if (
+                data.get("version") == INDEX_VERSION
+                and time.time() - data.get("time", 0) < self.ttl
+            ):
+                self.data = data
+
+        return self.data
+
+    def build(self, ubuntu=None):
+        """Rebuild and save the index.
+
+        Args:
+            ubuntu: ubuntu_release_info Data object, fetched by default
+
+        Returns:
+            integer, number of targets indexed
+
+        """
+        self.data = build_index(ubuntu)
+        write_json(self.path, self.data)
+        return len(self.data["targets"])
+
+    def lookup(self, flavor, release=None, arch="amd64"):
+        """Return a resolved target without any release data.
+
+        Args:
+            flavor: string, flavor name
+            release: string, codename or release number, None for LTS
+            arch: string, architecture
+
+        Returns:
+            dictionary with title, url, variety, and filename, or None
+            if the index is missing, stale, or lacks the target
+
+        """
+        data = self.load()
+        if not data:
+            return None
+
+        codename = data["releases"].get(release or "")
+        values = data["targets"].get("%s:%s:%s" % (flavor, codename, arch))
+        if not values:
+            return None
+
+        return dict(zip(FIELDS, values))
+
+    def targets(self):
+        """Return every indexed 'flavor:codename:arch' key, sorted."""
+        data = self.load() or {"targets": {}}
+        return sorted(data["targets"])
+
+    def sources(self):
+        """Return a dictionary of usual ISO filename to its directory URLs.
+
+        Most filenames name a single directory, but some, such as the
+        netboot/mini.iso of every release and arch, are listed in several.
+        """
+        data = self.load() or {"targets": {}}
+        sources = {}
+        for values in data["targets"].values():
+            sources.setdefault(values[3], set()).add(values[1])
+        return {name: sorted(urls) for name, urls in sources.items()}
@@ -12,17 +12,30 @@ ubuntu-keyring package in the Ubuntu archive.
 
 """
 
-import hashlib
+import copy
+import functools
 import logging
 import os
-import sys
-import tempfile
 
-import gnupg
 import requests
-from tqdm import tqdm
 
-from ubuntu_release_info import data as UbuntuReleaseInfo
+from .cache import HashFileCache, MetadataCache, SignatureCache, VerifiedCache
+from .checksums import parse_checksums
+from .download import Download
+from .errors import (
+    DownloadError,
+    HashMismatchError,
+    HashNotFoundError,
+    SignatureError,
+    UnsupportedError,
+)
+from .gpg import read_keyring, verify_memoized
+from .metrics import Metrics
+from .mirror import MirrorRanker
+from .pipeline import file_digests
+from .ratelimit import Bandwidth
+from .session import POOL_SIZE, create_session
+from .zsync import Delta
 
 logging.getLogger("gnupg").setLevel(logging.ERROR)
 logging.getLogger("urllib3").setLevel(logging.ERROR)
@@ -32,134 +45,549 @@ logging.getLogger("requests").setLevel(logging.ERROR)
 class ISO:
     """Base ISO."""
 
-    def __init__(self, flavor, release, mirror=None):
-        """Initialize ISO class."""
+    def __init__(
+        self,
+        flavor,
+        release,
+        mirror=None,
+        connections=1,
+        store=None,
+        gpg="gnupg",
+        arch="amd64",
+        ubuntu=None,
+        stripe=False,
+        session=None,
+        seed=None,
+        digests=(),
+        bandwidth=None,
+        rate=0,
+        priority=1,
+        metrics=None,
+        show_progress=True,
+        hash_files=None,
+    ):
+        """Initialize ISO class.
+
+        Args:
+            flavor: URL class of the flavor
+            release: string, codename or numeric Ubuntu release value
+            mirror: string or list of strings, base URLs of mirrors; with
+                several the fastest one that has the ISO is used
+            connections: integer, parallel connections per download
+            store: Store object to download through
+            gpg: string, signature verification backend
+            arch: string, architecture of the ISO
+            ubuntu: ubuntu_release_info Data object to share between ISOs
+            stripe: boolean, download from all healthy mirrors at once
+                instead of only the fastest
+            session: requests Session to share, a new one by default
+            seed: string, path to an older copy of the ISO to update
+                with zsync instead of downloading it in full
+            digests: list of strings, hashlib names of extra digests to
+                compute and report for the ISO, e.g. sha512 or blake2b
+            bandwidth: Bandwidth object shared with the other downloads
+                of the run, for a total rate limit
+            rate: integer, bytes per second this ISO is downloaded at
+                most, 0 for no limit of its own
+            priority: float, weight of this ISO when the total rate is
+                split between concurrent downloads
+            metrics: Metrics object to report the time and bytes of
+                each phase to, labeled with this ISO
+            show_progress: boolean, draw progress bars while downloading
+            hash_files: HashFileCache object to share verified hash
+                files with the other ISOs of the run, e.g. other arches
+
+        Raises:
+            UnsupportedError: the flavor does not exist for the release
+                or arch
+            SignatureError: the signing key is missing
+        """
         self._log = logging.getLogger(__name__)
-        self.release = self.get_ubuntu_release(release)
-        self.target = flavor(self.release, mirror=mirror)
-        self.ubuntu_cd_public_gpg = self._read_gpg_key()
+        self.connections = connections
+        self.stripe = stripe
+        self.stripes = []
+        self.selected = ""
+        self.seed = seed
+        self.extra_digests = [name for name in digests if name != "sha256"]
+        self.digests = {}
+        self.checksums = None
+        self.bandwidth = bandwidth or Bandwidth()
+        self.rate = rate
+        self.priority = priority
+        self.show_progress = show_progress
+        self.store = store
+        self.gpg = gpg
+        self.position = None
+        self.verified = VerifiedCache()
+        self.mirrors = [mirror] if isinstance(mirror, str) else list(mirror or [])
+        self.mirrors = [mirror for mirror in self.mirrors if mirror]
+        self.session = session or create_session(
+            pool_size=max(POOL_SIZE, connections * (1 + len(self.mirrors)))
+        )
+        self.metadata = MetadataCache(session=self.session)
+        self.signatures = SignatureCache()
+        self.hash_files = hash_files or HashFileCache()
+        self.release = self.get_ubuntu_release(release, ubuntu)
+        self.flavor = flavor
+        self.arch = arch
+        self.canonical = flavor(self.release, arch=arch)
+        self.target = flavor(
+            self.release, arch=arch, mirror=self.mirrors[0] if self.mirrors else ""
+        )
+        self.metrics = (metrics or Metrics()).labeled(
+            flavor=self.target.flavor,
+            variety=self.target.variety,
+            release=self.release.codename,
+            arch=arch,
+        )
+        self.ubuntu_cd_public_gpg = read_keyring()
 
     def __repr__(self):
         """Return string representation of ISO."""
         return str(self.target)
 
-    def _read_gpg_key(self):
-        """Read the public GPG key used for signing CDs."""
-        keyring_path = "usr/share/keyrings/ubuntu-archive-keyring.gpg"
-        if os.getenv("SNAP"):
-            keyring_path = os.path.join(os.getenv("SNAP"), keyring_path)
-        else:
-            keyring_path = os.path.join("/", keyring_path)
+    def hash(self, refresh=False):
+        """Download and verify the hash for the ISO.
 
-        if not os.path.isfile(keyring_path):
-            self._log.error("Oops: public GPG key not found at: %s", keyring_path)
-            sys.exit(1)
+        The hash file and its signature are always taken from the
+        canonical host, never a mirror, and revalidated against the
+        metadata cache rather than downloaded again. ISOs sharing the
+        hash file cache fetch and verify a hash file only once.
 
-        with open(keyring_path, "rb") as keyring:
-            gpg_key = keyring.read()
+        Args:
+            refresh: boolean, revalidate the hash file even if it was
+                fetched earlier in the run, e.g. to poll for a new ISO
 
-        return gpg_key
+        Returns:
+            tuple of strings, ISO filename and its SHA-256 digest
 
-    def hash(self):
-        """Download and verify the hash for the ISO."""
-        hashes = requests.get(self.target.hash_file).content
-        if not self.verify_gpg_signature(hashes, self.target.hash_file_signed):
-            self._log.error("Oops: GPG signature verification failed")
-            sys.exit(1)
+        Raises:
+            SignatureError: the signature of the hash file is bad
+            HashNotFoundError: the hash file does not list the ISO
+            DownloadError: the hash file could not be fetched
 
-        target_hash = ""
-        filename = ""
-        if self.target.variety == "mini":
-            for entry in hashes.decode("utf-8").split("\n"):
-                if "mini.iso" in entry:
-                    target_hash = entry.split("  ")[0]
-                    filename = entry.split("  ")[1].strip("./")
+        """
+        if refresh:
+            hashes = self.fetch_hashes(self.canonical.hash_file)
         else:
-            for entry in hashes.decode("utf-8").split("\n"):
-                # want to pick the latest ISO in the event of multiple releases
-                if self.target.variety in entry and self.target.arch in entry:
-                    target_hash = entry.split(" ")[0]
-                    filename = entry.split(" ")[1].strip("*")
-
+            hashes = self.hash_files.get(self.canonical.hash_file, self.fetch_hashes)
+        filename, target_hash = self.parse_hashes(hashes)
         if not target_hash:
-            self._log.error("Oops: No ISO hash found")
+            raise HashNotFoundError(
+                "No ISO hash found in %s" % self.canonical.hash_file
+            )
 
         return filename, target_hash
 
-    def download(self):
+    def fetch_hashes(self, url):
+        """Download a hash file and verify its signature.
+
+        Args:
+            url: string, URL of the hash file, signed by a '.gpg' file
+                next to it
+
+        Returns:
+            bytes, content of the verified hash file
+
+        Raises:
+            SignatureError: the signature of the hash file is bad
+            DownloadError: the hash file could not be fetched
+
+        """
+        try:
+            with self.metrics.timer("hash") as phase:
+                hashes = self.metadata.get(url)
+                phase["bytes"] = len(hashes)
+                verified = self.verify_gpg_signature(hashes, "%s.gpg" % url)
+        except requests.RequestException as error:
+            raise DownloadError("unable to fetch %s: %s" % (url, error))
+
+        if not verified:
+            raise SignatureError("GPG signature verification failed")
+
+        return hashes
+
+    def parse_hashes(self, hashes):
+        """Find the ISO in the content of a verified hash file.
+
+        The hash file is parsed into an index once and kept on the ISO,
+        and the latest version of the variety and architecture wins.
+
+        Args:
+            hashes: bytes, content of the hash file
+
+        Returns:
+            tuple of strings, ISO filename and its SHA-256 digest
+
+        """
+        self.checksums = parse_checksums(hashes)
+        checksum = self.checksums.find(self.target.variety, self.target.arch)
+        if not checksum:
+            return "", ""
+
+        return checksum.filename, checksum.digest
+
+    def download(self, filename=None, target_hash=None, destination=None, seed=None):
         """Download the ISO, calculate hash, and and verify it.
 
         If the expected hash does not match the local hash the
-        downloaded ISO will be deleted.
+        downloaded ISO will be deleted. An ISO that is already present
+        and matches the expected hash is not downloaded again.
+
+        With a store, the ISO is downloaded into the store once and
+        placed at the local path from there.
+
+        Args:
+            filename: string, ISO filename from an earlier hash() call
+            target_hash: string, expected SHA-256 from that call
+            destination: string, path to save to instead of the local
+                ISO filename
+            seed: string, path to an older copy of the ISO to update
+                from instead of the seed of the ISO
+
+        Returns:
+            string, path to the verified local ISO
+
+        Raises:
+            ISOError: the ISO could not be found, downloaded, or
+                verified
+
         """
-        filename, target_hash = self.hash()
-        local_iso = self.download_iso(self.target, filename)
+        if not target_hash:
+            filename, target_hash = self.hash()
+
+        local_iso = destination or self.local_filename(filename)
+        if self.is_verified(local_iso, target_hash):
+            self._log.info("%s already downloaded and verified", local_iso)
+            return self.report_digests(local_iso)
+
+        self.select_mirror(filename)
+        if self.store:
+            return self.report_digests(
+                self.download_to_store(filename, target_hash, local_iso, seed)
+            )
+
+        local_iso, local_hash = self.download_iso(
+            self.target, filename, target_hash, local_iso, seed
+        )
 
         self._log.debug("Verifying SHA-256")
         self._log.debug(target_hash)
-        if target_hash != self.calc_sha256(local_iso):
-            self._log.error("Oops: SHA-256 hash mismatch!")
+        if target_hash != local_hash:
             self.remove_file(local_iso)
-            sys.exit(1)
+            raise HashMismatchError("SHA-256 hash mismatch for %s" % local_iso)
 
+        self.verified.store(local_iso, local_hash)
         self._log.debug("Download complete and successfully verified")
+        return self.report_digests(local_iso)
+
+    def report_digests(self, local_iso):
+        """Log the extra digests of the local ISO.
+
+        Digests not computed during the download are computed from the
+        file, all in one pass.
+
+        Args:
+            local_iso: string, path to the verified local ISO
+
+        Returns:
+            string, path to the verified local ISO
+
+        """
+        if not self.extra_digests:
+            return local_iso
+
+        if not all(name in self.digests for name in self.extra_digests):
+            self.digests = file_digests(local_iso, ["sha256"] + self.extra_digests)
+
+        for name in self.extra_digests:
+            self._log.info("%s: %s", name.upper(), self.digests[name])
+
+        return local_iso
+
+    def select_mirror(self, filename):
+        """Point the target at the fastest mirror that has the ISO.
+
+        Nothing is probed with fewer than two mirrors. If none of the
+        mirrors has the ISO the canonical host is used. When striping,
+        the other healthy mirrors are kept to download from as well.
+        The mirrors are probed once per filename; later calls, such as
+        the one in download() after a batch picked the mirror, keep the
+        choice.
+
+        Args:
+            filename: string, ISO filename from the hash file
+
+        Returns:
+            URL object the ISO is downloaded from
+
+        """
+        if len(self.mirrors) < 2 or self.selected == filename:
+            return self.target
+
+        targets = {}
+        for mirror in self.mirrors:
+            target = self.flavor(self.release, arch=self.arch, mirror=mirror)
+            targets.setdefault("%s/%s" % (target.url, filename), target)
+
+        ranked = MirrorRanker(session=self.session).rank(list(targets))
+        if ranked:
+            self.target = targets[ranked[0]]
+        else:
+            self._log.warning(
+                "No mirror has %s, using %s", filename, self.canonical.url
+            )
+            self.target = self.canonical
+
+        if self.stripe:
+            self.stripes = [targets[url] for url in ranked[1:]]
+
+        self.selected = filename
+        self._log.debug("Selected mirror %s", self.target.url)
+        return self.target
+
+    def download_to_store(self, filename, target_hash, destination=None, seed=None):
+        """Download the ISO through the store and place it locally.
+
+        The lock of the ISO is held throughout, so other processes
+        wanting the same ISO wait for this download instead of
+        starting their own.
+
+        Args:
+            filename: string, ISO filename from the hash file
+            target_hash: string, expected SHA-256 digest
+            destination: string, path to place the ISO at instead of
+                the local ISO filename
+            seed: string, path to an older copy of the ISO to update
+                from instead of the seed of the ISO
+
+        Returns:
+            string, path to the verified local ISO
+
+        """
+        local_iso = destination or self.local_filename(filename)
+        with self.store.lock(target_hash):
+            if target_hash in self.store:
+                self._log.info("Using %s from the ISO store", local_iso)
+            else:
+                partial = self.store.staging(target_hash)
+                _, local_hash = self.download_iso(
+                    self.target, filename, target_hash, partial, seed
+                )
+                if target_hash != local_hash:
+                    self.remove_file(partial)
+                    raise HashMismatchError("SHA-256 hash mismatch for %s" % local_iso)
+
+                self.store.add(partial, target_hash)
+
+            self.store.materialize(target_hash, local_iso)
+
+        self.verified.store(local_iso, target_hash)
+        self.store.evict(keep=target_hash)
+        return local_iso
+
+    def is_verified(self, filename, target_hash):
+        """Return whether a local file matches the expected hash.
+
+        The digest of a file is cached against its path, size,
+        modification time, and inode so an unchanged file is only
+        hashed once.
+
+        Args:
+            filename: string, path to local file
+            target_hash: string, expected SHA-256 digest
+
+        Returns:
+            boolean, if the file exists and matches
+
+        """
+        if not target_hash or not os.path.isfile(filename):
+            return False
+
+        local_hash = self.verified.lookup(filename)
+        if local_hash is None:
+            self._log.debug("Hashing existing %s", filename)
+            local_hash = self.calc_sha256(filename)
+            self.verified.store(filename, local_hash)
+
+        return local_hash == target_hash
+
+    def local_filename(self, filename):
+        """Return the local filename for an ISO in the hash file.
+
+        Args:
+            filename: string, ISO filename from the hash file
+
+        Returns:
+            string, filename to save the ISO as
+
+        """
+        if self.target.variety == "mini":
+            return "mini.iso"
+
+        return filename
 
     def calc_sha256(self, filename):
         """Calculate SHA256 of a given filename.
 
-        The files can be large so the SHA is calculated in chucks.
+        The files can be large so the SHA is calculated in chucks, read
+        on one thread and hashed on another along with any extra
+        digests. This re-reads the whole file, so it is only used for
+        files already on disk; fresh downloads are hashed as they
+        stream in.
 
         Returns:
             SHA256 digest
 
         """
-        sha256 = hashlib.sha256()
-        with open(filename, "rb") as file:
-            while True:
-                data = file.read(65536)
-                if not data:
-                    break
-                sha256.update(data)
+        with self.metrics.timer("calc_sha256", bytes=os.path.getsize(filename)):
+            self.digests = file_digests(filename, ["sha256"] + self.extra_digests)
+        self._log.debug(self.digests["sha256"])
+        return self.digests["sha256"]
 
-        self._log.debug(sha256.hexdigest())
-        return sha256.hexdigest()
-
-    def download_iso(self, iso, filename):
+    def download_iso(self, iso, filename, target_hash="", destination=None, seed=None):
         """Download the ISO with progress bar.
 
         This uses tqdm to create a progress bar to show the status of
         the download, total time, remaining time, speed, and overall
         percentage done.
 
+        Each chunk is fed to the SHA-256 state as it is written, so the
+        digest is ready as soon as the last byte lands and the ISO does
+        not need to be read back from disk. With more than one
+        connection the ISO is fetched in segments with Range requests,
+        and when striping the segments are spread over every healthy
+        mirror. The download is held to its share of the bandwidth.
+
+        An interrupted download is resumed on the next run unless the
+        remote ISO or its expected hash changed.
+
         Args:
             iso: ISO URL object
+            filename: string, ISO filename from the hash file
+            target_hash: string, expected SHA-256 of the ISO
+            destination: string, path to save to instead of the local
+                ISO filename
+            seed: string, path to an older copy of the ISO to update
+                from instead of the seed of the ISO
 
         Returns:
-            string, ISO filename
+            tuple of strings, ISO filename and its SHA-256 digest
 
         """
+        seed = seed or self.seed
         url = "%s/%s" % (iso.url, filename)
-        if self.target.variety == "mini":
-            filename = "mini.iso"
+        mirrors = ["%s/%s" % (stripe.url, filename) for stripe in self.stripes]
+        filename = destination or self.local_filename(filename)
+
+        with self.bandwidth.share(self.priority, self.rate) as limiter:
+            if seed:
+                digest = self.update_iso(url, filename, target_hash, limiter, seed)
+                if digest:
+                    return filename, digest
+
+            self._log.info("Downloading %s from %s", filename, iso.url)
+            download = Download(
+                url,
+                filename,
+                connections=self.connections,
+                progress=self.progress_factory(filename),
+                expected_hash=target_hash,
+                mirrors=mirrors,
+                session=self.session,
+                digests=self.extra_digests,
+                limiter=limiter,
+            )
+
+            with self.metrics.timer("download", connections=self.connections) as phase:
+                try:
+                    digest = download.run()
+                except requests.RequestException as error:
+                    raise DownloadError("download failed: %s" % error)
+                finally:
+                    phase.update(download.stats)
+
+        self.digests = download.digests
+        self._log.debug(digest)
+        return filename, digest
 
-        self._log.info("Downloading %s from %s", filename, iso.url)
-        response = requests.get(url, stream=True)
-        chunk_size = 1024 * 1024
+    def update_iso(self, url, filename, target_hash, limiter=None, seed=None):
+        """Build the ISO from the seed and the blocks that changed.
+
+        Args:
+            url: string, URL of the ISO
+            filename: string, path to save the ISO to
+            target_hash: string, expected SHA-256 of the ISO
+            limiter: Share object holding the update to its rate
+            seed: string, path to the older copy, the seed of the ISO by
+                default
 
-        progress = tqdm(
-            total=int(response.headers["Content-Length"]), unit="B", unit_scale=True,
+        Returns:
+            string, SHA-256 digest of the ISO, or None if the update was
+            not possible and the ISO has to be downloaded in full
+
+        """
+        seed = seed or self.seed
+        self._log.info("Updating %s from %s", filename, seed)
+        delta = Delta(
+            url,
+            filename,
+            seed,
+            progress=self.progress_factory(filename),
+            session=self.session,
+            limiter=limiter,
         )
 
-        with open(filename, "wb") as file:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                progress.update(len(chunk))
-                file.write(chunk)
+        try:
+            with self.metrics.timer("delta"):
+                digest = delta.run()
+        except (OSError, DownloadError, requests.RequestException) as error:
+            self._log.warning("Delta update failed, downloading in full: %s", error)
+            return None
 
-        progress.close()
+        if target_hash and digest != target_hash:
+            self._log.warning("Delta update hash mismatch, downloading in full")
+            self.remove_file(filename)
+            return None
 
-        return filename
+        return digest
+
+    def progress_factory(self, filename):
+        """Return the progress bar factory for a download, if any.
+
+        Args:
+            filename: string, name of the file being downloaded
+        """
+        if not self.show_progress:
+            return None
+
+        return functools.partial(self.progress, filename=filename)
+
+    def progress(self, size, filename):
+        """Return a progress bar for a download.
+
+        When a position is set, as in batch mode, the bar is drawn on
+        that line and labeled with the filename.
 
-    def get_ubuntu_release(self, release=None):
+        Args:
+            size: integer, total size in bytes
+            filename: string, name of the file being downloaded
+        """
+        from tqdm import tqdm
+
+        if self.position is None:
+            return tqdm(total=size, unit="B", unit_scale=True)
+
+        return tqdm(
+            total=size,
+            unit="B",
+            unit_scale=True,
+            position=self.position,
+            desc=os.path.basename(filename),
+            leave=False,
+        )
+
+    def get_ubuntu_release(self, release=None, ubuntu=None):
         """Return specified Ubuntu release or latest LTS.
 
         This will return the release that aligns with the given codename
@@ -168,29 +596,48 @@ class ISO:
 
         Args:
             release: string, codename or numeric Ubuntu release value
+            ubuntu: ubuntu_release_info Data object to use instead of
+                fetching the release data again
         Returns:
             UbuntuRelease object
 
+        Raises:
+            UnsupportedError: the release is unknown or unsupported
+
         """
-        ubuntu = UbuntuReleaseInfo.Data()
+        if ubuntu is None:
+            from ubuntu_release_info import data as UbuntuReleaseInfo
+
+            ubuntu = UbuntuReleaseInfo.Data()
 
         if not release:
-            return ubuntu.lts
+            return copy.copy(ubuntu.lts)
 
+        # looked up here, as the ubuntu_release_info lookups exit
+        supported = [supported.codename for supported in ubuntu.supported]
         if "." in release:
-            release = ubuntu.by_release(release)
+            matches = [
+                supported
+                for supported in ubuntu.supported
+                if release
+                in (supported.version, ".".join(supported.version.split(".")[:2]))
+            ]
         else:
-            release = ubuntu.by_codename(release)
+            matches = [ubuntu.releases[release]] if release in ubuntu.releases else []
+
+        if not matches:
+            raise UnsupportedError(
+                "unknown release '%s'! Please choose from:\n%s" % (release, supported)
+            )
 
-        if not release.is_supported:
-            self._log.error(
-                "Oops: '%s' is an unsupported release!" " Please choose from:\n%s",
-                release.codename,
-                [release.codename for release in ubuntu.supported],
+        if not matches[0].is_supported:
+            raise UnsupportedError(
+                "'%s' is an unsupported release! Please choose from:\n%s"
+                % (matches[0].codename, supported)
             )
-            sys.exit(1)
 
-        return release
+        # flavors may adjust the release (e.g. Studio), so never share it
+        return copy.copy(matches[0])
 
     @staticmethod
     def remove_file(filename):
@@ -207,11 +654,14 @@ class ISO:
     def verify_gpg_signature(self, data, signature_url):
         """Verify GPG signature of a signed file.
 
-        This will setup a new GPG key entry in a temporary directory to
-        prevent needing to add the key to the user's keyring. The
-        Ubuntu ISO CD singing key will get imported to the keyring.
-        Finally, the signed file's signature will be verified with the
-        unsigned file.
+        This uses a keyring separate from the user's keyring. With the
+        'gnupg' backend the Ubuntu ISO CD singing key is imported once
+        into a GPG home under the cache directory and gpg verifies the
+        signature; the 'python' backend checks the signature in-process
+        without running gpg.
+
+        Successful verifications are memoized on the keyring, data, and
+        signature, so an unchanged hash file does not run gpg again.
 
         The signing key is 0xD94AA3F0EFE21092
 
@@ -223,12 +673,21 @@ class ISO:
             boolean, if verification succeeds
 
         """
-        with tempfile.TemporaryDirectory() as directory_name:
-            gpg = gnupg.GPG(gnupghome=directory_name)
-            gpg.import_keys(self.ubuntu_cd_public_gpg)
+        signature = self.metadata.get(signature_url)
+        with self.metrics.timer("gpg", backend=self.gpg, bytes=len(data)):
+            return self.verify_signature(data, signature)
+
+    def verify_signature(self, data, signature):
+        """Verify a detached GPG signature of data.
+
+        Args:
+            data: bytes, signed data
+            signature: bytes, detached signature of data
 
-            sig_file = os.path.join(directory_name, "signature.gpg")
-            with open(sig_file, "wb") as f:
-                f.write(requests.get(signature_url).content)
+        Return:
+            boolean, if verification succeeds
 
-            return gpg.verify_data(sig_file, data)
+        """
+        return verify_memoized(
+            self.gpg, self.ubuntu_cd_public_gpg, data, signature, self.signatures
+        )
@@ -0,0 +1,205 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download metrics.
+
+Each phase of getting an ISO is timed and reported as one record, a
+flat dictionary such as:
+
+    {"event": "phase", "phase": "download", "ok": true, "seconds": 41.2,
+     "bytes": 1331691520, "connections": 1, "probe_seconds": 0.12,
+     "first_byte_seconds": 0.08, "read_seconds": 40.9, "write_seconds": 1.7,
+     "hash_seconds": 3.1, "flavor": "ubuntu-server", "variety": "live-server",
+     "release": "focal", "arch": "amd64", "time": 1634470000.0}
+
+The phases are 'hash' (fetching and checking SHA256SUMS), 'gpg' (the
+signature check within it), 'download' or 'delta' (getting the ISO),
+and 'calc_sha256' (hashing an ISO already on disk). The download record
+breaks its time down into the HEAD probe, which includes DNS, connect,
+and TLS on a fresh connection, the wait for the first response, and the
+time spent reading from the network, writing to disk, and hashing. The
+read, write, and hash times are busy time summed over threads, so with
+several connections they can add up to more than the wall time.
+
+Records go to hooks, plain callables taking the record, so a service
+can feed them to Prometheus or anything else. JsonLines is a hook that
+appends them to a file, which is what --metrics-file uses, and
+Collector keeps them in memory for the summary of --json. Without
+hooks a timer only reads the clock twice, so the overhead is a few
+microseconds per phase.
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+
+class JsonLines:
+    """Hook that appends each record to a file as a line of JSON."""
+
+    def __init__(self, path):
+        """Initialize hook.
+
+        Args:
+            path: string, file to append to
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        """Append a record."""
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock:
+            with open(self.path, "a") as metrics_file:
+                metrics_file.write(line)
+
+
+class Collector:
+    """Hook that keeps the records in memory, e.g. for a summary."""
+
+    def __init__(self):
+        """Initialize hook."""
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        """Keep a record."""
+        with self._lock:
+            self.records.append(record)
+
+    def seconds(self):
+        """Return a dictionary of phase name to total seconds."""
+        seconds = {}
+        with self._lock:
+            for record in self.records:
+                if record["event"] == "phase":
+                    phase = record["phase"]
+                    seconds[phase] = seconds.get(phase, 0) + record["seconds"]
+        return seconds
+
+
+class Metrics:
+    """Phase timers and counters reported to hooks."""
+
+    def __init__(self, hooks=None, **labels):
+        """Initialize metrics.
+
+        Args:
+            hooks: list of callables, each called with every record
+            labels: fields added to every record, e.g. release
+        """
+        self.hooks = list(hooks or [])
+        self.labels = labels
+
+    def __bool__(self):
+        """Return if anything receives the records."""
+        return bool(self.hooks)
+
+    def add_hook(self, hook):
+        """Send records to another hook.
+
+        Args:
+            hook: callable, called with every record
+        """
+        self.hooks.append(hook)
+
+    def labeled(self, **labels):
+        """Return metrics sending to the same hooks with more labels.
+
+        Args:
+            labels: fields added to every record
+        """
+        child = Metrics(**dict(self.labels, **labels))
+        child.hooks = self.hooks
+        return child
+
+    def emit(self, event, **fields):
+        """Send a record to every hook.
+
+        Args:
+            event: string, kind of record
+            fields: values of the record
+        """
+        if not self.hooks:
+            return
+
+        record = dict(self.labels, event=event, time=time.time())
+        record.update(fields)
+        for hook in self.hooks:
+            hook(record)
+
+    @contextlib.contextmanager
+    def timer(self, phase, **fields):
+        """Time a phase and report it when it ends.
+
+        The context yields a dictionary; values added to it, such as a
+        byte count, become part of the record. A phase ending in an
+        exception is reported with ok set to False.
+
+        Args:
+            phase: string, name of the phase
+            fields: values of the record
+        """
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield fields
+            ok = True
+        finally:
+            self.emit(
+                "phase",
+                phase=phase,
+                seconds=time.perf_counter() - start,
+                ok=ok,
+                **fields
+            )
+
+
+class Timings:
+    """Thread-safe totals of seconds and bytes by name."""
+
+    def __init__(self):
+        """Initialize totals."""
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value):
+        """Add to a total.
+
+        Args:
+            name: string, e.g. read_seconds or bytes
+            value: number to add
+        """
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0) + value
+
+    def setdefault(self, name, value):
+        """Set a value unless it is already set, e.g. the first byte."""
+        with self._lock:
+            self.totals.setdefault(name, value)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """Add the time spent in the block to a total of seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def iterate(self, name, iterable):
+        """Yield from iterable, adding the time spent waiting to a total.
+
+        Args:
+            name: string, total of seconds, e.g. read_seconds
+            iterable: iterable to time, such as a response body
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add(name, time.perf_counter() - start)
+            yield item
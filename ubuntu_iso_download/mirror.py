@@ -0,0 +1,148 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download mirror selection.
+
+Given several mirrors, each is probed with a small ranged GET of the ISO
+itself, which measures the time to the first byte and the throughput
+while also checking that the mirror actually carries the ISO. The probes
+run concurrently and the results are kept on disk for a while so the
+next run can pick a mirror without probing again.
+
+Only the ISO is taken from a mirror. The SHA256SUMS file and its
+signature always come from the canonical Ubuntu host.
+"""
+
+import concurrent.futures
+import logging
+import os
+import time
+
+import requests
+
+from .cache import cache_dir, read_json, write_json
+from .session import get_session
+
+PROBE_SIZE = 256 * 1024
+PROBE_TIMEOUT = 5
+RANKING_TTL = 6 * 3600
+
+
+def read_mirror_list(path):
+    """Return the mirror URLs listed in a file.
+
+    The file has one URL per line. Blank lines and lines starting with
+    '#' are ignored.
+
+    Args:
+        path: string, path to the mirror list
+    """
+    mirrors = []
+    with open(path, "r") as mirror_list:
+        for line in mirror_list:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                mirrors.append(line)
+
+    return mirrors
+
+
+def probe(url, size=PROBE_SIZE, timeout=PROBE_TIMEOUT, session=None):
+    """Measure how fast the start of a file can be fetched.
+
+    Args:
+        url: string, URL of the file
+        size: integer, number of bytes to fetch
+        timeout: float, seconds to wait for the mirror
+        session: requests Session to probe with
+
+    Returns:
+        dictionary with ok, latency in seconds, and throughput in bytes
+        per second
+
+    """
+    result = {"ok": False, "latency": None, "throughput": 0.0}
+    start = time.monotonic()
+    try:
+        response = (session or get_session()).get(
+            url,
+            headers={"Range": "bytes=0-%s" % (size - 1)},
+            stream=True,
+            timeout=timeout,
+        )
+    except requests.RequestException:
+        return result
+
+    with response:
+        first_byte = time.monotonic()
+        if response.status_code not in (200, 206):
+            return result
+
+        received = 0
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                received += len(chunk)
+                if received >= size:
+                    break
+        except requests.RequestException:
+            return result
+
+    elapsed = max(time.monotonic() - first_byte, 1e-6)
+    result.update(
+        ok=received > 0,
+        latency=first_byte - start,
+        throughput=received / elapsed,
+    )
+    return result
+
+
+class MirrorRanker:
+    """Rank mirrors by probing them, remembering results for a while."""
+
+    def __init__(self, path=None, ttl=RANKING_TTL, probe_size=PROBE_SIZE, session=None):
+        """Initialize ranker.
+
+        Args:
+            path: string, location of the rankings file
+            ttl: integer, seconds a probe result is reused
+            probe_size: integer, bytes fetched from each mirror
+            session: requests Session to probe with
+        """
+        self._log = logging.getLogger(__name__)
+        self.path = path or os.path.join(cache_dir(), "mirrors.json")
+        self.ttl = ttl
+        self.probe_size = probe_size
+        self.session = session
+
+    def rank(self, urls):
+        """Return the URLs that can be fetched, fastest first.
+
+        Args:
+            urls: list of strings, the same file on different mirrors
+
+        Returns:
+            list of strings, healthy URLs by descending throughput
+
+        """
+        now = time.time()
+        results = {
+            url: result
+            for url, result in read_json(self.path, {}).items()
+            if now - result.get("time", 0) < self.ttl
+        }
+
+        stale = [url for url in urls if url not in results]
+        if stale:
+            with concurrent.futures.ThreadPoolExecutor(len(stale)) as executor:
+                probes = executor.map(
+                    lambda url: probe(url, self.probe_size, session=self.session), stale
+                )
+                for url, result in zip(stale, probes):
+                    self._log.debug("Probed %s: %s", url, result)
+                    result["time"] = now
+                    results[url] = result
+            write_json(self.path, results)
+
+        healthy = [url for url in urls if results[url]["ok"]]
+        return sorted(
+            healthy,
+            key=lambda url: (-results[url]["throughput"], results[url]["latency"]),
+        )
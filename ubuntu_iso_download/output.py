@@ -0,0 +1,132 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download output files.
+
+A download is written into a file of its final size that is allocated
+up front, with posix_fallocate where the platform and filesystem support
+it, so the ISO is laid out in as few extents as possible no matter in
+which order its segments arrive. Filesystems without fallocate get a
+sparse file of the right size instead.
+
+Writers pass an explicit offset to os.pwrite, so threads writing
+different segments never share or move a file position and need no
+lock. Completed regions are read back through a memory map, handing the
+hash a memoryview of the page cache instead of a copy. Only the region
+being read is mapped, so hashing a multi-GB file does not keep all of it
+resident.
+"""
+
+import contextlib
+import mmap
+import os
+
+READ_SIZE = 16 * 1024 * 1024
+
+
+class OutputFile:
+    """File written at explicit offsets by concurrent writers."""
+
+    def __init__(self, path, size=None, preallocate=True):
+        """Open or create the file.
+
+        Args:
+            path: string, path to the file
+            size: integer, final size in bytes; the file is created and
+                allocated to this size, or opened read-only as is when
+                None
+            preallocate: boolean, reserve the blocks instead of leaving
+                a sparse file
+        """
+        self.path = path
+        flags = os.O_RDONLY if size is None else os.O_RDWR | os.O_CREAT
+        self.fd = os.open(path, flags, 0o644)
+        self.size = os.fstat(self.fd).st_size if size is None else size
+
+        self.preallocated = False
+        if os.fstat(self.fd).st_size != self.size:
+            self.preallocated = self.allocate(preallocate)
+
+    def __enter__(self):
+        """Return the file."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the file."""
+        self.close()
+
+    def allocate(self, preallocate=True):
+        """Size the file, reserving its blocks if possible.
+
+        Args:
+            preallocate: boolean, reserve the blocks instead of leaving
+                a sparse file
+
+        Returns:
+            boolean, if the blocks were reserved
+
+        """
+        os.ftruncate(self.fd, self.size)
+        if not preallocate or not self.size or not hasattr(os, "posix_fallocate"):
+            return False
+
+        try:
+            os.posix_fallocate(self.fd, 0, self.size)
+        except OSError:
+            return False
+
+        return True
+
+    def write(self, offset, data):
+        """Write data at offset without touching the file position.
+
+        Args:
+            offset: integer, file offset to write at
+            data: bytes-like, data to write
+        """
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            offset += written
+            view = view[written:]
+
+    @contextlib.contextmanager
+    def region(self, start, end):
+        """Yield a read-only memoryview of a completed region.
+
+        Args:
+            start: integer, first byte
+            end: integer, end of the region, exclusive
+        """
+        if end <= start:
+            yield memoryview(b"")
+            return
+
+        offset = start - start % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(
+            self.fd, end - offset, access=mmap.ACCESS_READ, offset=offset
+        ) as mapped:
+            skip = start - offset
+            view = memoryview(mapped)[skip:]
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def regions(self, start, end, size=READ_SIZE):
+        """Yield the data between start and end in memoryviews.
+
+        Each view is released once the consumer asks for the next.
+
+        Args:
+            start: integer, first byte
+            end: integer, end of the range, exclusive
+            size: integer, maximum bytes per view
+        """
+        for offset in range(start, min(end, self.size), size):
+            with self.region(offset, min(offset + size, end, self.size)) as view:
+                yield view
+
+    def close(self):
+        """Close the file."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
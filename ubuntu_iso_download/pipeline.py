@@ -0,0 +1,190 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download read, write, and hash pipeline.
+
+A stream is read into a fixed pool of reusable buffers by the calling
+thread. Each filled buffer is handed to a writer thread and to one
+hasher thread per digest algorithm at the same time, and goes back to
+the pool once all of them are done with it. Both pwrite and hashlib
+release the GIL on large buffers, so reading from the network, writing
+to disk, and hashing run on separate cores.
+
+The pool is the only memory used for data: when the disk or a hasher
+falls behind the reader waits for a free buffer, which in turn stops
+reading from the socket. The time each stage spends busy is added up in
+a Timings object, so a slow download shows which stage held it back.
+"""
+
+import hashlib
+import mmap
+import queue
+import threading
+import time
+
+from .metrics import Timings
+
+BUFFER_SIZE = 1024 * 1024
+BUFFER_COUNT = 8
+
+
+class BufferPool:
+    """Fixed set of reusable buffers."""
+
+    def __init__(self, count=BUFFER_COUNT, size=BUFFER_SIZE, aligned=False):
+        """Initialize pool.
+
+        Args:
+            count: integer, number of buffers
+            size: integer, bytes per buffer
+            aligned: boolean, allocate page-aligned buffers, as reads
+                with O_DIRECT need
+        """
+        self.count = count
+        self.size = size
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(mmap.mmap(-1, size) if aligned else bytearray(size))
+
+    def acquire(self):
+        """Return a free buffer, waiting for one if all are in use."""
+        return self._free.get()
+
+    def release(self, buffer):
+        """Return a buffer to the pool."""
+        self._free.put(buffer)
+
+
+class Pipeline:
+    """Write and hash a stream on separate threads."""
+
+    def __init__(
+        self, output=None, offset=0, algorithms=("sha256",), pool=None, timings=None
+    ):
+        """Initialize pipeline.
+
+        Args:
+            output: OutputFile object to write to, None to only hash
+            offset: integer, file offset of the first byte
+            algorithms: list of strings, hashlib digest names
+            pool: BufferPool object to take buffers from
+            timings: Timings object to add the read_seconds,
+                write_seconds, and hash_seconds of the stages to
+        """
+        self.output = output
+        self.offset = offset
+        self.hashes = {name: hashlib.new(name) for name in algorithms}
+        self.pool = pool or BufferPool()
+        self.timings = timings or Timings()
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._error = None
+
+    def run(self, readinto, progress=None):
+        """Read a stream to its end through the pipeline.
+
+        Args:
+            readinto: callable, fills a writable buffer and returns the
+                number of bytes read, 0 at the end of the stream
+            progress: callable, called with the length of each read
+
+        Returns:
+            dictionary of algorithm name to hex digest
+
+        """
+        consumers = [
+            ("hash_seconds", lambda view, offset, hashed=hashed: hashed.update(view))
+            for hashed in self.hashes.values()
+        ]
+        if self.output:
+            consumers.append(("write_seconds", self._write))
+
+        queues = [queue.Queue() for _ in consumers]
+        threads = [
+            threading.Thread(
+                target=self._consume, args=(work_queue,) + consumer, daemon=True
+            )
+            for work_queue, consumer in zip(queues, consumers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while self._error is None:
+                buffer = self.pool.acquire()
+                start = time.perf_counter()
+                length = readinto(memoryview(buffer))
+                self.timings.add("read_seconds", time.perf_counter() - start)
+                if not length:
+                    self.pool.release(buffer)
+                    break
+
+                if queues:
+                    with self._lock:
+                        self._pending[id(buffer)] = len(queues)
+                    for work_queue in queues:
+                        work_queue.put((buffer, self.offset, length))
+                else:
+                    self.pool.release(buffer)
+
+                self.offset += length
+                if progress:
+                    progress(length)
+        finally:
+            for work_queue in queues:
+                work_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return {name: hashed.hexdigest() for name, hashed in self.hashes.items()}
+
+    def _consume(self, work_queue, name, work):
+        """Process buffers from a queue until the end marker."""
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+
+            buffer, offset, length = item
+            view = memoryview(buffer)[:length]
+            try:
+                if self._error is None:
+                    start = time.perf_counter()
+                    work(view, offset)
+                    self.timings.add(name, time.perf_counter() - start)
+            except Exception as error:
+                self._error = error
+            finally:
+                view.release()
+                self._done(buffer)
+
+    def _done(self, buffer):
+        """Release a buffer once every consumer is done with it."""
+        with self._lock:
+            self._pending[id(buffer)] -= 1
+            if self._pending[id(buffer)]:
+                return
+            del self._pending[id(buffer)]
+
+        self.pool.release(buffer)
+
+    def _write(self, view, offset):
+        """Write a buffer at its offset."""
+        self.output.write(offset, view)
+
+
+def file_digests(filename, algorithms=("sha256",)):
+    """Return the digests of a file, hashing each algorithm in parallel.
+
+    Args:
+        filename: string, path to the file
+        algorithms: list of strings, hashlib digest names
+
+    Returns:
+        dictionary of algorithm name to hex digest
+
+    """
+    with open(filename, "rb", buffering=0) as file:
+        return Pipeline(algorithms=algorithms).run(file.readinto)
@@ -0,0 +1,246 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download bandwidth limits.
+
+Bytes are paid for from token buckets that refill at the allowed rate.
+A download takes tokens for every chunk it receives and sleeps when the
+bucket runs dry, which in turn stops reading from the socket and lets
+TCP slow the sender down.
+
+Downloads running at the same time share one Bandwidth object. The
+total rate is split between the active downloads in proportion to their
+priority, and a download with a cap of its own below its share leaves
+the rest to the others. Shares are recomputed whenever a download
+starts or finishes.
+
+The clock and sleep functions are injectable so the limits can be
+tested deterministically.
+"""
+
+import threading
+import time
+
+RATE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_rate(value):
+    """Parse a rate like 50M or 512K into bytes per second.
+
+    Args:
+        value: integer or string, bytes per second with an optional K,
+            M, or G suffix and '/s'
+
+    Returns:
+        integer, bytes per second, 0 for no limit
+
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    value = value.strip().upper()
+    if value.endswith("/S"):
+        value = value[:-2]
+    value = value.rstrip("B")
+    unit = value[-1:] if value[-1:] in RATE_UNITS else ""
+    try:
+        return int(float(value[: len(value) - len(unit)]) * RATE_UNITS[unit])
+    except ValueError:
+        raise ValueError("invalid rate: '%s'" % value)
+
+
+def fair_shares(total, shares):
+    """Split a total rate by weight, respecting individual caps.
+
+    Rate a share cannot use because of its cap is split again between
+    the uncapped shares.
+
+    Args:
+        total: float, bytes per second to split, 0 for unlimited
+        shares: list of (weight, cap) tuples, cap 0 for none
+
+    Returns:
+        list of floats, bytes per second of each share, 0 for unlimited
+
+    """
+    rates = [cap for _, cap in shares]
+    if not total:
+        return rates
+
+    open_shares = list(range(len(shares)))
+    remaining = float(total)
+    while open_shares:
+        weight = sum(shares[index][0] for index in open_shares)
+        capped = [
+            index
+            for index in open_shares
+            if shares[index][1]
+            and shares[index][1] <= remaining * shares[index][0] / weight
+        ]
+        if not capped:
+            for index in open_shares:
+                rates[index] = remaining * shares[index][0] / weight
+            break
+
+        for index in capped:
+            remaining -= shares[index][1]
+            open_shares.remove(index)
+
+    return rates
+
+
+class TokenBucket:
+    """Token bucket rate limiter."""
+
+    def __init__(self, rate=0, burst=None, clock=time.monotonic, sleep=time.sleep):
+        """Initialize bucket.
+
+        Args:
+            rate: float, bytes per second, 0 for no limit
+            burst: float, bytes the bucket holds, one second by default
+            clock: callable, returns monotonic seconds
+            sleep: callable, sleeps for the given seconds
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = 0
+        self.burst = burst
+        self.tokens = 0.0
+        self._time = clock()
+        self._lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Change the rate, keeping the tokens gathered so far.
+
+        Args:
+            rate: float, bytes per second, 0 for no limit
+        """
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.tokens = min(self.tokens, self.capacity)
+
+    @property
+    def capacity(self):
+        """Return the most tokens the bucket holds."""
+        if self.burst is not None:
+            return self.burst
+        return self.rate
+
+    def consume(self, amount):
+        """Take tokens for amount bytes, sleeping until they are paid for.
+
+        A chunk larger than the bucket leaves it in debt, so any chunk
+        size works and the average rate still holds.
+
+        Args:
+            amount: integer, number of bytes
+
+        Returns:
+            float, seconds slept
+
+        """
+        with self._lock:
+            if not self.rate:
+                return 0.0
+
+            self._refill()
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if delay:
+            self.sleep(delay)
+        return delay
+
+    def _refill(self):
+        """Add the tokens gathered since the last refill."""
+        now = self.clock()
+        if self.rate:
+            self.tokens = min(
+                self.tokens + (now - self._time) * self.rate, self.capacity
+            )
+        self._time = now
+
+
+class Share(TokenBucket):
+    """Bucket of one download within a Bandwidth."""
+
+    def __init__(self, bandwidth, weight=1, cap=0):
+        """Initialize share.
+
+        Args:
+            bandwidth: Bandwidth object the share belongs to
+            weight: float, priority relative to the other downloads
+            cap: float, bytes per second this download may use at most,
+                0 for no cap of its own
+        """
+        super().__init__(clock=bandwidth.clock, sleep=bandwidth.sleep)
+        self.bandwidth = bandwidth
+        self.weight = max(weight, 0.001)
+        self.cap = cap
+
+    def __enter__(self):
+        """Return the share."""
+        return self
+
+    def __exit__(self, *args):
+        """Give the share back."""
+        self.close()
+
+    def close(self):
+        """Give the share back to the other downloads."""
+        self.bandwidth.release(self)
+
+
+class Bandwidth:
+    """Total bandwidth split fairly between concurrent downloads."""
+
+    def __init__(self, rate=0, clock=time.monotonic, sleep=time.sleep):
+        """Initialize bandwidth.
+
+        Args:
+            rate: float, total bytes per second, 0 for no limit
+            clock: callable, returns monotonic seconds
+            sleep: callable, sleeps for the given seconds
+        """
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.shares = []
+        self._lock = threading.Lock()
+
+    def share(self, weight=1, cap=0):
+        """Return the share of a download starting now.
+
+        Args:
+            weight: float, priority relative to the other downloads
+            cap: float, bytes per second this download may use at most,
+                0 for no cap of its own
+
+        Returns:
+            Share object, to consume from and close when done
+
+        """
+        share = Share(self, weight, cap)
+        with self._lock:
+            self.shares.append(share)
+            self._rebalance()
+        return share
+
+    def release(self, share):
+        """Remove a finished download and give its rate to the others.
+
+        Args:
+            share: Share object from share()
+        """
+        with self._lock:
+            if share in self.shares:
+                self.shares.remove(share)
+                self._rebalance()
+
+    def _rebalance(self):
+        """Set the rate of every active share."""
+        rates = fair_shares(
+            self.rate, [(share.weight, share.cap) for share in self.shares]
+        )
+        for share, rate in zip(self.shares, rates):
+            share.set_rate(rate)
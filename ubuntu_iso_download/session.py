@@ -0,0 +1,104 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download HTTP sessions.
+
+All HTTP requests go through a requests Session so connections to the
+same host are kept alive and reused, which matters most when many hash
+files are fetched from the same cdimage host. The session retries
+transient failures, such as refused connections or a 503 from a busy
+mirror, with exponential backoff, and applies a default timeout to
+every request that does not set its own.
+
+An ISO creates a session of its own unless given one. In batch mode a
+single session is shared by every ISO, and code without an ISO uses the
+process-wide session from get_session().
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .settings import BACKOFF, POOL_SIZE, RETRIES, RETRY_STATUSES, TIMEOUT
+
+_SESSION = None
+_LOCK = threading.Lock()
+
+
+class TimeoutAdapter(HTTPAdapter):
+    """HTTP adapter with a default timeout."""
+
+    def __init__(self, timeout=TIMEOUT, **kwargs):
+        """Initialize adapter.
+
+        Args:
+            timeout: float or (connect, read) tuple, default timeout in
+                seconds
+            kwargs: additional keyword arguments for HTTPAdapter
+        """
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        """Send a request, applying the default timeout if none is set."""
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def retry_policy(retries=RETRIES, backoff=BACKOFF):
+    """Return the retry policy for idempotent requests.
+
+    Args:
+        retries: integer, number of retries
+        backoff: float, backoff factor in seconds
+    """
+    options = {
+        "total": retries,
+        "backoff_factor": backoff,
+        "status_forcelist": RETRY_STATUSES,
+        "raise_on_status": False,
+    }
+    try:
+        return Retry(allowed_methods=("HEAD", "GET"), **options)
+    except TypeError:
+        # urllib3 before 1.26
+        return Retry(method_whitelist=("HEAD", "GET"), **options)
+
+
+def create_session(
+    pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT
+):
+    """Return a new session with connection pooling and retries.
+
+    Args:
+        pool_size: integer, connections kept open per host
+        retries: integer, retries of failed requests
+        backoff: float, backoff factor between retries in seconds
+        timeout: float or (connect, read) tuple, default timeout in
+            seconds
+
+    Returns:
+        requests Session object
+
+    """
+    adapter = TimeoutAdapter(
+        timeout=timeout,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry_policy(retries, backoff),
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Return the process-wide session, creating it on first use."""
+    global _SESSION
+    with _LOCK:
+        if _SESSION is None:
+            _SESSION = create_session()
+        return _SESSION
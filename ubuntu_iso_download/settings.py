@@ -0,0 +1,13 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download default settings.
+
+Defaults shared by the HTTP session and the command line. They live
+apart from session.py so building the argument parser does not import
+requests.
+"""
+
+POOL_SIZE = 10
+RETRIES = 3
+BACKOFF = 0.5
+TIMEOUT = (10, 60)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
@@ -0,0 +1,208 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download content-addressed ISO store.
+
+A store is a shared directory where ISOs are kept under the SHA-256 from
+the signed SHA256SUMS file. Only verified ISOs are ever added, so an ISO
+found in the store can be placed at the requested path without hashing
+it again. Files are placed with a hardlink when the store and the target
+share a filesystem, a reflink when the filesystem supports copy-on-write
+clones, and a regular copy otherwise.
+
+Several processes may use the same store at once. Each ISO has a lock
+file that is held with flock while it is downloaded, placed, or evicted,
+so concurrent jobs asking for the same ISO wait for a single download.
+When a maximum size is set, the least recently used ISOs are evicted.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import shutil
+import time
+
+FICLONE = 0x40049409
+
+
+class Store:
+    """Content-addressed ISO store."""
+
+    def __init__(self, path, max_size=0):
+        """Initialize store.
+
+        Args:
+            path: string, directory of the store
+            max_size: integer, maximum size in bytes, 0 for unlimited
+        """
+        self._log = logging.getLogger(__name__)
+        self.path = path
+        self.max_size = max_size
+
+        os.makedirs(os.path.join(self.path, "sha256"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "locks"), exist_ok=True)
+
+    def __contains__(self, sha256):
+        """Return whether the store has an ISO."""
+        return os.path.isfile(self.entry(sha256))
+
+    def entry(self, sha256):
+        """Return the path of an ISO in the store.
+
+        Args:
+            sha256: string, SHA-256 digest of the ISO
+        """
+        return os.path.join(self.path, "sha256", sha256[:2], "%s.iso" % sha256)
+
+    def staging(self, sha256):
+        """Return the path to download an ISO to before adding it.
+
+        Partial downloads stay here between runs so they can resume.
+
+        Args:
+            sha256: string, SHA-256 digest of the ISO
+        """
+        entry = self.entry(sha256)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        return "%s.download" % entry
+
+    def entries(self):
+        """Return the digests of all ISOs in the store."""
+        digests = []
+        for root, _, files in os.walk(os.path.join(self.path, "sha256")):
+            for name in files:
+                if name.endswith(".iso"):
+                    digests.append(name[: -len(".iso")])
+
+        return digests
+
+    @contextlib.contextmanager
+    def lock(self, sha256, blocking=True):
+        """Hold the lock of an ISO.
+
+        Args:
+            sha256: string, SHA-256 digest of the ISO
+            blocking: boolean, wait for the lock instead of failing
+
+        Raises:
+            BlockingIOError if not blocking and the lock is held
+
+        """
+        path = os.path.join(self.path, "locks", "%s.lock" % sha256)
+        with open(path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def add(self, filename, sha256):
+        """Move a verified ISO into the store.
+
+        The caller must hold the lock of the ISO.
+
+        Args:
+            filename: string, path to the verified ISO
+            sha256: string, SHA-256 digest of the ISO
+        """
+        entry = self.entry(sha256)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        os.chmod(filename, 0o444)
+        os.replace(filename, entry)
+
+    def materialize(self, sha256, destination):
+        """Place an ISO from the store at destination.
+
+        The caller must hold the lock of the ISO.
+
+        Args:
+            sha256: string, SHA-256 digest of the ISO
+            destination: string, path to place the ISO at
+
+        Returns:
+            string, method used: 'hardlink', 'reflink', or 'copy'
+
+        """
+        entry = self.entry(sha256)
+        self.touch(sha256)
+
+        temp = "%s.%s.tmp" % (destination, os.getpid())
+        try:
+            os.link(entry, temp)
+            method = "hardlink"
+        except OSError:
+            try:
+                self._reflink(entry, temp)
+                method = "reflink"
+            except OSError:
+                shutil.copyfile(entry, temp)
+                method = "copy"
+
+        os.replace(temp, destination)
+        self._log.debug("Placed %s at %s with a %s", sha256, destination, method)
+        return method
+
+    def touch(self, sha256):
+        """Mark an ISO as recently used.
+
+        Only the access time is changed since the modification time is
+        shared with every hardlink of the ISO.
+
+        Args:
+            sha256: string, SHA-256 digest of the ISO
+        """
+        entry = self.entry(sha256)
+        os.utime(entry, (time.time(), os.stat(entry).st_mtime))
+
+    def evict(self, keep=None):
+        """Remove least recently used ISOs until under the maximum size.
+
+        ISOs that another process holds the lock of are skipped.
+
+        Args:
+            keep: string, SHA-256 digest of an ISO never to evict
+
+        Returns:
+            list of evicted digests
+
+        """
+        if not self.max_size:
+            return []
+
+        entries = []
+        for sha256 in self.entries():
+            try:
+                stat = os.stat(self.entry(sha256))
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, sha256))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, sha256 in sorted(entries):
+            if total <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+
+            try:
+                with self.lock(sha256, blocking=False):
+                    os.remove(self.entry(sha256))
+            except (BlockingIOError, FileNotFoundError):
+                continue
+
+            self._log.debug("Evicted %s from the store", sha256)
+            total -= size
+            evicted.append(sha256)
+
+        return evicted
+
+    @staticmethod
+    def _reflink(source, destination):
+        """Clone source to destination with a copy-on-write reflink."""
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except OSError:
+                dst.close()
+                os.remove(destination)
+                raise
@@ -0,0 +1,137 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test aio module."""
+import asyncio
+import hashlib
+import re
+
+import pytest
+
+from .aio import AsyncISO
+from .errors import HashMismatchError, SignatureError
+from .test_iso import make_iso
+from .test_zsync import make_control
+
+CONTENT = b"ubuntu" * 300000
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+PATH = "/focal/ubuntu-20.04-live-server-amd64.iso"
+
+
+def run(coroutine):
+    """Run a coroutine on a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def sign(http_server, signing_key, content):
+    """Publish a signed hash file for content on the test server."""
+    sums = ("%s *ubuntu-20.04-live-server-amd64.iso\n" % content).encode()
+    http_server.files["/focal/SHA256SUMS"] = sums
+    http_server.files["/focal/SHA256SUMS.gpg"] = signing_key.sign(sums)
+
+
+def make_async_iso(http_server, signing_key):
+    """Return an AsyncISO for a signed release on the test server."""
+    sign(http_server, signing_key, DIGEST)
+    http_server.files[PATH] = CONTENT
+
+    iso = make_iso(http_server.url + "/focal")
+    iso.target.hash_file = http_server.url + "/focal/SHA256SUMS"
+    iso.ubuntu_cd_public_gpg = signing_key.keyring
+    iso.show_progress = False
+    return AsyncISO(iso)
+
+
+def ranged_bytes(requests):
+    """Return the bytes of the ISO fetched with Range requests."""
+    fetched = 0
+    for _, request_path, headers in requests:
+        match = re.match(r"bytes=(\d+)-(\d+)", headers.get("Range", ""))
+        if request_path == PATH and match:
+            fetched += int(match.group(2)) - int(match.group(1)) + 1
+    return fetched
+
+
+def test_download(http_server, signing_key, tmp_path, monkeypatch):
+    """The ISO is verified, downloaded, and not downloaded twice."""
+    monkeypatch.chdir(tmp_path)
+    iso = make_async_iso(http_server, signing_key)
+    records = []
+    iso.iso.metrics.add_hook(records.append)
+
+    async def download():
+        first = await iso.download()
+        second = await iso.download()
+        return first, second
+
+    first, second = run(download())
+    assert first == second == "ubuntu-20.04-live-server-amd64.iso"
+    assert (tmp_path / first).read_bytes() == CONTENT
+    assert not (tmp_path / (first + ".part")).exists()
+
+    gets = [path for method, path, _ in http_server.requests if method == "GET"]
+    assert gets.count(PATH) == 1
+    assert [record["phase"] for record in records] == ["gpg", "hash", "download"]
+    assert records[-1]["bytes"] == len(CONTENT)
+
+
+def test_download_segments(http_server, signing_key, tmp_path):
+    """The options of the ISO apply, e.g. several connections."""
+    iso = make_async_iso(http_server, signing_key)
+    iso.iso.connections = 4
+    destination = str(tmp_path / "new.iso")
+
+    assert run(iso.download(destination)) == destination
+    assert open(destination, "rb").read() == CONTENT
+    assert ranged_bytes(http_server.requests) == len(CONTENT)
+
+
+def test_download_mismatch(http_server, signing_key, tmp_path, monkeypatch):
+    """A corrupt download is removed."""
+    monkeypatch.chdir(tmp_path)
+    iso = make_async_iso(http_server, signing_key)
+    http_server.files[PATH] = b"corrupt"
+
+    with pytest.raises(HashMismatchError):
+        run(iso.download())
+    assert list(tmp_path.glob("*.iso*")) == []
+
+
+def test_download_seed(http_server, signing_key, tmp_path):
+    """Only the blocks missing from the seed are fetched."""
+    iso = make_async_iso(http_server, signing_key)
+    seed = tmp_path / "old.iso"
+    seed.write_bytes(b"debian" + CONTENT[6:])
+    http_server.files[PATH + ".zsync"] = make_control(
+        CONTENT, url="ubuntu-20.04-live-server-amd64.iso"
+    )
+    destination = str(tmp_path / "new.iso")
+
+    assert run(iso.download(destination, str(seed))) == destination
+    assert open(destination, "rb").read() == CONTENT
+    assert ranged_bytes(http_server.requests) < 4 * 4096
+    assert all(
+        "Range" in headers
+        for method, path, headers in http_server.requests
+        if path == PATH and method == "GET"
+    )
+
+
+def test_hash_refresh(http_server, signing_key):
+    """Every call sees the current hash file."""
+    iso = make_async_iso(http_server, signing_key)
+    assert run(iso.hash())[1] == DIGEST
+
+    sign(http_server, signing_key, "0" * 64)
+    assert run(iso.hash())[1] == "0" * 64
+
+
+def test_hash_bad_signature(http_server, signing_key):
+    """Hash files with a bad signature are rejected."""
+    iso = make_async_iso(http_server, signing_key)
+    http_server.files["/focal/SHA256SUMS"] += b"tampered\n"
+
+    with pytest.raises(SignatureError):
+        run(iso.hash())
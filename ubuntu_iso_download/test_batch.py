@@ -0,0 +1,176 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test batch module."""
+import threading
+import time
+
+import pytest
+
+from .batch import Batch, Entry, load_manifest
+from .errors import DownloadError
+
+
+class Target:
+    """Dummy URL target."""
+
+    def __init__(self, url):
+        """Initialize target."""
+        self.url = url
+
+
+class FakeISO:
+    """Dummy ISO that records concurrent downloads per host."""
+
+    active = {}
+    peak = {}
+    started = []
+    lock = threading.Lock()
+
+    def __init__(self, url, fail=False):
+        """Initialize ISO."""
+        self.target = Target(url)
+        self.stripes = []
+        self.position = None
+        self.fail = fail
+
+    def download(self, filename, target_hash):
+        """Pretend to download."""
+        host = self.target.url
+        with self.lock:
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+            self.started.append(self)
+        time.sleep(0.05)
+        with self.lock:
+            self.active[host] -= 1
+
+        if self.fail:
+            raise DownloadError("HTTP 404 for %s" % filename)
+        return filename
+
+
+def resolved(url, fail=False):
+    """Return a resolved entry backed by a fake ISO."""
+    entry = Entry("server", "focal")
+    entry.iso = FakeISO(url, fail)
+    entry.filename = "%s.iso" % id(entry)
+    entry.target_hash = "abc"
+    entry.status = "resolved"
+    return entry
+
+
+def test_entry_parse():
+    """Targets are flavor[:release[:arch]]."""
+    entry = Entry.parse("server:focal:arm64")
+    assert (entry.flavor, entry.release, entry.arch) == ("server", "focal", "arm64")
+
+    entry = Entry.parse("desktop")
+    assert (entry.flavor, entry.release, entry.arch) == ("desktop", None, "amd64")
+    assert repr(entry) == "desktop:lts:amd64"
+
+    with pytest.raises(ValueError):
+        Entry.parse("windows:11")
+
+
+def test_load_manifest(tmp_path):
+    """Manifests are a list or a mapping with 'isos'."""
+    manifest = tmp_path / "isos.yaml"
+    manifest.write_text(
+        "isos:\n"
+        "  - flavor: server\n"
+        "    release: 20.04\n"
+        "    arch: arm64\n"
+        "  - flavor: xubuntu\n"
+        "    mirror: http://mirror.example.com\n"
+        "    priority: 2\n"
+        "    limit_rate: 20M\n"
+    )
+
+    entries = load_manifest(str(manifest))
+    assert [repr(entry) for entry in entries] == [
+        "server:20.04:arm64",
+        "xubuntu:lts:amd64",
+    ]
+    assert entries[1].mirror == "http://mirror.example.com"
+    assert (entries[0].priority, entries[0].rate) == (None, None)
+    assert (entries[1].priority, entries[1].rate) == (2, 20 * 1024**2)
+
+
+def test_download_limits(caplog):
+    """Downloads are bounded per host and failures are reported."""
+    entries = [resolved("http://one.example.com/focal") for _ in range(4)]
+    entries += [resolved("http://two.example.com/focal") for _ in range(2)]
+    entries.append(resolved("http://two.example.com/focal", fail=True))
+
+    batch = Batch(entries, jobs=6, per_host=2)
+    batch.download()
+
+    assert FakeISO.peak["http://one.example.com/focal"] == 2
+    assert [entry.status for entry in entries] == ["ok"] * 6 + ["failed"]
+    assert sorted(entry.iso.position for entry in entries) == list(range(7))
+
+    summary = batch.summary().splitlines()
+    assert summary[0].split() == ["TARGET", "STATUS", "SIZE", "TIME", "ISO"]
+    assert len(summary) == 8
+    assert "failed" in summary[-1]
+    assert [record.levelname for record in caplog.records] == ["WARNING"]
+    assert "HTTP 404" in caplog.records[0].getMessage()
+
+    result = entries[-1].result()
+    assert result["status"] == "failed"
+    assert result["target"] == "server:focal:amd64"
+    assert result["url"] == "http://two.example.com/focal"
+    assert result["error"]["type"] == "DownloadError"
+    assert "error" not in entries[0].result()
+
+
+def test_download_busy_host():
+    """Entries queued for a busy host leave the jobs to other hosts."""
+    entries = [resolved("http://one.example.com/focal") for _ in range(3)]
+    entries.append(resolved("http://two.example.com/focal"))
+    del FakeISO.started[:]
+
+    Batch(entries, jobs=2, per_host=1).download()
+
+    assert [entry.status for entry in entries] == ["ok"] * 4
+    assert FakeISO.started[:2] in (
+        [entries[0].iso, entries[3].iso],
+        [entries[3].iso, entries[0].iso],
+    )
+
+
+def test_download_striped_hosts():
+    """An entry striped across mirrors holds a slot on each of them."""
+    entries = [resolved("http://%s.example.com/focal" % name) for name in "abc"]
+    entries[0].iso.stripes = [Target("http://b.example.com/focal")]
+    del FakeISO.started[:]
+
+    Batch(entries, jobs=2, per_host=1).download()
+
+    assert entries[0].hosts == ["a.example.com", "b.example.com"]
+    assert [entry.status for entry in entries] == ["ok"] * 3
+    assert FakeISO.started[2] is entries[1].iso
+
+
+def test_resolve_priority(monkeypatch):
+    """An explicit priority of 0 is kept, not replaced by the default."""
+    priorities = []
+
+    class PriorityISO(FakeISO):
+        """Dummy ISO that records its priority."""
+
+        def __init__(self, flavor, release, priority, **options):
+            """Initialize ISO."""
+            super().__init__("http://one.example.com/focal")
+            priorities.append(priority)
+
+        def hash(self):
+            """Return no hash."""
+            return "", ""
+
+    monkeypatch.setattr("ubuntu_iso_download.batch.ISO", PriorityISO)
+    entries = [Entry("server", priority=0), Entry("desktop")]
+    batch = Batch(entries, priorities={"server": 2, "desktop": 3})
+    for entry in entries:
+        batch._resolve(entry, None)
+
+    assert priorities == [0, 3]
@@ -0,0 +1,134 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test cache module."""
+import concurrent.futures
+import json
+import os
+import time
+
+import pytest
+
+from .cache import (
+    HashFileCache,
+    MetadataCache,
+    SignatureCache,
+    VerifiedCache,
+    cache_dir,
+)
+from .errors import DownloadError
+
+
+def test_cache_dir(cache_home):
+    """Cache directory lives under XDG_CACHE_HOME."""
+    assert cache_dir() == str(cache_home / "ubuntu-iso-download")
+    assert os.path.isdir(cache_dir())
+
+
+def test_verified_cache(tmp_path):
+    """Entries are invalidated when the file changes."""
+    filename = str(tmp_path / "ubuntu.iso")
+    with open(filename, "wb") as file:
+        file.write(b"ubuntu")
+
+    cache = VerifiedCache()
+    assert cache.lookup(filename) is None
+
+    cache.store(filename, "abc")
+    assert cache.lookup(filename) == "abc"
+
+    with open(filename, "ab") as file:
+        file.write(b"more")
+    assert cache.lookup(filename) is None
+    assert cache.lookup(str(tmp_path / "missing.iso")) is None
+
+
+def test_verified_cache_concurrent(tmp_path):
+    """Files stored at once from several threads are all kept."""
+    filenames = []
+    for number in range(8):
+        filenames.append(str(tmp_path / ("%s.iso" % number)))
+        with open(filenames[-1], "wb") as file:
+            file.write(b"ubuntu")
+
+    cache = VerifiedCache()
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda name: cache.store(name, name), filenames * 4))
+
+    assert [cache.lookup(name) for name in filenames] == filenames
+
+
+def test_metadata_cache(http_server):
+    """Cached files are revalidated and reused on 304."""
+    http_server.files["/SHA256SUMS"] = b"abc *ubuntu.iso\n"
+    url = http_server.url + "/SHA256SUMS"
+
+    cache = MetadataCache()
+    assert cache.get(url) == b"abc *ubuntu.iso\n"
+    assert cache.get(url) == b"abc *ubuntu.iso\n"
+
+    http_server.files["/SHA256SUMS"] = b"def *ubuntu.iso\n"
+    assert cache.get(url) == b"def *ubuntu.iso\n"
+
+    validators = [h.get("If-None-Match") for _, _, h in http_server.requests]
+    assert validators[0] is None
+    assert validators[1] == validators[2] is not None
+
+    with pytest.raises(DownloadError, match="HTTP 404"):
+        cache.get(http_server.url + "/missing")
+
+
+def test_signature_cache():
+    """Successful verifications are remembered."""
+    cache = SignatureCache()
+    key = cache.key(b"keyring", b"data", b"signature")
+
+    assert key not in cache
+    cache.add(key)
+    assert key in cache
+    assert cache.key(b"keyring", b"data", b"other") not in cache
+    assert key in SignatureCache()
+
+
+def test_signature_cache_size(tmp_path):
+    """Only the most recent verifications are kept."""
+    path = str(tmp_path / "signatures.json")
+    with open(path, "w") as file:
+        json.dump(["old:list:format"], file)
+
+    cache = SignatureCache(path, size=2)
+    assert "old:list:format" not in cache
+    for key in ("a", "b", "c"):
+        cache.add(key)
+
+    with open(path) as file:
+        assert sorted(json.load(file)) == ["b", "c"]
+    assert "a" not in SignatureCache(path)
+
+
+def test_hash_file_cache():
+    """Each hash file is fetched once, however many ISOs ask at once."""
+    cache = HashFileCache()
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        time.sleep(0.05)
+        return url.encode()
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        urls = ["ports/SHA256SUMS"] * 3 + ["amd64/SHA256SUMS"]
+        results = list(executor.map(lambda url: cache.get(url, fetch), urls))
+
+    assert results == [url.encode() for url in urls]
+    assert sorted(fetched) == ["amd64/SHA256SUMS", "ports/SHA256SUMS"]
+
+
+def test_hash_file_cache_failure():
+    """A failed fetch is not remembered."""
+    cache = HashFileCache()
+
+    def fail(url):
+        raise OSError("unreachable")
+
+    with pytest.raises(OSError):
+        cache.get("SHA256SUMS", fail)
+    assert cache.get("SHA256SUMS", lambda url: b"sums") == b"sums"
@@ -0,0 +1,82 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test checksums module."""
+from .checksums import Checksums, parse_checksums
+
+RELEASE = b"""\
+%s *ubuntu-20.04.2-live-server-amd64.iso
+%s *ubuntu-20.04.3-desktop-amd64.iso
+%s *ubuntu-20.04.3-live-server-amd64.iso
+%s *ubuntu-20.04.3-live-server-arm64.iso
+%s *ubuntu-20.04.3-preinstalled-server-arm64+raspi.img.xz
+""" % tuple(
+    str(number).encode() * 64 for number in range(5)
+)
+
+NETBOOT = b"""\
+%s  ./netboot/gtk/mini.iso
+%s  ./netboot/mini.iso
+%s  ./netboot/netboot.tar.gz
+""" % tuple(
+    str(number).encode() * 64 for number in range(3)
+)
+
+
+def test_parse():
+    """Both filename formats are parsed into their parts."""
+    checksums = Checksums.parse(RELEASE)
+    assert len(checksums) == 5
+
+    server = checksums.files["ubuntu-20.04.3-live-server-arm64.iso"]
+    assert (server.name, server.version, server.variety, server.arch) == (
+        "ubuntu",
+        "20.04.3",
+        "live-server",
+        "arm64",
+    )
+
+    netboot = Checksums.parse(NETBOOT)
+    assert [checksum.filename for checksum in netboot] == [
+        "netboot/gtk/mini.iso",
+        "netboot/mini.iso",
+        "netboot/netboot.tar.gz",
+    ]
+    assert netboot.digest("./netboot/mini.iso") == "1" * 64
+
+
+def test_find():
+    """The latest version of a variety and architecture is found."""
+    checksums = Checksums.parse(RELEASE)
+
+    assert checksums.find("live-server", "amd64").digest == "2" * 64
+    assert checksums.find("live-server", "amd64", "20.04.2").digest == "0" * 64
+    assert checksums.find("live-server", "arm64").digest == "3" * 64
+    assert checksums.find("desktop", "amd64").digest == "1" * 64
+    assert checksums.find("desktop", "arm64") is None
+    assert checksums.find("server", "amd64") is None
+
+
+def test_find_daily_and_netboot():
+    """Daily names have no version and netboot names no architecture."""
+    daily = Checksums.parse(
+        b"%s *focal-live-server-amd64.iso\n%s *focal-desktop-legacy-amd64.iso\n"
+        % (b"a" * 64, b"b" * 64)
+    )
+    assert daily.find("live-server", "amd64").digest == "a" * 64
+    assert daily.find("desktop", "amd64") is None
+    assert daily.find("desktop-legacy", "amd64").digest == "b" * 64
+
+    netboot = Checksums.parse(NETBOOT)
+    assert netboot.find("mini", "i386").filename == "netboot/mini.iso"
+
+
+def test_select():
+    """Every ISO of an architecture in one query."""
+    checksums = Checksums.parse(RELEASE)
+    assert len(checksums.select(arch="amd64")) == 3
+    assert len(checksums.select(variety="live-server")) == 3
+    assert len(checksums.select(version="20.04.3")) == 3
+
+
+def test_parse_checksums_cached():
+    """The same content is parsed only once."""
+    assert parse_checksums(RELEASE) is parse_checksums(bytes(RELEASE))
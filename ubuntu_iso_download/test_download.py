@@ -0,0 +1,216 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test download module."""
+import hashlib
+import os
+
+import pytest
+
+from . import download as download_module
+from .download import Download, DownloadError, Journal, RangeSet
+
+CONTENT = os.urandom(3 * 1024 * 1024 + 123)
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+class Progress:
+    """Dummy progress bar."""
+
+    def __init__(self, total):
+        """Initialize progress."""
+        self.total = total
+        self.count = 0
+        self.closed = False
+
+    def update(self, length):
+        """Count progress."""
+        self.count += length
+
+    def close(self):
+        """Close progress."""
+        self.closed = True
+
+
+def test_range_set():
+    """Ranges merge and report gaps."""
+    done = RangeSet([(10, 20), (0, 5)])
+    done.add(5, 8)
+    done.add(19, 25)
+
+    assert list(done) == [(0, 8), (10, 25)]
+    assert done.missing(30) == [(8, 10), (25, 30)]
+    assert done.prefix == 8
+    assert done.total == 23
+
+
+def test_segments():
+    """Segments cover the missing ranges without gaps."""
+    download = Download("http://localhost/x.iso", "x.iso", connections=3)
+    assert download.segments([(0, 10)]) == [(0, 4), (4, 8), (8, 10)]
+    assert download.segments([(0, 1), (5, 6)]) == [(0, 1), (5, 6)]
+
+
+def test_stream(http_server, tmp_path):
+    """Single connection download."""
+    http_server.files["/x.iso"] = CONTENT
+    filename = str(tmp_path / "x.iso")
+
+    bars = []
+    download = Download(
+        http_server.url + "/x.iso",
+        filename,
+        progress=lambda size: bars.append(Progress(size)) or bars[-1],
+    )
+
+    assert download.run() == DIGEST
+    assert open(filename, "rb").read() == CONTENT
+    assert bars[0].count == bars[0].total == len(CONTENT)
+    assert bars[0].closed
+    assert not os.path.exists(filename + ".part")
+    assert not os.path.exists(filename + ".part.json")
+
+
+def test_segmented(http_server, tmp_path):
+    """Multi-connection download with Range requests."""
+    http_server.files["/x.iso"] = CONTENT
+    filename = str(tmp_path / "x.iso")
+
+    bars = []
+    download = Download(
+        http_server.url + "/x.iso",
+        filename,
+        connections=4,
+        progress=lambda size: bars.append(Progress(size)) or bars[-1],
+    )
+
+    assert download.run() == DIGEST
+    assert open(filename, "rb").read() == CONTENT
+    assert bars[0].count == len(CONTENT)
+    ranges = [h["Range"] for _, _, h in http_server.requests if "Range" in h]
+    assert len(ranges) == 4
+
+
+def test_segmented_fallback(http_server, tmp_path):
+    """Fall back to one stream without Accept-Ranges."""
+    http_server.files["/x.iso"] = CONTENT
+    http_server.ranges = False
+    filename = str(tmp_path / "x.iso")
+
+    download = Download(http_server.url + "/x.iso", filename, connections=4)
+
+    assert download.run() == DIGEST
+    assert [command for command, _, _ in http_server.requests] == ["HEAD", "GET"]
+
+
+def test_missing(http_server, tmp_path):
+    """Missing ISO raises an error."""
+    download = Download(http_server.url + "/x.iso", str(tmp_path / "x.iso"))
+
+    with pytest.raises(DownloadError):
+        download.run()
+
+
+def test_resume(http_server, tmp_path, monkeypatch):
+    """An interrupted download continues from the journal."""
+    http_server.files["/x.iso"] = CONTENT
+    filename = str(tmp_path / "x.iso")
+    url = http_server.url + "/x.iso"
+    monkeypatch.setattr(download_module, "CHUNK_SIZE", 64 * 1024)
+
+    interrupted = Download(url, filename, expected_hash=DIGEST)
+    calls = []
+    update = interrupted._hash.update
+
+    def fail(offset, data):
+        calls.append(offset)
+        if len(calls) > 5:
+            raise KeyboardInterrupt
+        update(offset, data)
+
+    interrupted._hash.update = fail
+    with pytest.raises(KeyboardInterrupt):
+        interrupted.run()
+
+    journal = Journal.load(filename + ".part.json")
+    assert journal.done.total == 5 * 64 * 1024
+    assert not os.path.exists(filename)
+
+    http_server.requests.clear()
+    assert Download(url, filename, expected_hash=DIGEST).run() == DIGEST
+    assert open(filename, "rb").read() == CONTENT
+    assert not os.path.exists(filename + ".part.json")
+    ranges = [h["Range"] for _, _, h in http_server.requests if "Range" in h]
+    assert ranges == ["bytes=%s-%s" % (5 * 64 * 1024, len(CONTENT) - 1)]
+
+
+def test_resume_respun(http_server, tmp_path):
+    """A partial download of a different ISO is discarded."""
+    http_server.files["/x.iso"] = CONTENT
+    filename = str(tmp_path / "x.iso")
+    with open(filename + ".part", "wb") as partial:
+        partial.write(b"stale" * 100)
+    Journal(
+        filename + ".part.json",
+        {"size": len(CONTENT), "sha256": "0" * 64},
+        RangeSet([(0, 500)]),
+    ).save(force=True)
+
+    download = Download(http_server.url + "/x.iso", filename, expected_hash=DIGEST)
+
+    assert download.run() == DIGEST
+    assert open(filename, "rb").read() == CONTENT
+
+
+def test_striped(http_server, tmp_path, monkeypatch):
+    """Pieces are spread over mirrors and failing mirrors are dropped."""
+    monkeypatch.setattr(download_module, "PIECE_SIZE", 256 * 1024)
+    http_server.files["/a/x.iso"] = CONTENT
+    http_server.files["/b/x.iso"] = CONTENT
+    filename = str(tmp_path / "x.iso")
+
+    download = Download(
+        http_server.url + "/a/x.iso",
+        filename,
+        expected_hash=DIGEST,
+        mirrors=[http_server.url + "/b/x.iso", http_server.url + "/gone/x.iso"],
+    )
+
+    assert download.run() == DIGEST
+    assert open(filename, "rb").read() == CONTENT
+    paths = {path for _, path, headers in http_server.requests if "Range" in headers}
+    assert paths == {"/a/x.iso", "/b/x.iso", "/gone/x.iso"}
+
+
+def test_striped_all_fail(http_server, tmp_path):
+    """A striped download fails once every mirror is dropped."""
+    http_server.files["/a/x.iso"] = CONTENT
+    download = Download(
+        http_server.url + "/a/x.iso",
+        str(tmp_path / "x.iso"),
+        mirrors=[http_server.url + "/gone/x.iso"],
+    )
+    del http_server.files["/a/x.iso"]
+    download.probe = lambda: {
+        "size": len(CONTENT),
+        "ranges": True,
+        "etag": "",
+        "last_modified": "",
+    }
+
+    with pytest.raises(DownloadError):
+        download.run()
+
+
+def test_extra_digests(http_server, tmp_path):
+    """Extra digests are computed along the way."""
+    http_server.files["/x.iso"] = CONTENT
+    for connections in (1, 4):
+        filename = str(tmp_path / ("x%s.iso" % connections))
+        download = Download(
+            http_server.url + "/x.iso",
+            filename,
+            connections=connections,
+            digests=["sha512"],
+        )
+
+        assert download.run() == DIGEST
+        assert download.digests["sha512"] == hashlib.sha512(CONTENT).hexdigest()
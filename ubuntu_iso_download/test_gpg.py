@@ -0,0 +1,69 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test gpg module."""
+import os
+
+import pytest
+
+from .gpg import GnuPGVerifier, PythonVerifier, dearmor, get_verifier
+
+UBUNTU_KEYRING = "/usr/share/keyrings/ubuntu-archive-keyring.gpg"
+DATA = b"abc *ubuntu-20.04-desktop-amd64.iso\n"
+
+
+@pytest.mark.parametrize("verifier", [GnuPGVerifier, PythonVerifier])
+@pytest.mark.parametrize("armor", [True, False])
+def test_verify(signing_key, verifier, armor):
+    """Both backends accept good and reject bad signatures."""
+    signature = signing_key.sign(DATA, armor=armor)
+    keyring = signing_key.keyring
+
+    assert verifier(keyring).verify(DATA, signature)
+    assert not verifier(keyring).verify(DATA + b"tampered", signature)
+    assert not verifier(keyring).verify(DATA, b"not a signature")
+
+
+def test_python_unknown_key(signing_key):
+    """Signatures from keys outside the keyring are rejected."""
+    signature = signing_key.sign(DATA)
+
+    assert not PythonVerifier(b"").verify(DATA, signature)
+
+
+def test_gnupg_imports_once(signing_key, monkeypatch):
+    """The keyring is only imported into a new GPG home."""
+    GnuPGVerifier(signing_key.keyring)
+
+    monkeypatch.setattr(
+        "gnupg.GPG.import_keys", lambda *args: pytest.fail("imported again")
+    )
+    verifier = GnuPGVerifier(signing_key.keyring)
+    assert verifier.verify(DATA, signing_key.sign(DATA))
+
+
+def test_get_verifier(signing_key):
+    """Verifiers are reused within the process."""
+    verifier = get_verifier("python", signing_key.keyring)
+
+    assert get_verifier("python", signing_key.keyring) is verifier
+    with pytest.raises(ValueError):
+        get_verifier("unknown", signing_key.keyring)
+
+
+def test_dearmor(signing_key):
+    """Armored data decodes to the binary packets."""
+    armored = signing_key.gpg.export_keys(signing_key.fingerprint)
+
+    assert dearmor(armored.encode()) == signing_key.keyring
+    assert dearmor(b"\x99binary") == b"\x99binary"
+
+
+@pytest.mark.skipif(
+    not os.path.isfile(UBUNTU_KEYRING), reason="ubuntu-keyring not installed"
+)
+def test_ubuntu_keyring():
+    """The Ubuntu CD image signing key is read from the archive keyring."""
+    with open(UBUNTU_KEYRING, "rb") as keyring:
+        verifier = PythonVerifier(keyring.read())
+
+    fingerprints = [key["fingerprint"].hex() for key in verifier.keys.values()]
+    assert "843938df228d22f7b3742bc0d94aa3f0efe21092" in fingerprints
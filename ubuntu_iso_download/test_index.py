@@ -0,0 +1,66 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test index module."""
+import json
+
+from ubuntu_release_info.release import Release
+
+from .index import TargetIndex, build_index
+
+
+class Data:
+    """Dummy release data."""
+
+    def __init__(self):
+        """Initialize releases."""
+        self.lts = Release("focal", "Focal Fossa", "20.04.3 LTS", True, True)
+        xenial = Release("xenial", "Xenial Xerus", "16.04.7 LTS", True, True)
+        impish = Release("impish", "Impish Indri", "21.10", True)
+        impish.is_dev = True
+        self.supported = [xenial, self.lts, impish]
+
+
+def test_build_index():
+    """Every supported combination is resolved once."""
+    data = build_index(Data(), arches=("amd64", "arm64"))
+
+    assert data["releases"][""] == "focal"
+    assert data["releases"]["20.04"] == "focal"
+    assert data["releases"]["20.04.3"] == "focal"
+
+    targets = data["targets"]
+    assert targets["server:focal:amd64"] == [
+        "Ubuntu Server ISO on focal",
+        "http://releases.ubuntu.com/20.04.3",
+        "live-server",
+        "ubuntu-20.04.3-live-server-amd64.iso",
+    ]
+    assert targets["server:xenial:amd64"][2] == "server"
+    assert targets["server:impish:arm64"][3] == "impish-live-server-arm64.iso"
+    assert targets["netboot:xenial:amd64"][3] == "netboot/mini.iso"
+    assert "netboot:xenial:arm64" not in targets
+    assert "netboot:focal:amd64" not in targets
+    assert "budgie:xenial:amd64" not in targets
+
+
+def test_lookup(tmp_path):
+    """Lookups by codename, version, or LTS come from the cached file."""
+    path = str(tmp_path / "index.json")
+    index = TargetIndex(path)
+    assert index.lookup("server") is None
+
+    assert index.build(Data()) == len(json.load(open(path))["targets"])
+
+    index = TargetIndex(path)
+    target = index.lookup("xubuntu", "20.04")
+    assert target == index.lookup("xubuntu", "focal") == index.lookup("xubuntu")
+    assert target["url"] == ("http://cdimage.ubuntu.com/xubuntu/releases/focal/release")
+    assert index.lookup("xubuntu", "18.04") is None
+    assert "desktop:focal:amd64" in index.targets()
+
+
+def test_stale(tmp_path):
+    """A stale index is not used."""
+    path = str(tmp_path / "index.json")
+    TargetIndex(path).build(Data())
+
+    assert TargetIndex(path, ttl=-1).lookup("server") is None
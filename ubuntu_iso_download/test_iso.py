@@ -0,0 +1,230 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test iso module."""
+import hashlib
+import logging
+
+import pytest
+from ubuntu_release_info.release import Release
+
+from .cache import HashFileCache, MetadataCache, SignatureCache, VerifiedCache
+from .errors import HashMismatchError, HashNotFoundError, UnsupportedError
+from .iso import ISO
+from .metrics import Metrics
+from .ratelimit import Bandwidth
+from .session import create_session
+from .store import Store
+from .test_index import Data
+
+
+class Target:
+    """Dummy URL target."""
+
+    arch = "amd64"
+    url = ""
+    variety = "live-server"
+
+
+def make_iso(url=""):
+    """Return an ISO object without touching the network."""
+    iso = ISO.__new__(ISO)
+    iso._log = logging.getLogger(__name__)
+    iso.target = Target()
+    iso.target.url = url
+    iso.canonical = iso.target
+    iso.mirrors = []
+    iso.stripe = False
+    iso.stripes = []
+    iso.selected = ""
+    iso.seed = None
+    iso.extra_digests = []
+    iso.digests = {}
+    iso.bandwidth = Bandwidth()
+    iso.rate = 0
+    iso.priority = 1
+    iso.metrics = Metrics()
+    iso.show_progress = True
+    iso.connections = 1
+    iso.session = create_session()
+    iso.verified = VerifiedCache()
+    iso.metadata = MetadataCache()
+    iso.signatures = SignatureCache()
+    iso.hash_files = HashFileCache()
+    iso.ubuntu_cd_public_gpg = b"keyring"
+    iso.gpg = "python"
+    iso.store = None
+    iso.position = None
+    return iso
+
+
+def test_download_iso_streaming_hash(http_server, tmp_path, monkeypatch):
+    """Hash is computed while the ISO streams to disk."""
+    content = b"ubuntu" * 500000
+    http_server.files["/focal/ubuntu.iso"] = content
+    monkeypatch.chdir(tmp_path)
+
+    iso = make_iso(http_server.url + "/focal")
+    filename, digest = iso.download_iso(iso.target, "ubuntu.iso")
+
+    assert filename == "ubuntu.iso"
+    assert digest == hashlib.sha256(content).hexdigest()
+    assert digest == iso.calc_sha256(str(tmp_path / filename))
+
+
+def test_is_verified(tmp_path, monkeypatch):
+    """Existing ISOs are hashed once and then served from the cache."""
+    filename = str(tmp_path / "ubuntu.iso")
+    with open(filename, "wb") as file:
+        file.write(b"ubuntu")
+    digest = hashlib.sha256(b"ubuntu").hexdigest()
+
+    iso = make_iso()
+    assert iso.is_verified(filename, digest)
+    assert not iso.is_verified(filename, "0" * 64)
+    assert not iso.is_verified(str(tmp_path / "missing.iso"), digest)
+
+    monkeypatch.setattr(iso, "calc_sha256", None)
+    assert iso.is_verified(filename, digest)
+
+
+def test_download_to_store(http_server, tmp_path, monkeypatch):
+    """ISOs are downloaded into the store once and linked locally."""
+    content = b"ubuntu" * 1000
+    digest = hashlib.sha256(content).hexdigest()
+    http_server.files["/focal/ubuntu.iso"] = content
+
+    iso = make_iso(http_server.url + "/focal")
+    iso.store = Store(str(tmp_path / "store"))
+
+    for workspace in ("one", "two"):
+        (tmp_path / workspace).mkdir()
+        monkeypatch.chdir(tmp_path / workspace)
+        iso.download_to_store("ubuntu.iso", digest)
+        assert open("ubuntu.iso", "rb").read() == content
+
+    assert [command for command, _, _ in http_server.requests] == ["HEAD", "GET"]
+    assert iso.store.entries() == [digest]
+
+
+def test_verify_gpg_signature_memoized(http_server):
+    """A remembered verification does not run gpg."""
+    http_server.files["/SHA256SUMS.gpg"] = b"signature"
+    iso = make_iso()
+    iso.signatures.add(iso.signatures.key(b"keyring", b"data", b"signature"))
+
+    assert iso.verify_gpg_signature(b"data", http_server.url + "/SHA256SUMS.gpg")
+
+
+def test_select_mirror(monkeypatch):
+    """The fastest mirror is used, falling back to the canonical host."""
+
+    class Flavor(Target):
+        def __init__(self, release, arch="amd64", mirror=""):
+            self.url = mirror or "http://canonical"
+
+    iso = make_iso("http://canonical")
+    iso.flavor, iso.release, iso.arch = Flavor, None, "amd64"
+    iso.mirrors = ["http://one", "http://two", "http://three"]
+    iso.stripe = True
+
+    monkeypatch.setattr(
+        "ubuntu_iso_download.mirror.MirrorRanker.rank", lambda self, urls: urls[::-1]
+    )
+    assert iso.select_mirror("ubuntu.iso").url == "http://three"
+    assert [stripe.url for stripe in iso.stripes] == ["http://two", "http://one"]
+
+    # the choice is kept, e.g. by download() after a batch resolved it
+    monkeypatch.setattr(
+        "ubuntu_iso_download.mirror.MirrorRanker.rank", lambda self, urls: []
+    )
+    assert iso.select_mirror("ubuntu.iso").url == "http://three"
+    assert iso.select_mirror("other.iso") is iso.canonical
+
+
+def test_download_iso_seed_fallback(http_server, tmp_path, monkeypatch):
+    """Without a zsync file the ISO is downloaded in full."""
+    content = b"ubuntu" * 1000
+    http_server.files["/focal/ubuntu.iso"] = content
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "old.iso").write_bytes(b"old")
+
+    iso = make_iso(http_server.url + "/focal")
+    iso.seed = str(tmp_path / "old.iso")
+    filename, digest = iso.download_iso(
+        iso.target, "ubuntu.iso", hashlib.sha256(content).hexdigest()
+    )
+
+    assert digest == hashlib.sha256(content).hexdigest()
+    assert (tmp_path / filename).read_bytes() == content
+
+
+def test_download_iso_rate(http_server, tmp_path, monkeypatch):
+    """Downloads take a share of the bandwidth and give it back."""
+    content = b"ubuntu" * 1000
+    http_server.files["/focal/ubuntu.iso"] = content
+    monkeypatch.chdir(tmp_path)
+
+    slept = []
+    iso = make_iso(http_server.url + "/focal")
+    iso.bandwidth = Bandwidth(1000, sleep=slept.append)
+    iso.download_iso(iso.target, "ubuntu.iso")
+
+    assert sum(slept) > 0
+    assert iso.bandwidth.shares == []
+
+
+def test_parse_hashes():
+    """The latest ISO of the target variety and architecture is picked."""
+    iso = make_iso()
+    hashes = (
+        b"%s *ubuntu-20.04.3-live-server-amd64.iso\n"
+        b"%s *ubuntu-20.04.3-desktop-amd64.iso\n"
+        b"%s *ubuntu-20.04.2-live-server-amd64.iso\n"
+        % (b"a" * 64, b"b" * 64, b"c" * 64)
+    )
+
+    assert iso.parse_hashes(hashes) == (
+        "ubuntu-20.04.3-live-server-amd64.iso",
+        "a" * 64,
+    )
+    assert iso.checksums.find("desktop", "amd64").digest == "b" * 64
+    assert iso.parse_hashes(b"") == ("", "")
+
+
+def test_download_mismatch(http_server, tmp_path, monkeypatch):
+    """A download with the wrong hash is removed and raises."""
+    http_server.files["/focal/ubuntu.iso"] = b"corrupt"
+    monkeypatch.chdir(tmp_path)
+
+    iso = make_iso(http_server.url + "/focal")
+    with pytest.raises(HashMismatchError):
+        iso.download("ubuntu.iso", "a" * 64)
+    assert not (tmp_path / "ubuntu.iso").exists()
+
+
+def test_hash_not_found(monkeypatch):
+    """A hash file without the ISO raises instead of exiting."""
+    iso = make_iso("http://example.com/focal")
+    iso.target.hash_file = iso.target.url + "/SHA256SUMS"
+    iso.target.hash_file_signed = iso.target.url + "/SHA256SUMS.gpg"
+    monkeypatch.setattr(iso.metadata, "get", lambda url: b"")
+    monkeypatch.setattr(iso, "verify_gpg_signature", lambda data, url: True)
+
+    with pytest.raises(HashNotFoundError):
+        iso.hash()
+
+
+def test_get_ubuntu_release():
+    """Releases are found by codename or version, or raise."""
+    iso = make_iso()
+    focal = Release("focal", "Focal Fossa", "20.04.3 LTS", True, True)
+    trusty = Release("trusty", "Trusty Tahr", "14.04.6 LTS", False, True)
+    ubuntu = Data()
+    ubuntu.lts = focal
+    ubuntu.supported = [focal]
+    ubuntu.releases = {"focal": focal, "trusty": trusty}
+
+    assert iso.get_ubuntu_release("20.04", ubuntu).codename == "focal"
+    assert iso.get_ubuntu_release("focal", ubuntu).codename == "focal"
+    for release in ("trusty", "hirsute", "21.04"):
+        with pytest.raises(UnsupportedError):
+            iso.get_ubuntu_release(release, ubuntu)
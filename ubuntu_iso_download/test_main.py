@@ -0,0 +1,122 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test main module."""
+import json
+import sys
+
+import pytest
+
+from tests.imports import import_times, run_python
+
+from . import iso
+from .__main__ import launch
+from .errors import UnsupportedError
+from .index import TargetIndex
+from .test_index import Data
+
+HEAVY = (
+    "gnupg",
+    "requests",
+    "tqdm",
+    "ubuntu_release_info",
+    "urllib3",
+    "yaml",
+)
+
+
+def test_help_imports():
+    """--help does not import the download dependencies."""
+    stdout, _ = run_python(
+        "import json, sys\n"
+        "from ubuntu_iso_download.__main__ import parse_args\n"
+        "try:\n"
+        "    parse_args(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+    modules = json.loads(stdout.splitlines()[-1])
+
+    assert [module for module in HEAVY if module in modules] == []
+
+
+def test_import_light():
+    """Importing the main module leaves the heavy dependencies out.
+
+    The start-up time itself is measured in benchmarks/test_startup.py.
+    """
+    stdout, report = run_python(
+        "import json, sys\n"
+        "import ubuntu_iso_download.__main__\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+    modules = json.loads(stdout.splitlines()[-1])
+
+    assert [module for module in HEAVY if module in modules] == []
+    assert "ubuntu_iso_download.__main__" in import_times(report)
+
+
+def run_launch(monkeypatch, capsys, *argv):
+    """Run the command line and return its exit code and JSON output."""
+    monkeypatch.setattr(sys, "argv", ["ubuntu-iso"] + list(argv))
+    with pytest.raises(SystemExit) as exit:
+        launch()
+    return exit.value.code, json.loads(capsys.readouterr().out)
+
+
+def test_json_dry_run(tmp_path, monkeypatch, capsys):
+    """A dry run prints the resolved target as JSON."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    TargetIndex().build(Data())
+
+    code, result = run_launch(
+        monkeypatch, capsys, "server", "20.04", "--dry-run", "--json"
+    )
+
+    assert not code
+    assert result["status"] == "ok"
+    assert result["url"] == "http://releases.ubuntu.com/20.04.3"
+    assert result["filename"] == "ubuntu-20.04.3-live-server-amd64.iso"
+
+
+def test_json_dry_run_arches(tmp_path, monkeypatch, capsys):
+    """Every --arch gets its own JSON line."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    TargetIndex().build(Data())
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["ubuntu-iso", "server", "focal", "--arch", "arm64", "--arch", "amd64"]
+        + ["--arch", "arm64", "--dry-run", "--json"],
+    )
+
+    with pytest.raises(SystemExit) as exit:
+        launch()
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert not exit.value.code
+    assert [result["arch"] for result in results] == ["arm64", "amd64"]
+    assert results[0]["url"] == (
+        "http://cdimage.ubuntu.com/ubuntu/releases/focal/release"
+    )
+    assert results[0]["filename"] == "ubuntu-20.04.3-live-server-arm64.iso"
+    assert results[1]["url"] == "http://releases.ubuntu.com/20.04.3"
+
+
+def test_json_error(tmp_path, monkeypatch, capsys):
+    """Errors are reported as JSON with their type and a failing exit."""
+
+    def unsupported(*args, **kwargs):
+        raise UnsupportedError("The netboot ISO was discontinued after 19.10.")
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(iso, "ISO", unsupported)
+
+    code, result = run_launch(monkeypatch, capsys, "netboot", "focal", "--json")
+
+    assert code == 1
+    assert result["status"] == "error"
+    assert result["flavor"] == "netboot"
+    assert result["error"] == {
+        "type": "UnsupportedError",
+        "message": "The netboot ISO was discontinued after 19.10.",
+    }
@@ -0,0 +1,102 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test metrics module."""
+import json
+import time
+
+import pytest
+
+from .metrics import JsonLines, Metrics, Timings
+
+
+def test_timer():
+    """A phase is reported once with its labels, fields, and time."""
+    records = []
+    metrics = Metrics([records.append], release="focal")
+
+    with metrics.timer("download", connections=4) as phase:
+        time.sleep(0.01)
+        phase["bytes"] = 100
+
+    [record] = records
+    assert record["event"] == "phase"
+    assert record["phase"] == "download"
+    assert record["release"] == "focal"
+    assert record["connections"] == 4
+    assert record["bytes"] == 100
+    assert record["ok"] is True
+    assert record["seconds"] >= 0.01
+
+
+def test_timer_failure():
+    """A phase ending in an exception is reported as failed."""
+    records = []
+    metrics = Metrics([records.append])
+
+    with pytest.raises(SystemExit):
+        with metrics.timer("hash"):
+            raise SystemExit(1)
+
+    assert records[0]["ok"] is False
+
+
+def test_labeled():
+    """Labeled metrics share the hooks and add to the labels."""
+    records = []
+    metrics = Metrics(release="focal")
+    child = metrics.labeled(arch="arm64")
+    metrics.add_hook(records.append)
+
+    child.emit("phase", phase="gpg")
+
+    assert records[0]["release"] == "focal"
+    assert records[0]["arch"] == "arm64"
+    assert "arch" not in metrics.labels
+
+
+def test_json_lines(tmp_path):
+    """Records are appended as one JSON object per line."""
+    path = str(tmp_path / "metrics.jsonl")
+    metrics = Metrics([JsonLines(path)], arch="amd64")
+
+    metrics.emit("phase", phase="hash")
+    metrics.emit("phase", phase="gpg")
+
+    lines = [json.loads(line) for line in open(path)]
+    assert [line["phase"] for line in lines] == ["hash", "gpg"]
+    assert lines[1]["arch"] == "amd64"
+
+
+def test_timings():
+    """Totals add up time spent in blocks and iterations."""
+    timings = Timings()
+    timings.add("bytes", 10)
+    timings.add("bytes", 5)
+    timings.setdefault("first_byte_seconds", 1)
+    timings.setdefault("first_byte_seconds", 2)
+    with timings.timed("write_seconds"):
+        time.sleep(0.01)
+
+    def slow():
+        for item in range(2):
+            time.sleep(0.01)
+            yield item
+
+    assert list(timings.iterate("read_seconds", slow())) == [0, 1]
+    assert timings.totals["bytes"] == 15
+    assert timings.totals["first_byte_seconds"] == 1
+    assert timings.totals["write_seconds"] >= 0.01
+    assert timings.totals["read_seconds"] >= 0.02
+
+
+def test_overhead():
+    """Timing a phase without hooks costs next to nothing."""
+    metrics = Metrics().labeled(release="focal")
+    count = 10000
+
+    start = time.perf_counter()
+    for _ in range(count):
+        with metrics.timer("hash"):
+            pass
+
+    # a few microseconds each, against seconds for any real phase
+    assert (time.perf_counter() - start) / count < 50e-6
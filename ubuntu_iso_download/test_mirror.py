@@ -0,0 +1,55 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test mirror module."""
+from .mirror import MirrorRanker, probe, read_mirror_list
+from .session import create_session
+
+CONTENT = b"ubuntu" * 100000
+
+
+def test_read_mirror_list(tmp_path):
+    """Comments and blank lines are skipped."""
+    mirror_list = tmp_path / "mirrors"
+    mirror_list.write_text(
+        "# preferred\nhttp://one.example.com/ubuntu\n\n"
+        "http://two.example.com/ubuntu  # backup\n"
+    )
+
+    assert read_mirror_list(str(mirror_list)) == [
+        "http://one.example.com/ubuntu",
+        "http://two.example.com/ubuntu",
+    ]
+
+
+def test_probe(http_server):
+    """Probes fetch only the start of the file."""
+    http_server.files["/focal/ubuntu.iso"] = CONTENT
+
+    result = probe(http_server.url + "/focal/ubuntu.iso", size=1024)
+    assert result["ok"]
+    assert result["latency"] >= 0
+    assert result["throughput"] > 0
+    assert http_server.requests[-1][2]["Range"] == "bytes=0-1023"
+
+    assert not probe(http_server.url + "/missing.iso")["ok"]
+    session = create_session(retries=0)
+    assert not probe("http://127.0.0.1:1/ubuntu.iso", session=session)["ok"]
+
+
+def test_rank(monkeypatch):
+    """Mirrors without the ISO are dropped and results are cached."""
+    urls = ["http://a/ubuntu.iso", "http://missing/ubuntu.iso", "http://b/ubuntu.iso"]
+    speeds = {urls[0]: 10.0, urls[2]: 20.0}
+    probed = []
+
+    def fake_probe(url, size, session=None):
+        probed.append(url)
+        return {"ok": url in speeds, "latency": 0.1, "throughput": speeds.get(url, 0)}
+
+    monkeypatch.setattr("ubuntu_iso_download.mirror.probe", fake_probe)
+
+    assert MirrorRanker().rank(urls) == [urls[2], urls[0]]
+    assert MirrorRanker().rank(urls) == [urls[2], urls[0]]
+    assert len(probed) == 3
+
+    MirrorRanker(ttl=0).rank(urls)
+    assert len(probed) == 6
@@ -0,0 +1,79 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test output module."""
+import concurrent.futures
+import os
+import tempfile
+
+import pytest
+
+from .output import OutputFile
+
+SIZE = 8 * 1024 * 1024
+SEGMENT = 1024 * 1024
+
+
+def write_segments(path, preallocate=True):
+    """Write SIZE bytes in reverse order from several threads."""
+    content = os.urandom(SIZE)
+    with OutputFile(path, SIZE, preallocate=preallocate) as output:
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            for start in reversed(range(0, SIZE, SEGMENT)):
+                end = start + SEGMENT
+                executor.submit(output.write, start, content[start:end])
+
+    return content
+
+
+def test_out_of_order_writes(tmp_path):
+    """Segments land at their offsets no matter the order."""
+    path = str(tmp_path / "x.iso.part")
+    content = write_segments(path)
+
+    assert open(path, "rb").read() == content
+
+
+def test_sparse(tmp_path):
+    """Without preallocation only the written blocks are allocated."""
+    path = str(tmp_path / "x.iso.part")
+    with OutputFile(path, SIZE, preallocate=False) as output:
+        output.write(SIZE - 4096, b"x" * 4096)
+
+    stat = os.stat(path)
+    assert stat.st_size == SIZE
+    assert stat.st_blocks * 512 < SIZE
+    with open(path, "rb") as file:
+        assert file.read(4096) == b"\x00" * 4096
+
+
+def test_preallocate(tmp_path):
+    """Preallocation reserves every block where supported."""
+    path = str(tmp_path / "x.iso.part")
+    with OutputFile(path, SIZE) as output:
+        if not output.preallocated:
+            pytest.skip("fallocate not supported here")
+
+    assert os.stat(path).st_blocks * 512 >= SIZE
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="no tmpfs at /dev/shm")
+def test_tmpfs():
+    """Downloads into tmpfs work the same."""
+    with tempfile.TemporaryDirectory(dir="/dev/shm") as directory:
+        path = os.path.join(directory, "x.iso.part")
+        content = write_segments(path)
+        assert open(path, "rb").read() == content
+
+
+def test_regions(tmp_path):
+    """Completed regions are read back as memoryviews."""
+    path = str(tmp_path / "x.iso")
+    content = write_segments(path)
+
+    with OutputFile(path) as output:
+        views = [bytes(view) for view in output.regions(100, SIZE, size=SEGMENT)]
+        with output.region(0, 10) as view:
+            assert isinstance(view, memoryview)
+            assert view == content[:10]
+
+    assert b"".join(views) == content[100:]
+    assert len(views) == SIZE // SEGMENT
@@ -0,0 +1,97 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test pipeline module."""
+import hashlib
+import io
+import os
+
+import pytest
+
+from .metrics import Timings
+from .output import OutputFile
+from .pipeline import BufferPool, Pipeline, file_digests
+
+CONTENT = os.urandom(5 * 1024 * 1024 + 321)
+
+
+def test_write_and_hash(tmp_path):
+    """Every buffer is written at its offset and hashed in order."""
+    path = str(tmp_path / "x.iso.part")
+    reads = []
+    with OutputFile(path, len(CONTENT)) as output:
+        digests = Pipeline(output, algorithms=("sha256", "sha512")).run(
+            io.BytesIO(CONTENT).readinto, reads.append
+        )
+
+    assert open(path, "rb").read() == CONTENT
+    assert digests == {
+        "sha256": hashlib.sha256(CONTENT).hexdigest(),
+        "sha512": hashlib.sha512(CONTENT).hexdigest(),
+    }
+    assert sum(reads) == len(CONTENT)
+
+
+def test_offset(tmp_path):
+    """Writes start at the given offset."""
+    path = str(tmp_path / "x.iso.part")
+    with OutputFile(path, 10 + len(CONTENT)) as output:
+        Pipeline(output, offset=10).run(io.BytesIO(CONTENT).readinto)
+
+    assert open(path, "rb").read()[10:] == CONTENT
+
+
+def test_bounded():
+    """A small pool is reused for the whole stream and fully returned."""
+    pool = BufferPool(count=2, size=4096)
+    digests = Pipeline(pool=pool).run(io.BytesIO(CONTENT).readinto)
+
+    assert digests["sha256"] == hashlib.sha256(CONTENT).hexdigest()
+    assert pool._free.qsize() == 2
+
+
+def test_timings(tmp_path):
+    """The busy time of every stage is added up."""
+    path = str(tmp_path / "x.iso.part")
+    timings = Timings()
+    with OutputFile(path, len(CONTENT)) as output:
+        Pipeline(output, timings=timings).run(io.BytesIO(CONTENT).readinto)
+
+    assert sorted(timings.totals) == ["hash_seconds", "read_seconds", "write_seconds"]
+    assert all(seconds > 0 for seconds in timings.totals.values())
+
+
+def test_error(tmp_path):
+    """A failing consumer stops the pipeline and raises."""
+    path = str(tmp_path / "x.iso.part")
+    with OutputFile(path, len(CONTENT)) as output:
+        pipeline = Pipeline(output)
+
+        def fail(view, offset):
+            raise OSError("disk full")
+
+        pipeline._write = fail
+        with pytest.raises(OSError):
+            pipeline.run(io.BytesIO(CONTENT).readinto)
+
+
+def test_file_digests(tmp_path):
+    """Digests of a file on disk."""
+    path = tmp_path / "x.iso"
+    path.write_bytes(CONTENT)
+
+    assert file_digests(str(path), ["sha256", "md5"]) == {
+        "sha256": hashlib.sha256(CONTENT).hexdigest(),
+        "md5": hashlib.md5(CONTENT).hexdigest(),
+    }
+
+
+def test_no_consumers():
+    """Without output or digests the stream is only read."""
+    reads = []
+    pool = BufferPool(count=2, size=4096)
+    assert (
+        Pipeline(algorithms=(), pool=pool).run(
+            io.BytesIO(CONTENT).readinto, reads.append
+        )
+        == {}
+    )
+    assert sum(reads) == len(CONTENT)
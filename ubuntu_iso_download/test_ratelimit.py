@@ -0,0 +1,86 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test ratelimit module."""
+import pytest
+
+from .ratelimit import Bandwidth, TokenBucket, fair_shares, parse_rate
+
+
+class Clock:
+    """Fake clock advanced by sleeping."""
+
+    def __init__(self):
+        """Initialize clock."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+    def sleep(self, seconds):
+        """Advance the time."""
+        self.now += seconds
+
+
+def test_parse_rate():
+    """Rates with units."""
+    assert parse_rate("50M") == 50 * 1024**2
+    assert parse_rate("512k/s") == 512 * 1024
+    assert parse_rate("1.5KB") == 1536
+    assert parse_rate(1000) == 1000
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+def test_token_bucket():
+    """The average rate holds whatever the chunk size."""
+    clock = Clock()
+    bucket = TokenBucket(1000, clock=clock, sleep=clock.sleep)
+
+    for _ in range(10):
+        bucket.consume(500)
+    assert clock.now == pytest.approx(5.0)
+
+    bucket.consume(3000)
+    assert clock.now == pytest.approx(8.0)
+
+
+def test_token_bucket_burst():
+    """Idle time fills the bucket up to its burst size only."""
+    clock = Clock()
+    bucket = TokenBucket(1000, burst=2000, clock=clock, sleep=clock.sleep)
+
+    clock.now = 100.0
+    assert bucket.consume(2000) == 0
+    assert bucket.consume(1000) == pytest.approx(1.0)
+
+
+def test_unlimited():
+    """A rate of zero never sleeps."""
+    clock = Clock()
+    bucket = TokenBucket(0, clock=clock, sleep=clock.sleep)
+    bucket.consume(10**12)
+    assert clock.now == 0
+
+
+def test_fair_shares():
+    """Weights split the rate and unused capped rate is redistributed."""
+    assert fair_shares(900, [(1, 0), (2, 0)]) == [300, 600]
+    assert fair_shares(900, [(1, 100), (1, 0), (1, 0)]) == [100, 400, 400]
+    assert fair_shares(900, [(1, 1000), (1, 1000)]) == [450, 450]
+    assert fair_shares(0, [(1, 0), (1, 200)]) == [0, 200]
+
+
+def test_bandwidth():
+    """Shares are rebalanced as downloads start and finish."""
+    clock = Clock()
+    bandwidth = Bandwidth(1000, clock=clock, sleep=clock.sleep)
+
+    first = bandwidth.share()
+    assert first.rate == 1000
+
+    with bandwidth.share(weight=3) as second:
+        assert first.rate == 250
+        assert second.rate == 750
+
+    assert first.rate == 1000
+    assert bandwidth.shares == [first]
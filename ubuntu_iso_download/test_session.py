@@ -0,0 +1,35 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test session module."""
+from .session import create_session, get_session
+
+
+def test_keep_alive(http_server):
+    """Requests to the same host reuse one connection."""
+    http_server.files["/SHA256SUMS"] = b"hashes"
+    session = create_session()
+
+    for _ in range(5):
+        assert session.get(http_server.url + "/SHA256SUMS").content == b"hashes"
+
+    assert len(http_server.clients) == 1
+
+
+def test_retry(http_server):
+    """Transient server errors are retried."""
+    http_server.files["/SHA256SUMS"] = b"hashes"
+    http_server.failures = 2
+
+    response = create_session(retries=2, backoff=0).get(http_server.url + "/SHA256SUMS")
+    assert response.status_code == 200
+    assert len(http_server.requests) == 3
+
+    http_server.failures = 2
+    response = create_session(retries=1, backoff=0).get(http_server.url + "/SHA256SUMS")
+    assert response.status_code == 503
+
+
+def test_default_timeout():
+    """Every adapter carries the default timeout."""
+    session = create_session(timeout=7)
+    assert session.get_adapter("https://example.com").timeout == 7
+    assert get_session() is get_session()
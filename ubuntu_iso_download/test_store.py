@@ -0,0 +1,75 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test store module."""
+import os
+
+import pytest
+
+from .store import Store
+
+SHA_A = "a" * 64
+SHA_B = "b" * 64
+SHA_C = "c" * 64
+
+
+def add(store, tmp_path, sha256, size, atime):
+    """Add a file of a given size and access time to the store."""
+    filename = str(tmp_path / sha256)
+    with open(filename, "wb") as file:
+        file.write(b"x" * size)
+
+    store.add(filename, sha256)
+    os.utime(store.entry(sha256), (atime, atime))
+
+
+def test_add_and_materialize(tmp_path):
+    """ISOs are linked from the store."""
+    store = Store(str(tmp_path / "store"))
+    add(store, tmp_path, SHA_A, 10, 1)
+
+    assert SHA_A in store
+    assert SHA_B not in store
+    assert store.entries() == [SHA_A]
+
+    destination = str(tmp_path / "ubuntu.iso")
+    assert store.materialize(SHA_A, destination) == "hardlink"
+    assert os.path.samefile(destination, store.entry(SHA_A))
+
+
+def test_materialize_copy(tmp_path, monkeypatch):
+    """Fall back to a copy when links and reflinks are unavailable."""
+    store = Store(str(tmp_path / "store"))
+    add(store, tmp_path, SHA_A, 10, 1)
+
+    def fail(*args):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(os, "link", fail)
+    monkeypatch.setattr(Store, "_reflink", staticmethod(fail))
+
+    destination = str(tmp_path / "ubuntu.iso")
+    assert store.materialize(SHA_A, destination) == "copy"
+    assert not os.path.samefile(destination, store.entry(SHA_A))
+    assert open(destination, "rb").read() == b"x" * 10
+
+
+def test_evict(tmp_path):
+    """Least recently used ISOs are evicted, skipping locked ones."""
+    store = Store(str(tmp_path / "store"), max_size=25)
+    add(store, tmp_path, SHA_A, 10, 1)
+    add(store, tmp_path, SHA_B, 10, 2)
+    add(store, tmp_path, SHA_C, 10, 3)
+
+    with store.lock(SHA_A):
+        assert store.evict(keep=SHA_C) == [SHA_B]
+
+    assert sorted(store.entries()) == [SHA_A, SHA_C]
+
+
+def test_lock_nonblocking(tmp_path):
+    """A held lock cannot be taken without blocking."""
+    store = Store(str(tmp_path / "store"))
+
+    with store.lock(SHA_A):
+        with pytest.raises(BlockingIOError):
+            with Store(store.path).lock(SHA_A, blocking=False):
+                pass
@@ -2,6 +2,7 @@
 """Test url module."""
 import pytest
 
+from .errors import UnsupportedError
 from .url import (
     Budgie,
     Desktop,
@@ -36,6 +37,8 @@ class Release:
 XENIAL = Release("xenial", False, True, "16.04", 4, 16)
 BIONIC = Release("bionic", False, True, "18.04", 4, 18)
 DISCO = Release("disco", True, False, "19.04", 4, 19)
+FOCAL = Release("focal", False, True, "20.04.3", 4, 20)
+JAMMY = Release("jammy", False, True, "22.04", 4, 22)
 
 
 def test_url():
@@ -184,10 +187,57 @@ def test_netboot_ppc64el():
     arch = "ppc64el"
     release = DISCO
 
-    with pytest.raises(SystemExit):
+    with pytest.raises(UnsupportedError):
         Netboot(release, arch)
 
 
+@pytest.mark.parametrize("arch", ["arm64", "ppc64el", "s390x"])
+def test_server_ports(arch):
+    """Server ports come from cdimage, whatever the mirror."""
+    url = Server(FOCAL, arch, "http://mirror.example.com/ubuntu-releases")
+
+    assert url.url == "http://cdimage.ubuntu.com/ubuntu/releases/focal/release"
+    assert Server(FOCAL, "amd64").url == "http://releases.ubuntu.com/20.04.3"
+
+
+def test_server_ports_devel():
+    """Daily server ports share the daily directory."""
+    url = Server(DISCO, "s390x")
+
+    assert url.url == "http://cdimage.ubuntu.com/ubuntu-server/daily-live/current"
+
+
+def test_server_riscv64():
+    """riscv64 server ISOs start with 22.04."""
+    assert Server(JAMMY, "riscv64").url == (
+        "http://cdimage.ubuntu.com/ubuntu/releases/jammy/release"
+    )
+    with pytest.raises(UnsupportedError):
+        Server(FOCAL, "riscv64")
+
+
+@pytest.mark.parametrize(
+    "url_class, release, arch",
+    [
+        (Desktop, FOCAL, "arm64"),
+        (Desktop, BIONIC, "i386"),
+        (Server, BIONIC, "i386"),
+        (Kubuntu, FOCAL, "arm64"),
+        (Xubuntu, FOCAL, "i386"),
+    ],
+)
+def test_unsupported_arch(url_class, release, arch):
+    """Flavors only resolve for the architectures they are built for."""
+    with pytest.raises(UnsupportedError):
+        url_class(release, arch)
+
+
+def test_supported_i386():
+    """Older releases still resolve for i386."""
+    assert Server(XENIAL, "i386").url == "http://releases.ubuntu.com/16.04"
+    assert Xubuntu(BIONIC, "i386").arch == "i386"
+
+
 def test_budgie_stable():
     """Test budgie stable url."""
     arch = "amd64"
@@ -215,7 +265,7 @@ def test_budgie_unsupported():
     arch = "amd64"
     release = XENIAL
 
-    with pytest.raises(SystemExit):
+    with pytest.raises(UnsupportedError):
         Budgie(release, arch)
 
 
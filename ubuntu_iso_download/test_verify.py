@@ -0,0 +1,148 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test verify module."""
+import hashlib
+import os
+import shutil
+
+import pytest
+
+from tests.fakemirror import FakeMirror
+
+from .pipeline import BufferPool, Pipeline
+from .verify import Library, Reader
+
+DIRECTORY = "ubuntu/releases/focal/release"
+OLD_DIRECTORY = "ubuntu/releases/20.04.2"
+SERVER = "ubuntu-20.04.3-live-server-amd64.iso"
+DESKTOP = "ubuntu-20.04.3-desktop-amd64.iso"
+OLD_SERVER = "ubuntu-20.04.2-live-server-amd64.iso"
+NETBOOT = "ubuntu/dists/bionic/main/installer-%s/current/images"
+SIZE = 2 * 1024 * 1024 + 17
+
+
+class Index:
+    """Dummy target index."""
+
+    def __init__(self, sources):
+        """Initialize index."""
+        self.data = sources
+
+    def load(self):
+        """Return the index."""
+        return self.data
+
+    def sources(self):
+        """Return the directory URL of every filename."""
+        return self.data
+
+
+@pytest.mark.parametrize("direct, drop_cache", [(False, False), (True, True)])
+def test_reader(tmp_path, direct, drop_cache):
+    """Files are read whole, with or without the page cache."""
+    path = str(tmp_path / "x.iso")
+    content = os.urandom(SIZE)
+    with open(path, "wb") as iso:
+        iso.write(content)
+
+    with Reader(path, direct, drop_cache) as reader:
+        pool = BufferPool(2, 1024 * 1024, aligned=True)
+        digests = Pipeline(pool=pool).run(reader.readinto)
+
+    assert digests["sha256"] == hashlib.sha256(content).hexdigest()
+    assert reader.offset == SIZE
+
+
+def test_library(signing_key, tmp_path, monkeypatch):
+    """ISOs are matched by name and reported by outcome."""
+    keyring = tmp_path / "snap" / "usr" / "share" / "keyrings"
+    keyring.mkdir(parents=True)
+    (keyring / "ubuntu-archive-keyring.gpg").write_bytes(signing_key.keyring)
+    monkeypatch.setenv("SNAP", str(tmp_path / "snap"))
+
+    with FakeMirror(str(tmp_path / "mirror")) as mirror:
+        url = mirror.add_release(DIRECTORY, {SERVER: SIZE, DESKTOP: SIZE}, signing_key)
+        old_url = mirror.add_release(OLD_DIRECTORY, {OLD_SERVER: SIZE}, signing_key)
+
+        library = tmp_path / "library"
+        (library / "old").mkdir(parents=True)
+        for directory, name in [
+            (DIRECTORY, SERVER),
+            (DIRECTORY, DESKTOP),
+            (OLD_DIRECTORY, OLD_SERVER),
+        ]:
+            target = library / ("old" if directory == OLD_DIRECTORY else "")
+            shutil.copy(os.path.join(mirror.root, directory, name), str(target / name))
+        with open(str(library / DESKTOP), "r+b") as iso:
+            iso.write(b"corrupt")
+        (library / "custom.iso").write_bytes(b"custom")
+
+        results = Library(
+            str(library),
+            hash_files=[old_url + "/SHA256SUMS"],
+            gpg="python",
+            jobs=2,
+            index=Index({SERVER: [url], DESKTOP: [url]}),
+        ).run()
+
+    requests = [path for _, path, _ in mirror.requests]
+    statuses = {os.path.basename(result["path"]): result for result in results}
+
+    assert requests.count("/%s/SHA256SUMS" % DIRECTORY) == 1
+    assert not [path for path in requests if path.endswith(".iso")]
+    assert statuses[SERVER]["status"] == "ok"
+    assert statuses[SERVER]["source"] == url + "/SHA256SUMS"
+    assert statuses[DESKTOP]["status"] == "mismatch"
+    assert statuses[OLD_SERVER]["status"] == "ok"
+    assert statuses["custom.iso"]["status"] == "unknown"
+    assert statuses["custom.iso"]["actual"] == ""
+
+
+def test_library_links_and_netboot(signing_key, tmp_path, monkeypatch):
+    """Symlinks are skipped and a mini.iso is found under netboot/."""
+    keyring = tmp_path / "snap" / "usr" / "share" / "keyrings"
+    keyring.mkdir(parents=True)
+    (keyring / "ubuntu-archive-keyring.gpg").write_bytes(signing_key.keyring)
+    monkeypatch.setenv("SNAP", str(tmp_path / "snap"))
+
+    with FakeMirror(str(tmp_path / "mirror")) as mirror:
+        url = mirror.add_release(DIRECTORY, {SERVER: SIZE}, signing_key)
+        sources = {SERVER: [url], "netboot/mini.iso": []}
+        for arch, size in [("amd64", SIZE), ("i386", SIZE + 1)]:
+            sources["netboot/mini.iso"].append(
+                mirror.add_release(
+                    NETBOOT % arch, {"netboot/mini.iso": size}, signing_key
+                )
+            )
+
+        # a watch target directory, plus a netboot ISO as downloaded
+        library = tmp_path / "library"
+        image = library / "server-focal-amd64" / "abc"
+        image.mkdir(parents=True)
+        shutil.copy(os.path.join(mirror.root, DIRECTORY, SERVER), str(image / SERVER))
+        (library / "server-focal-amd64" / "current.iso").symlink_to("abc/" + SERVER)
+        (library / "dangling.iso").symlink_to("missing.iso")
+        shutil.copy(
+            os.path.join(mirror.root, NETBOOT % "i386", "netboot", "mini.iso"),
+            str(library / "mini.iso"),
+        )
+
+        results = Library(
+            str(library), gpg="python", jobs=2, index=Index(sources)
+        ).run()
+
+    assert [os.path.basename(result["path"]) for result in results] == [
+        "mini.iso",
+        SERVER,
+    ]
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert results[0]["source"] == sources["netboot/mini.iso"][1] + "/SHA256SUMS"
+
+
+def test_expect_vanished(tmp_path):
+    """An ISO that cannot be read is reported as an error."""
+    result = Library(str(tmp_path), index=Index({}))._expect(
+        str(tmp_path / "gone.iso"), {}, {}
+    )
+
+    assert result["status"] == "error"
+    assert "gone.iso" in result["error"]
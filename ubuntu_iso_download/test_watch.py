@@ -0,0 +1,222 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test watch module."""
+import asyncio
+import os
+import re
+
+import pytest
+
+from tests.fakemirror import FakeMirror, release_data
+
+from .batch import Entry
+from .errors import DownloadError, SignatureError
+from .test_zsync import make_control
+from .url import FLAVORS
+from .watch import CURRENT, PREVIOUS, Watch
+
+DIRECTORY = "ubuntu/releases/focal/release"
+OLD = "ubuntu-20.04.3-live-server-amd64.iso"
+NEW = "ubuntu-20.04.4-live-server-amd64.iso"
+SIZE = 2 * 1024 * 1024 + 17
+
+
+def ranged_bytes(requests, path):
+    """Return the bytes requested from a file with Range requests."""
+    fetched = 0
+    for _, request_path, headers in requests:
+        match = re.match(r"bytes=(\d+)-(\d+)", headers.get("Range", ""))
+        if request_path == path and match:
+            fetched += int(match.group(2)) - int(match.group(1)) + 1
+    return fetched
+
+
+def poll(watch):
+    """Poll once on a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(watch.poll())
+    finally:
+        loop.close()
+
+
+def test_watch(signing_key, tmp_path, monkeypatch):
+    """ISOs are only fetched when their hash changes, then by delta."""
+    keyring = tmp_path / "snap" / "usr" / "share" / "keyrings"
+    keyring.mkdir(parents=True)
+    (keyring / "ubuntu-archive-keyring.gpg").write_bytes(signing_key.keyring)
+    monkeypatch.setenv("SNAP", str(tmp_path / "snap"))
+
+    with FakeMirror(str(tmp_path / "mirror")) as mirror:
+        monkeypatch.setitem(FLAVORS, "fake", mirror.flavor(DIRECTORY))
+        mirror.add_release(DIRECTORY, {OLD: SIZE}, signing_key)
+        entry = Entry("fake", "focal")
+        watch = Watch(
+            [entry], str(tmp_path / "isos"), ubuntu=release_data(), gpg="python"
+        )
+        target = watch.target_directory(entry)
+        old_digest = mirror.isos["%s/%s" % (DIRECTORY, OLD)]
+
+        assert poll(watch)
+        assert entry.status == "updated"
+        old_link = "%s/%s" % (old_digest, OLD)
+        assert os.readlink(os.path.join(target, CURRENT)) == old_link
+
+        del mirror.requests[:]
+        assert poll(watch)
+        assert entry.status == "current"
+        assert not [path for _, path, _ in mirror.requests if path.endswith(".iso")]
+
+        # a point release, published with a control file for zsync
+        os.remove(os.path.join(mirror.root, DIRECTORY, OLD))
+        mirror.add_release(DIRECTORY, {NEW: SIZE}, signing_key)
+        new_path = os.path.join(mirror.root, DIRECTORY, NEW)
+        with open(new_path, "rb") as iso, open(new_path + ".zsync", "wb") as control:
+            control.write(make_control(iso.read(), url=NEW))
+        new_digest = mirror.isos["%s/%s" % (DIRECTORY, NEW)]
+
+        del mirror.requests[:]
+        assert poll(watch)
+
+    assert entry.status == "updated"
+    assert entry.target_hash == new_digest
+    assert os.readlink(os.path.join(target, CURRENT)) == "%s/%s" % (new_digest, NEW)
+    assert os.readlink(os.path.join(target, PREVIOUS)) == old_link
+    assert sorted(os.listdir(target)) == sorted(
+        [CURRENT, PREVIOUS, old_digest, new_digest]
+    )
+
+    path = "/%s/%s" % (DIRECTORY, NEW)
+    assert 0 < ranged_bytes(mirror.requests, path) < SIZE // 10
+    assert all(
+        "Range" in headers
+        for _, request_path, headers in mirror.requests
+        if request_path == path
+    )
+
+
+def test_watch_netboot(signing_key, tmp_path, monkeypatch):
+    """ISOs listed below a directory are kept under their own name."""
+    keyring = tmp_path / "snap" / "usr" / "share" / "keyrings"
+    keyring.mkdir(parents=True)
+    (keyring / "ubuntu-archive-keyring.gpg").write_bytes(signing_key.keyring)
+    monkeypatch.setenv("SNAP", str(tmp_path / "snap"))
+
+    with FakeMirror(str(tmp_path / "mirror")) as mirror:
+        monkeypatch.setitem(FLAVORS, "fake", mirror.flavor(DIRECTORY, "mini"))
+        mirror.add_release(DIRECTORY, {"netboot/mini.iso": SIZE}, signing_key)
+        entry = Entry("fake", "focal")
+        watch = Watch(
+            [entry], str(tmp_path / "isos"), ubuntu=release_data(), gpg="python"
+        )
+
+        assert poll(watch)
+
+    digest = mirror.isos["%s/netboot/mini.iso" % DIRECTORY]
+    current = os.path.join(watch.target_directory(entry), CURRENT)
+    assert entry.status == "updated"
+    assert entry.filename == "netboot/mini.iso"
+    assert os.readlink(current) == "%s/mini.iso" % digest
+    assert os.path.getsize(current) == SIZE
+
+
+def test_watch_failure(tmp_path, monkeypatch):
+    """A target that cannot be polled is reported as failed."""
+    monkeypatch.setenv("SNAP", str(tmp_path / "missing"))
+    entry = Entry("server", "focal")
+    watch = Watch([entry], str(tmp_path / "isos"), ubuntu=release_data())
+
+    assert not watch.run(cycles=1)
+    assert entry.status == "failed"
+    assert isinstance(entry.error, SignatureError)
+    assert not (tmp_path / "isos").exists()
+
+
+def test_watch_isolates_targets(tmp_path, monkeypatch):
+    """An unexpected error or a stalled target only fails that target."""
+    broken, stalled, fine = Entry("server"), Entry("desktop"), Entry("kubuntu")
+    watch = Watch([broken, stalled, fine], str(tmp_path), ubuntu=release_data())
+    watch.timeout = 0.2
+
+    async def update(entry):
+        if entry is broken:
+            raise ValueError("bad SHA256SUMS line")
+        if entry is stalled:
+            await asyncio.sleep(60)
+        entry.status = "current"
+
+    monkeypatch.setattr(watch, "update", update)
+
+    assert not poll(watch)
+    assert broken.status == stalled.status == "failed"
+    assert isinstance(broken.error, ValueError)
+    assert isinstance(stalled.error, asyncio.TimeoutError)
+    assert fine.status == "current"
+
+
+def test_get_keeps_existing_image(tmp_path):
+    """A failed attempt never removes an image that was already there."""
+    entry = Entry("server", "focal")
+    entry.filename, entry.target_hash = "x.iso", "a" * 64
+    watch = Watch([entry], str(tmp_path), ubuntu=release_data())
+    image = tmp_path / watch.target_directory(entry) / entry.target_hash
+    image.mkdir(parents=True)
+    (image / "x.iso").write_bytes(b"previous")
+
+    class FailingISO:
+        """AsyncISO whose downloads fail."""
+
+        async def select_mirror(self):
+            raise DownloadError("HTTP 503")
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(DownloadError):
+            loop.run_until_complete(watch._get(entry, FailingISO(), ""))
+    finally:
+        loop.close()
+
+    assert (image / "x.iso").read_bytes() == b"previous"
+
+
+def test_download_per_host(tmp_path):
+    """At most per_host targets download from one host at once."""
+    entries = [Entry("server"), Entry("desktop"), Entry("kubuntu")]
+    watch = Watch(entries, str(tmp_path), per_host=2, ubuntu=release_data())
+    running = []
+    most = []
+
+    class Target:
+        """URL target on one host."""
+
+        url = "http://cdimage.ubuntu.com/releases"
+
+    class SlowISO:
+        """AsyncISO whose downloads take a while."""
+
+        target = Target()
+        stripes = []
+
+        async def select_mirror(self):
+            return self.target
+
+        async def download(self, destination=None, seed=None):
+            running.append(destination)
+            most.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(destination)
+
+    async def download():
+        for entry in entries:
+            entry.iso = SlowISO()
+        await asyncio.gather(
+            *[watch._download(entry, entry.iso, str(entry), "") for entry in entries]
+        )
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(download())
+    finally:
+        loop.close()
+
+    assert max(most) == 2
+    assert running == []
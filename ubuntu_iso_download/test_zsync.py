@@ -0,0 +1,169 @@
+# This file is part of ubuntu-iso-download. See LICENSE file for license info.
+"""Test zsync module."""
+import hashlib
+import os
+import re
+
+import pytest
+
+from .download import DownloadError
+from .zsync import Control, Delta, _md4, block_sums, md4, piece_sums
+
+BLOCKSIZE = 4096
+
+
+def make_control(content, blocksize=BLOCKSIZE, url="x.iso", seq_matches=2):
+    """Return a control file for content as zsyncmake writes it."""
+    header = (
+        "zsync: 0.6.2\nFilename: x.iso\nBlocksize: %s\nLength: %s\n"
+        "Hash-Lengths: %s,2,8\nURL: %s\n\n"
+        % (blocksize, len(content), seq_matches, url)
+    )
+    body = b""
+    for start in range(0, len(content), blocksize):
+        end = start + blocksize
+        block = content[start:end].ljust(blocksize, b"\x00")
+        a, b = block_sums(block)
+        body += ((a << 16 | b) & 0xFFFF).to_bytes(2, "big") + md4(block)[:8]
+
+    return header.encode() + body
+
+
+def test_md4():
+    """The pure Python MD4 matches the RFC 1320 test vectors."""
+    assert _md4(b"").hex() == "31d6cfe0d16ae931b73c59d7e0c089c0"
+    assert _md4(b"abc").hex() == "a448017aaf21d8525fc10ae87aa6729d"
+    assert _md4(b"a" * 1000) == md4(b"a" * 1000)
+
+
+def test_block_sums():
+    """Weights count down from the block length."""
+    assert block_sums(b"\x01\x02\x03") == (6, 3 * 1 + 2 * 2 + 1 * 3)
+
+
+@pytest.mark.parametrize("size", [1, 1000, 2048, 4096, 5000])
+def test_piece_sums(size):
+    """Pieces are summed like single blocks, the last one padded."""
+    data = os.urandom(3 * size + 7)
+    expected = []
+    for start in range(0, len(data), size):
+        end = start + size
+        expected.append(block_sums(data[start:end].ljust(size, b"\x00")))
+
+    assert list(piece_sums(data, size)) == expected
+
+
+def test_control():
+    """Control files are parsed into per-block checksums."""
+    content = os.urandom(3 * BLOCKSIZE + 100)
+    control = Control(make_control(content), "http://host/daily/x.iso.zsync")
+
+    assert control.blocks == 4
+    assert control.length == len(content)
+    assert control.url == "http://host/daily/x.iso"
+    assert control.block_range(3) == (3 * BLOCKSIZE, len(content))
+
+    with pytest.raises(DownloadError):
+        Control(b"zsync: 0.6.2\n")
+
+
+def test_delta(http_server, tmp_path):
+    """Only blocks missing from the seed are downloaded."""
+    sectors = [os.urandom(2048) for _ in range(64)]
+    old = b"".join(sectors)
+    # shift everything by one sector, change one block, and grow the ISO
+    changed, unchanged = 30 * 2048, 32 * 2048
+    new = os.urandom(2048) + old[:changed] + os.urandom(4096)
+    new += old[unchanged:] + os.urandom(1000)
+
+    http_server.files["/daily/x.iso"] = new
+    http_server.files["/daily/x.iso.zsync"] = make_control(new)
+    seed = tmp_path / "old.iso"
+    seed.write_bytes(old)
+    filename = str(tmp_path / "x.iso")
+
+    delta = Delta(http_server.url + "/daily/x.iso", filename, str(seed))
+
+    assert delta.run() == hashlib.sha256(new).hexdigest()
+    assert open(filename, "rb").read() == new
+
+    fetched = 0
+    for _, _, headers in http_server.requests:
+        match = re.match(r"bytes=(\d+)-(\d+)", headers.get("Range", ""))
+        if match:
+            fetched += int(match.group(2)) - int(match.group(1)) + 1
+    assert fetched < len(new) // 4
+
+
+def test_delta_missing_control(http_server, tmp_path):
+    """A missing control file raises an error."""
+    seed = tmp_path / "old.iso"
+    seed.write_bytes(b"old")
+    delta = Delta(http_server.url + "/x.iso", str(tmp_path / "x.iso"), str(seed))
+
+    with pytest.raises(DownloadError):
+        delta.run()
+
+
+def test_missing_gap(tmp_path):
+    """Missing blocks less than the gap apart are fetched as one range."""
+    delta = Delta("http://host/x.iso", "x.iso", "old.iso", gap=2 * BLOCKSIZE)
+    delta.control = Control(make_control(os.urandom(10 * BLOCKSIZE)))
+    matches = {block: 0 for block in (1, 3, 4, 5, 8)}
+
+    assert delta.missing(matches) == [
+        (0, 3 * BLOCKSIZE),
+        (6 * BLOCKSIZE, 10 * BLOCKSIZE),
+    ]
+
+    delta.gap = 0
+    assert len(delta.missing(matches)) == 4
+
+
+def run_delta(http_server, tmp_path, old, new, **options):
+    """Update from old to new and return the number of bytes fetched."""
+    http_server.files["/x.iso"] = new
+    http_server.files["/x.iso.zsync"] = make_control(new, **options)
+    seed = tmp_path / "old.iso"
+    seed.write_bytes(old)
+    filename = str(tmp_path / "x.iso")
+
+    delta = Delta(http_server.url + "/x.iso", filename, str(seed), gap=0)
+    assert delta.run() == hashlib.sha256(new).hexdigest()
+
+    fetched = 0
+    for _, _, headers in http_server.requests:
+        match = re.match(r"bytes=(\d+)-(\d+)", headers.get("Range", ""))
+        if match:
+            fetched += int(match.group(2)) - int(match.group(1)) + 1
+    return fetched
+
+
+def test_delta_last_block(http_server, tmp_path):
+    """The short last block is found at the end of the seed."""
+    old = os.urandom(8 * BLOCKSIZE + 1000)
+    new = os.urandom(BLOCKSIZE) + old[BLOCKSIZE:]
+
+    assert run_delta(http_server, tmp_path, old, new) == BLOCKSIZE
+
+
+def test_delta_sector_shift(http_server, tmp_path):
+    """Data moved by part of a sector is not found, only by sectors."""
+    old = os.urandom(8 * BLOCKSIZE)
+
+    assert run_delta(http_server, tmp_path, old, b"x" * 2048 + old) == BLOCKSIZE
+    del http_server.requests[:]
+    new = b"x" * 100 + old
+    assert run_delta(http_server, tmp_path, old, new) == len(new)
+
+
+def test_delta_seq_matches(http_server, tmp_path):
+    """With sequence matches, a block only matches with the next one."""
+    blocks = [os.urandom(BLOCKSIZE) for _ in range(4)]
+    old = blocks[0] + os.urandom(BLOCKSIZE) + blocks[2] + blocks[3]
+    new = b"".join(blocks)
+
+    # block 0 is followed by a changed block in the seed
+    assert run_delta(http_server, tmp_path, old, new) == 2 * BLOCKSIZE
+    del http_server.requests[:]
+    assert run_delta(http_server, tmp_path, old, new, seq_matches=1) == BLOCKSIZE
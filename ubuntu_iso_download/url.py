@@ -15,12 +15,17 @@ Ubuntu Desktop and Server AMD64 ISOs are kept on 'release.ubuntu.com',
 whereas flavors, development release, and other architectures are kept
 on 'cdimage.ubuntu.com'.
 
-Due to simplicity and demand, this only creates URLs for AMD64 (x86_64)
-ISOs.
+Each flavor knows the architectures it is built for. The server is
+built for every port (arm64, ppc64el, s390x, and riscv64 since 22.04),
+the desktop for arm64 since 24.04, and the other flavors for amd64
+only; i386 ended with the 17.x to 18.x releases. Port ISOs of a
+release all sit in one cdimage directory, next to a single SHA256SUMS.
+Asking for any other combination raises UnsupportedError.
 """
 
 import logging
-import sys
+
+from .errors import UnsupportedError
 
 ENOENT_URL = """Oops: URL not found
 If you are sure this is not networking related AND know the ISO exists
@@ -32,6 +37,8 @@ would you please file a bug and let us know that the following:
 
 URL_ARCHIVE = "http://archive.ubuntu.com"
 URL_CDIMAGE = "http://cdimage.ubuntu.com"
+ARCHES = ("amd64", "arm64", "i386", "ppc64el", "riscv64", "s390x")
+PORTS = ("arm64", "ppc64el", "riscv64", "s390x")
 URL_RELEASES = "http://releases.ubuntu.com"
 
 
@@ -56,10 +63,20 @@ class URL:
         self.release = release
         self.mirror = mirror.strip("/")
 
+        arches = self.supported_arches()
+        if arches is not None and arch not in arches:
+            raise UnsupportedError(
+                "%s ISOs are not built for %s on %s." % (self.name, arch, release)
+            )
+
     def __repr__(self):
         """Return string representation of ISO."""
         return "%s ISO on %s" % (self.name, self.release)
 
+    def supported_arches(self):
+        """Return the architectures built for the release, None for any."""
+        return None
+
     @property
     def hash_file(self):
         """Return URL to hash file."""
@@ -119,8 +136,24 @@ class Server(URL):
         if self.release.year < 18:
             self.variety = "server"
 
+    def supported_arches(self):
+        """Return the architectures built for the release."""
+        arches = ["amd64", "arm64", "ppc64el", "s390x"]
+        if self.release.year >= 22:
+            arches.append("riscv64")
+        if self.release.year < 18:
+            arches.append("i386")
+        return arches
+
     def _supported_url(self):
-        """Return supported release url."""
+        """Return supported release url.
+
+        Ports are only published on cdimage, which mirrors of
+        releases.ubuntu.com do not carry.
+        """
+        if self.arch in PORTS:
+            return super()._supported_url()
+
         return "{base_url}/{version}".format(
             base_url=self.mirror if self.mirror else URL_RELEASES,
             version=self.release.version,
@@ -133,8 +166,24 @@ class Desktop(URL):
     name = "Ubuntu Desktop"
     flavor = "ubuntu"
 
+    def supported_arches(self):
+        """Return the architectures built for the release."""
+        arches = ["amd64"]
+        if self.release.year >= 24:
+            arches.append("arm64")
+        if (self.release.year, self.release.month) < (17, 10):
+            arches.append("i386")
+        return arches
+
     def _supported_url(self):
-        """Return supported release url."""
+        """Return supported release url.
+
+        Ports are only published on cdimage, which mirrors of
+        releases.ubuntu.com do not carry.
+        """
+        if self.arch in PORTS:
+            return super()._supported_url()
+
         return "{base_url}/{version}".format(
             base_url=self.mirror if self.mirror else URL_RELEASES,
             version=self.release.version,
@@ -154,15 +203,13 @@ class Netboot(URL):
         Netboot is only supported on amd64 and i386, before 20.04.
         """
         super().__init__(release, arch, mirror)
-        supported_arch = ["amd64", "i386"]
-
-        if self.arch not in supported_arch:
-            self._log.error("The Ubuntu netboot is only supported on amd64 and i386.")
-            sys.exit(1)
 
         if self.release.year >= 20:
-            self._log.error("The netboot ISO was discontinued after 19.10.")
-            sys.exit(1)
+            raise UnsupportedError("The netboot ISO was discontinued after 19.10.")
+
+    def supported_arches(self):
+        """Return the architectures built for the release."""
+        return ["amd64", "i386"]
 
     @property
     def dir(self):
@@ -182,7 +229,18 @@ class Netboot(URL):
         )
 
 
-class Budgie(URL):
+class Flavor(URL):
+    """Community flavor, built for amd64 and before 19.04 for i386."""
+
+    def supported_arches(self):
+        """Return the architectures built for the release."""
+        arches = ["amd64"]
+        if self.release.year < 19:
+            arches.append("i386")
+        return arches
+
+
+class Budgie(Flavor):
     """Budgie Desktop Flavor."""
 
     name = "Ubuntu Budgie"
@@ -196,41 +254,40 @@ class Budgie(URL):
         super().__init__(release, arch, mirror)
 
         if self.release.year < 18:
-            self._log.error(
+            raise UnsupportedError(
                 "The Ubuntu Budgie flavor was not supported until the 18.04 release"
             )
-            sys.exit(1)
 
 
-class Kubuntu(URL):
+class Kubuntu(Flavor):
     """Kubuntu Desktop Flavor."""
 
     name = "Kubuntu"
     flavor = "kubuntu"
 
 
-class Kylin(URL):
+class Kylin(Flavor):
     """Kylin Desktop Flavor."""
 
     name = "Ubuntu Kylin"
     flavor = "ubuntukylin"
 
 
-class Lubuntu(URL):
+class Lubuntu(Flavor):
     """Lubuntu Desktop Flavor."""
 
     name = "Lubuntu"
     flavor = "lubuntu"
 
 
-class Mate(URL):
+class Mate(Flavor):
     """Mate Desktop Flavor."""
 
     name = "Ubuntu MATE"
     flavor = "ubuntu-mate"
 
 
-class Studio(URL):
+class Studio(Flavor):
     """Studio Desktop Flavor."""
 
     name = "Ubuntu Studio"
@@ -256,8 +313,22 @@ class Studio(URL):
         )
 
 
-class Xubuntu(URL):
+class Xubuntu(Flavor):
     """Xubuntu Desktop Flavor."""
 
     name = "Xubuntu"
     flavor = "xubuntu"
+
+
+FLAVORS = {
+    "desktop": Desktop,
+    "server": Server,
+    "netboot": Netboot,
+    "budgie": Budgie,
+    "kubuntu": Kubuntu,
+    "kylin": Kylin,
+    "lubuntu": Lubuntu,
+    "mate": Mate,
+    "studio": Studio,
+    "xubuntu": Xubuntu,
+}
@@ -0,0 +1,342 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download library verification.
+
+Checks a directory of ISOs against the signed hash files again, e.g.
+after moving them to new storage. Each ISO is matched by filename, or
+by its directory and filename for names such as netboot/mini.iso: the
+target index knows which release directories publish a file of that
+name, and hash files given explicitly are searched as well. Every
+SHA256SUMS needed is fetched and its signature verified once, however
+many ISOs it covers. Symlinks, such as the current.iso and previous.iso
+links of watch mode, are skipped; the images they point to are checked
+under their own names.
+
+The ISOs are hashed in parallel, one per worker thread, each through
+its own read and hash pipeline. hashlib releases the GIL while hashing
+large buffers, so threads spread the work over every core without the
+cost of processes. Reads are large and page-aligned. The kernel is told
+they are sequential; with drop_cache the pages read are dropped again
+so that verifying a large library does not evict everything else from
+the page cache, and with direct the page cache is bypassed altogether
+with O_DIRECT where the filesystem supports it.
+"""
+
+import concurrent.futures
+import errno
+import logging
+import os
+
+import requests
+
+from .cache import MetadataCache, SignatureCache
+from .checksums import parse_checksums
+from .errors import ISOError, SignatureError
+from .gpg import read_keyring, verify_memoized
+from .index import TargetIndex
+from .pipeline import BufferPool, Pipeline
+
+READ_SIZE = 4 * 1024 * 1024
+READ_COUNT = 4
+
+
+def find_isos(directory):
+    """Return the paths of the ISOs below a directory, sorted.
+
+    Symlinks are left out, so no image is hashed twice and no dangling
+    link is reported.
+
+    Args:
+        directory: string, directory to search
+    """
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        paths.extend(
+            os.path.join(root, name)
+            for name in filenames
+            if name.endswith(".iso") and not os.path.islink(os.path.join(root, name))
+        )
+    return sorted(paths)
+
+
+def iso_names(path, sources=()):
+    """Return the names an ISO may be listed under in a hash file.
+
+    That is its filename, its directory and filename, and any indexed
+    name with a directory that ends in the filename, e.g. a mini.iso is
+    looked up as netboot/mini.iso too.
+
+    Args:
+        path: string, path to the ISO
+        sources: iterable of indexed ISO filenames
+    """
+    directory, name = os.path.split(path)
+    names = [name, "%s/%s" % (os.path.basename(directory), name)]
+    names.extend(
+        sorted(
+            source
+            for source in sources
+            if source.endswith("/" + name) and source not in names
+        )
+    )
+    return names
+
+
+class Reader:
+    """Sequential reads of a file, sparing the page cache if asked to."""
+
+    def __init__(self, path, direct=False, drop_cache=False):
+        """Open the file.
+
+        Args:
+            path: string, file to read
+            direct: boolean, bypass the page cache with O_DIRECT
+            drop_cache: boolean, drop pages from the cache once read
+        """
+        self.path = path
+        self.drop_cache = drop_cache
+        self.direct = direct and hasattr(os, "O_DIRECT")
+        self.offset = 0
+        self.fd = None
+        self._open()
+        self.size = os.fstat(self.fd).st_size
+
+    def __enter__(self):
+        """Return the reader."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the file."""
+        os.close(self.fd)
+
+    def _open(self):
+        """Open the file, without O_DIRECT if it is not supported."""
+        if self.direct:
+            try:
+                self.fd = os.open(self.path, os.O_RDONLY | os.O_DIRECT)
+                return
+            except OSError as error:
+                if error.errno != errno.EINVAL:
+                    raise
+                self.direct = False
+
+        self.fd = os.open(self.path, os.O_RDONLY)
+        self._advise(0, 0, "POSIX_FADV_SEQUENTIAL")
+
+    def readinto(self, view):
+        """Fill a page-aligned buffer and return the bytes read."""
+        # an O_DIRECT read at an unaligned end of file fails
+        if self.offset >= self.size:
+            return 0
+
+        try:
+            length = os.readv(self.fd, [view])
+        except OSError as error:
+            if not (self.direct and error.errno == errno.EINVAL and not self.offset):
+                raise
+            os.close(self.fd)
+            self.direct = False
+            self._open()
+            length = os.readv(self.fd, [view])
+
+        if self.drop_cache and length:
+            self._advise(self.offset, length, "POSIX_FADV_DONTNEED")
+        self.offset += length
+        return length
+
+    def _advise(self, offset, length, advice):
+        """Pass an access pattern hint to the kernel where supported."""
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, offset, length, getattr(os, advice))
+
+
+class Library:
+    """ISOs in a directory checked against their signed hash files."""
+
+    def __init__(
+        self,
+        directory,
+        hash_files=(),
+        gpg="gnupg",
+        jobs=None,
+        direct=False,
+        drop_cache=False,
+        session=None,
+        index=None,
+    ):
+        """Initialize library.
+
+        Args:
+            directory: string, directory holding the ISOs
+            hash_files: list of strings, URLs of further SHA256SUMS
+                files, each signed by a SHA256SUMS.gpg next to it
+            gpg: string, signature verification backend
+            jobs: integer, ISOs hashed at once, one per core by default
+            direct: boolean, read with O_DIRECT
+            drop_cache: boolean, drop the ISOs from the page cache
+            session: requests Session to fetch the hash files with
+            index: TargetIndex object to match filenames with
+        """
+        self._log = logging.getLogger(__name__)
+        self.directory = directory
+        self.hash_files = list(hash_files)
+        self.gpg = gpg
+        self.jobs = jobs or os.cpu_count() or 1
+        self.direct = direct
+        self.drop_cache = drop_cache
+        self.metadata = MetadataCache(session=session)
+        self.signatures = SignatureCache()
+        self.index = index or TargetIndex()
+        self.keyring = None
+        self._candidates = {}
+
+    def run(self):
+        """Verify every ISO of the library.
+
+        Returns:
+            list of dictionaries, one per ISO sorted by path, with its
+            path, status ('ok', 'mismatch', 'unknown' when no hash file
+            lists it, or 'error'), expected and actual SHA-256, size,
+            and the hash file used
+
+        Raises:
+            SignatureError: the signing key is missing
+
+        """
+        paths = find_isos(self.directory)
+        sources = self._sources() if paths else {}
+        self.keyring = read_keyring()
+
+        urls = set(self.hash_files)
+        for path in paths:
+            urls.update(self._source_urls(path, sources))
+
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            urls = sorted(urls)
+            hash_files = dict(zip(urls, executor.map(self._fetch, urls)))
+            results = [self._expect(path, sources, hash_files) for path in paths]
+            list(
+                executor.map(
+                    self._check,
+                    [result for result in results if result["expected"]],
+                )
+            )
+
+        return results
+
+    def _sources(self):
+        """Return the directory URLs of every usual ISO filename."""
+        if not self.index.load():
+            self._log.info("Building the target index")
+            self.index.build()
+
+        return self.index.sources()
+
+    def _fetch(self, url):
+        """Return a verified hash file, or the error fetching it.
+
+        Args:
+            url: string, URL of the SHA256SUMS file
+        """
+        self._log.debug("Fetching %s", url)
+        try:
+            hashes = self.metadata.get(url)
+            signature = self.metadata.get("%s.gpg" % url)
+            if not verify_memoized(
+                self.gpg, self.keyring, hashes, signature, self.signatures
+            ):
+                raise SignatureError("GPG signature verification failed for %s" % url)
+        except (ISOError, requests.RequestException) as error:
+            self._log.warning("Oops: unable to use %s: %s", url, error)
+            return error
+
+        return parse_checksums(hashes)
+
+    def _expect(self, path, sources, hash_files):
+        """Return the result of an ISO with its expected SHA-256 filled in.
+
+        The hash files of the release directories the filename belongs
+        to are searched first, then the hash files given explicitly.
+        Every digest listed for the ISO is kept, since names such as
+        netboot/mini.iso are published for several releases and arches.
+
+        Args:
+            path: string, path to the ISO
+            sources: dictionary of filename to release directory URLs
+            hash_files: dictionary of URL to Checksums object or error
+        """
+        result = {
+            "path": path,
+            "status": "unknown",
+            "expected": "",
+            "actual": "",
+            "size": 0,
+            "source": "",
+        }
+
+        try:
+            result["size"] = os.path.getsize(path)
+        except OSError as error:
+            result.update(status="error", error=str(error))
+            return result
+
+        names = iso_names(path, sources)
+        urls = self._source_urls(path, sources)
+        urls += [url for url in self.hash_files if url not in urls]
+        candidates = []
+        for url in urls:
+            checksums = hash_files[url]
+            if isinstance(checksums, Exception):
+                if not candidates:
+                    result.update(status="error", error=str(checksums), source=url)
+                continue
+
+            for name in names:
+                digest = checksums.digest(name)
+                if digest and (digest, url) not in candidates:
+                    candidates.append((digest, url))
+
+        if candidates:
+            result.update(
+                status="pending", expected=candidates[0][0], source=candidates[0][1]
+            )
+            result.pop("error", None)
+            self._candidates[path] = candidates
+
+        return result
+
+    @staticmethod
+    def _source_urls(path, sources):
+        """Return the URLs of the release hash files that may list an ISO.
+
+        Args:
+            path: string, path to the ISO
+            sources: dictionary of filename to release directory URLs
+        """
+        urls = []
+        for name in iso_names(path, sources):
+            for directory in sources.get(name, []):
+                url = "%s/SHA256SUMS" % directory
+                if url not in urls:
+                    urls.append(url)
+        return urls
+
+    def _check(self, result):
+        """Hash an ISO and compare it to its expected SHA-256.
+
+        Args:
+            result: dictionary from _expect, updated in place
+        """
+        try:
+            with Reader(result["path"], self.direct, self.drop_cache) as reader:
+                pool = BufferPool(READ_COUNT, READ_SIZE, aligned=True)
+                result["actual"] = Pipeline(pool=pool).run(reader.readinto)["sha256"]
+        except OSError as error:
+            result.update(status="error", error=str(error))
+            return
+
+        result["status"] = "mismatch"
+        for digest, url in self._candidates.get(result["path"], []):
+            if digest == result["actual"]:
+                result.update(status="ok", expected=digest, source=url)
+                break
+        self._log.debug("%s %s", result["status"], result["path"])
@@ -0,0 +1,328 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download watch mode.
+
+Keeps a directory up to date with the newest ISO of each target, e.g.
+the latest point release of an LTS or the daily build of the
+development release. Every interval the signed SHA256SUMS of each
+target is revalidated with a conditional request, which costs a 304
+and no signature check while nothing changed. Only when the SHA-256 of
+the ISO changes is anything downloaded, and then the current image is
+used as a zsync seed so only the changed blocks are fetched, with a
+full download as the fallback.
+
+Each target gets a directory of its own, holding every image in a
+directory named after its SHA-256 and two symlinks:
+
+    server-focal-amd64/
+        current.iso -> 5a6f.../ubuntu-20.04.4-live-server-amd64.iso
+        previous.iso -> 28cc.../ubuntu-20.04.3-live-server-amd64.iso
+
+The symlinks are replaced atomically once the new image is verified, so
+a reader never sees a partial ISO, and older images are removed. The
+digest in the link also tells a restarted watch what it has already.
+
+All targets are polled concurrently on one event loop, each ISO
+running in a thread of its own through AsyncISO. They share one
+session, so targets on the same host reuse its keep-alive connections,
+and at most per_host of them download from a host at once.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import shutil
+import time
+
+from .aio import AsyncISO
+from .errors import ISOError
+from .session import POOL_SIZE, create_session
+from .url import FLAVORS
+
+CURRENT = "current.iso"
+PREVIOUS = "previous.iso"
+RELEASE_TTL = 24 * 60 * 60
+TIMEOUT = 6 * 60 * 60
+
+# what a failed poll raises, from the library or the network
+ERRORS = (ISOError, OSError, EOFError, asyncio.TimeoutError)
+
+
+class Watch:
+    """Poll targets and keep the newest verified ISO of each."""
+
+    def __init__(
+        self,
+        entries,
+        directory,
+        interval=3600,
+        per_host=2,
+        ubuntu=None,
+        timeout=TIMEOUT,
+        **options
+    ):
+        """Initialize watch.
+
+        Args:
+            entries: list of batch Entry objects
+            directory: string, directory to keep the ISOs in
+            interval: float, seconds between polls
+            per_host: integer, maximum concurrent downloads per host
+            ubuntu: ubuntu_release_info Data object, fetched and
+                refreshed daily when None
+            timeout: float, seconds a target may take per poll, including
+                any download, before it is given up until the next poll
+            options: additional keyword arguments for each ISO
+        """
+        self._log = logging.getLogger(__name__)
+        self.entries = entries
+        self.directory = directory
+        self.interval = interval
+        self.timeout = timeout
+        self.per_host = max(1, per_host)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max(1, len(entries)))
+        self.options = options
+        self.options.setdefault("show_progress", False)
+        self.options.setdefault(
+            "session",
+            create_session(
+                pool_size=max(POOL_SIZE, len(entries) * options.get("connections", 1))
+            ),
+        )
+        self.ubuntu = ubuntu
+        self._refresh = ubuntu is None
+        self._released = 0
+        self._isos = {}
+        self._hosts = {}
+
+    def run(self, cycles=None):
+        """Poll on a new event loop until interrupted.
+
+        Args:
+            cycles: integer, number of polls, forever when None
+
+        Returns:
+            boolean, if every target was current after the last poll
+
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.watch(cycles))
+        finally:
+            self.executor.shutdown(wait=False)
+            loop.close()
+
+    async def watch(self, cycles=None):
+        """Poll every interval, see run()."""
+        cycle = 0
+        while True:
+            ok = await self.poll()
+            cycle += 1
+            if cycles is not None and cycle >= cycles:
+                return ok
+            await asyncio.sleep(self.interval)
+
+    async def poll(self):
+        """Poll every target once.
+
+        Returns:
+            boolean, if every target is current
+
+        """
+        await self._release_data()
+        self._hosts = {}
+        outcomes = await asyncio.gather(
+            *[
+                asyncio.wait_for(self.update(entry), self.timeout)
+                for entry in self.entries
+            ],
+            return_exceptions=True
+        )
+
+        # one target failing in an unexpected way must not stop the others
+        for entry, outcome in zip(self.entries, outcomes):
+            if isinstance(outcome, Exception):
+                if isinstance(outcome, asyncio.TimeoutError):
+                    outcome = asyncio.TimeoutError("timed out after %ss" % self.timeout)
+                self._log.warning("Oops: %s: %r", entry, outcome)
+                entry.status = "failed"
+                entry.error = outcome
+
+        return all(entry.status in ("current", "updated") for entry in self.entries)
+
+    async def _release_data(self):
+        """Fetch the release data when it is missing or a day old.
+
+        Fresh data follows a new LTS and the move of a development
+        release to the releases tree; the ISOs are resolved again.
+        """
+        if not self._refresh or time.monotonic() - self._released < RELEASE_TTL:
+            return
+
+        from ubuntu_release_info import data as UbuntuReleaseInfo
+
+        loop = asyncio.get_event_loop()
+        try:
+            self.ubuntu = await loop.run_in_executor(None, UbuntuReleaseInfo.Data)
+        except Exception as error:
+            if self.ubuntu is None:
+                raise
+            self._log.warning("Oops: keeping old release data: %s", error)
+            return
+
+        self._released = time.monotonic()
+        self._isos = {}
+
+    def target_directory(self, entry):
+        """Return the directory of a target.
+
+        Args:
+            entry: batch Entry object
+        """
+        return os.path.join(self.directory, repr(entry).replace(":", "-"))
+
+    def current(self, entry):
+        """Return the path and SHA-256 of the current image, or empties.
+
+        Args:
+            entry: batch Entry object
+        """
+        link = os.path.join(self.target_directory(entry), CURRENT)
+        if not os.path.isfile(link):
+            return "", ""
+        return link, os.readlink(link).split("/", 1)[0]
+
+    async def update(self, entry):
+        """Fetch the hash of a target and get its ISO if it changed.
+
+        The outcome is left on the entry: 'current', 'updated', or
+        'failed' with the error.
+
+        Args:
+            entry: batch Entry object
+        """
+        start = time.monotonic()
+        try:
+            iso = await self._iso(entry)
+            entry.filename, entry.target_hash = await iso.hash()
+            seed, digest = self.current(entry)
+            if digest == entry.target_hash:
+                entry.status = "current"
+            else:
+                entry.local_iso = await self._get(entry, iso, seed)
+                entry.status = "updated"
+                self._log.info("%s updated to %s", entry, entry.filename)
+            entry.error = None
+        except ERRORS as error:
+            self._log.warning("Oops: %s: %s", entry, error)
+            entry.status = "failed"
+            entry.error = error
+        entry.seconds = time.monotonic() - start
+
+    async def _iso(self, entry):
+        """Return the AsyncISO of an entry, resolving it once."""
+        key = repr(entry)
+        if key not in self._isos:
+            self._isos[key] = await AsyncISO.create(
+                FLAVORS[entry.flavor],
+                entry.release,
+                executor=self.executor,
+                mirror=entry.mirror,
+                arch=entry.arch,
+                ubuntu=self.ubuntu,
+                **self.options
+            )
+            entry.iso = self._isos[key].iso
+        return self._isos[key]
+
+    async def _get(self, entry, iso, seed):
+        """Get a new image, from the seed where possible, and swap to it.
+
+        Args:
+            entry: batch Entry object
+            iso: AsyncISO object with its hash fetched
+            seed: string, path to the current image, empty for none
+
+        Returns:
+            string, path to the current image link
+
+        """
+        # hash files list some ISOs below a directory, e.g. netboot/mini.iso
+        filename = os.path.basename(entry.filename)
+        target = self.target_directory(entry)
+        image = os.path.join(target, entry.target_hash)
+        path = os.path.join(image, filename)
+        created = not os.path.isdir(image)
+        os.makedirs(image, exist_ok=True)
+
+        # an image kept as previous is verified and reused, not fetched
+        if os.path.isfile(path):
+            seed = ""
+        elif seed:
+            seed = os.path.realpath(seed)
+
+        try:
+            await self._download(entry, iso, path, seed)
+        except BaseException:
+            # never remove an image that was there before, e.g. previous
+            if created:
+                shutil.rmtree(image, ignore_errors=True)
+            raise
+
+        self._swap(target, entry.target_hash, filename)
+        return os.path.join(target, CURRENT)
+
+    async def _download(self, entry, iso, path, seed):
+        """Download an image once a slot on each of its hosts is free.
+
+        Args:
+            entry: batch Entry object
+            iso: AsyncISO object with its hash fetched
+            path: string, path to save the image to
+            seed: string, path to update the image from, empty for none
+        """
+        await iso.select_mirror()
+        held = []
+        try:
+            # in a fixed order, so targets sharing hosts never deadlock
+            for host in sorted(entry.hosts):
+                slot = self._hosts.setdefault(host, asyncio.Semaphore(self.per_host))
+                await slot.acquire()
+                held.append(slot)
+            await iso.download(path, seed)
+        finally:
+            for slot in held:
+                slot.release()
+
+    def _swap(self, target, digest, filename):
+        """Point current at a new image, previous at the old one.
+
+        Args:
+            target: string, target directory
+            digest: string, SHA-256 of the new image
+            filename: string, filename of the new image
+        """
+        current = os.path.join(target, CURRENT)
+        if os.path.islink(current):
+            self._link(os.readlink(current), os.path.join(target, PREVIOUS))
+        self._link(os.path.join(digest, filename), current)
+
+        keep = {
+            os.readlink(link).split("/", 1)[0]
+            for link in (current, os.path.join(target, PREVIOUS))
+            if os.path.islink(link)
+        }
+        for name in os.listdir(target):
+            path = os.path.join(target, name)
+            if name not in keep and os.path.isdir(path) and not os.path.islink(path):
+                self._log.debug("Removing %s", path)
+                shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def _link(source, link):
+        """Replace a symlink atomically."""
+        temporary = "%s.tmp" % link
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        os.symlink(source, temporary)
+        os.replace(temporary, link)
@@ -0,0 +1,480 @@
+# This file is part of ubuntu-iso-download. See LICENSE for license infomation.
+"""Ubuntu ISO Download delta updates with zsync.
+
+cdimage publishes a '.zsync' control file next to each ISO. It lists,
+for every fixed-size block of the ISO, a weak rolling checksum and a
+truncated MD4 digest. Given an older ISO as a seed, the blocks already
+present in the seed are copied locally and only the remaining ones are
+fetched with HTTP Range requests.
+
+The seed is scanned at ISO 9660 sector (2048 byte) boundaries rather
+than at every byte. Files inside an ISO always start on a sector, so
+this finds the same blocks for ISO seeds while keeping the scan fast
+enough in pure Python. Data moved by anything other than whole sectors,
+as in a seed that is not an ISO, is not found and is fetched instead.
+The rolling checksum of each window is built from per-sector sums, so
+every byte of the seed is summed only once, and rolled forward a sector
+at a time, so only one window of sums is held however large the seed.
+The sums of a sector are taken with integer arithmetic on all of its
+bytes at once rather than byte by byte, see piece_sums(). Like zsync,
+the seed is treated as followed by zeros, so the last block of the ISO,
+padded with zeros in the control file, is found at the end of the seed.
+
+The missing blocks are fetched with a few Range requests in parallel.
+Ranges separated by at most RANGE_GAP bytes are fetched as one, since
+another request costs more than the few blocks fetched again.
+
+A block is accepted when its truncated MD4 matches and, as the control
+file asks with its sequence matches, so do those of the blocks that
+follow it. A false match is not possible to rule out with the short
+digests zsync stores, but it cannot go unnoticed: the result is
+verified against the signed SHA-256 like any download.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import mmap
+import os
+import struct
+import threading
+import urllib.parse
+
+from .download import CHUNK_SIZE, DownloadError, StreamHash
+from .output import OutputFile
+from .session import get_session
+
+SECTOR_SIZE = 2048
+RANGE_GAP = 32 * 1024
+RANGE_JOBS = 4
+
+
+def md4(data):
+    """Return the MD4 digest of data.
+
+    hashlib provides MD4 only while OpenSSL still ships it, so a pure
+    Python implementation is used otherwise.
+
+    Args:
+        data: bytes, data to hash
+    """
+    try:
+        return hashlib.new("md4", data).digest()
+    except ValueError:
+        return _md4(bytes(data))
+
+
+def _md4(data):
+    """Return the MD4 digest of data per RFC 1320."""
+    mask = 0xFFFFFFFF
+
+    def rotate(value, shift):
+        value &= mask
+        return ((value << shift) | (value >> (32 - shift))) & mask
+
+    length = len(data) * 8
+    data += b"\x80" + b"\x00" * ((55 - len(data)) % 64)
+    data += struct.pack("<Q", length & 0xFFFFFFFFFFFFFFFF)
+
+    state = [0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476]
+    for offset in range(0, len(data), 64):
+        end = offset + 64
+        x = struct.unpack("<16I", data[offset:end])
+        a, b, c, d = state
+
+        for i in range(16):
+            f = (b & c) | (~b & d)
+            a, b, c, d = d, rotate(a + f + x[i], (3, 7, 11, 19)[i % 4]), b, c
+        for i in range(16):
+            k = (i % 4) * 4 + i // 4
+            g = (b & c) | (b & d) | (c & d)
+            a, b, c, d = (
+                d,
+                rotate(a + g + x[k] + 0x5A827999, (3, 5, 9, 13)[i % 4]),
+                b,
+                c,
+            )
+        for i in range(16):
+            k = (0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15)[i]
+            h = b ^ c ^ d
+            a, b, c, d = (
+                d,
+                rotate(a + h + x[k] + 0x6ED9EBA1, (3, 9, 11, 15)[i % 4]),
+                b,
+                c,
+            )
+
+        state = [(value + new) & mask for value, new in zip(state, (a, b, c, d))]
+
+    return struct.pack("<4I", *state)
+
+
+def block_sums(data):
+    """Return the zsync (a, b) rolling checksum parts of a block.
+
+    a is the sum of the bytes and b weights each byte by its distance
+    from the end of the block, both modulo 2**16.
+
+    Args:
+        data: bytes-like, block data
+    """
+    return sum(data) & 0xFFFF, sum(itertools.accumulate(data)) & 0xFFFF
+
+
+def piece_sums(view, size):
+    """Yield the block_sums of every size-sized piece of view.
+
+    The last piece is padded with zeros. The bytes of a piece are spread
+    into the lanes of one integer, which is then folded in half until a
+    single lane holds their sum. Folding the upper half onto the lower
+    one also adds the upper half times its offset to a second integer,
+    giving the weighted sum b is made of, so the work is done by
+    integer operations on the whole piece instead of once per byte.
+
+    Args:
+        view: bytes-like, data to sum
+        size: integer, size of each piece
+    """
+    # wide enough lanes that neither sum carries into the next lane
+    width = 4 if 255 * size * size < 1 << 32 else 8
+    levels = []
+    length = size
+    while length > 1:
+        half = length // 2
+        bits = 8 * width * half
+        levels.append((bits, (1 << bits) - 1, half))
+        length -= half
+
+    lanes = bytearray(width * size)
+    for offset in range(0, len(view), size):
+        end = offset + size
+        piece = view[offset:end]
+        if len(piece) < size:
+            lanes = bytearray(width * size)
+        spread = width * len(piece)
+        lanes[0:spread:width] = piece
+
+        total, weighted = int.from_bytes(lanes, "little"), 0
+        for bits, mask, half in levels:
+            upper = total >> bits
+            weighted = (weighted & mask) + (weighted >> bits) + half * upper
+            total = (total & mask) + upper
+        yield total & 0xFFFF, (size * total - weighted) & 0xFFFF
+
+
+class Control:
+    """Parsed zsync control file."""
+
+    def __init__(self, data, url=""):
+        """Parse a control file.
+
+        Args:
+            data: bytes, content of the .zsync file
+            url: string, URL the control file was fetched from, to
+                resolve a relative ISO URL against
+        """
+        header, separator, body = data.partition(b"\n\n")
+        if not separator:
+            raise DownloadError("Invalid zsync control file")
+
+        fields = {}
+        for line in header.decode("utf-8", "replace").splitlines():
+            key, _, value = line.partition(":")
+            fields[key.strip().lower()] = value.strip()
+
+        if "z-map2" in fields:
+            raise DownloadError("Compressed zsync targets are not supported")
+
+        try:
+            self.blocksize = int(fields["blocksize"])
+            self.length = int(fields["length"])
+            lengths = fields.get("hash-lengths", "1,4,16").split(",")
+            self.seq_matches, self.rsum_bytes, self.checksum_bytes = map(int, lengths)
+        except (KeyError, ValueError):
+            raise DownloadError("Invalid zsync control file")
+
+        self.url = urllib.parse.urljoin(url, fields.get("url", ""))
+        self.sha1 = fields.get("sha-1", "")
+
+        count = -(-self.length // self.blocksize)
+        size = self.rsum_bytes + self.checksum_bytes
+        if len(body) < count * size:
+            raise DownloadError("Truncated zsync control file")
+
+        self.checksums = []
+        self.index = {}
+        for block in range(count):
+            start = block * size
+            middle = start + self.rsum_bytes
+            end = start + size
+            rsum = int.from_bytes(body[start:middle], "big")
+            self.checksums.append(body[middle:end])
+            self.index.setdefault(rsum, []).append(block)
+
+    @property
+    def blocks(self):
+        """Return the number of blocks of the target."""
+        return len(self.checksums)
+
+    def rsum(self, a, b):
+        """Return the stored part of a rolling checksum."""
+        return ((a << 16) | b) & ((1 << (8 * self.rsum_bytes)) - 1)
+
+    def block_range(self, block):
+        """Return the (start, end) byte range of a block, end exclusive."""
+        start = block * self.blocksize
+        return start, min(start + self.blocksize, self.length)
+
+
+class Delta:
+    """Build an ISO from a seed file and the blocks missing from it."""
+
+    def __init__(
+        self,
+        url,
+        filename,
+        seed,
+        progress=None,
+        session=None,
+        zsync_url=None,
+        limiter=None,
+        gap=RANGE_GAP,
+        jobs=RANGE_JOBS,
+    ):
+        """Initialize delta update.
+
+        Args:
+            url: string, URL of the ISO
+            filename: string, local path to write to
+            seed: string, path to an older local copy of the ISO
+            progress: callable, factory taking the number of bytes to
+                fetch and returning a tqdm-like object
+            session: requests Session to download with
+            zsync_url: string, URL of the control file, the ISO URL
+                with '.zsync' appended by default
+            limiter: object with a consume(bytes) method that sleeps to
+                hold the download to a rate
+            gap: integer, missing ranges at most this many bytes apart
+                are fetched as one
+            jobs: integer, Range requests made at once
+        """
+        self._log = logging.getLogger(__name__)
+        self.url = url
+        self.filename = filename
+        self.seed = seed
+        self.progress_factory = progress
+        self.session = session or get_session()
+        self.zsync_url = zsync_url or "%s.zsync" % url
+        self.limiter = limiter
+        self.gap = gap
+        self.jobs = jobs
+        self.partial = "%s.part" % filename
+        self.control = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Build the ISO and return its SHA-256 digest."""
+        response = self.session.get(self.zsync_url)
+        if not response.ok:
+            raise DownloadError(
+                "HTTP %s for %s" % (response.status_code, self.zsync_url)
+            )
+        self.control = Control(response.content, self.zsync_url)
+
+        matches = self.match()
+        self._log.info(
+            "Reusing %s of %s blocks from %s",
+            len(matches),
+            self.control.blocks,
+            self.seed,
+        )
+
+        with OutputFile(self.partial, self.control.length) as output:
+            self.copy_matches(matches, output)
+            self._fetch(self.missing(matches), output)
+            digest = StreamHash().hexdigest(output, self.control.length)
+
+        os.replace(self.partial, self.filename)
+        return digest
+
+    def match(self):
+        """Find blocks of the target in the seed.
+
+        Returns:
+            dictionary of block number to the seed offset holding it
+
+        """
+        control = self.control
+        step = SECTOR_SIZE
+        if control.blocksize % step:
+            step = control.blocksize
+        per_window = control.blocksize // step
+
+        matches = {}
+        with open(self.seed, "rb") as seed:
+            if not os.fstat(seed.fileno()).st_size:
+                return matches
+
+            with mmap.mmap(seed.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                # zeros after the seed, for windows running past its end
+                sums = itertools.chain(
+                    piece_sums(view, step), itertools.repeat((0, 0), per_window - 1)
+                )
+                a = b = 0
+                window = collections.deque()
+                for sector, (part_a, part_b) in enumerate(sums):
+                    # every sector in the window moves a place from the end
+                    b = (b + a * step + part_b) & 0xFFFF
+                    a = (a + part_a) & 0xFFFF
+                    window.append((part_a, part_b))
+                    if len(window) > per_window:
+                        old_a, old_b = window.popleft()
+                        a = (a - old_a) & 0xFFFF
+                        b = (b - old_b - old_a * step * per_window) & 0xFFFF
+                    if len(window) < per_window:
+                        continue
+
+                    blocks = control.index.get(control.rsum(a, b))
+                    if blocks:
+                        offset = (sector + 1 - per_window) * step
+                        self._check(view, offset, blocks, matches)
+
+                    if len(matches) == control.blocks:
+                        break
+
+        return matches
+
+    def _check(self, view, offset, blocks, matches):
+        """Record the blocks whose strong checksum matches the window.
+
+        With sequence matches, the blocks following a block have to
+        match the windows following the window too, up to the end of
+        the target, and are recorded with it.
+        """
+        control = self.control
+        candidates = [block for block in blocks if block not in matches]
+        if not candidates:
+            return
+
+        digests = {}
+        for block in candidates:
+            last = min(block + control.seq_matches, control.blocks)
+            found = {}
+            for following in range(block, last):
+                start = offset + (following - block) * control.blocksize
+                if start not in digests:
+                    digests[start] = self._digest(view, start)
+                if control.checksums[following] != digests[start]:
+                    break
+                found[following] = start
+            else:
+                for following, start in found.items():
+                    matches.setdefault(following, start)
+
+    def _digest(self, view, offset):
+        """Return the truncated MD4 of a window, padded with zeros."""
+        end = offset + self.control.blocksize
+        window = bytes(view[offset:end]).ljust(self.control.blocksize, b"\0")
+        return md4(window)[: self.control.checksum_bytes]
+
+    def missing(self, matches):
+        """Return the byte ranges not found in the seed, merged.
+
+        Ranges at most the gap apart are merged too.
+
+        Args:
+            matches: dictionary, result of match()
+
+        Returns:
+            list of (start, end) tuples, end exclusive
+
+        """
+        ranges = []
+        for block in range(self.control.blocks):
+            if block in matches:
+                continue
+
+            start, end = self.control.block_range(block)
+            if ranges and start - ranges[-1][1] <= self.gap:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+
+        return ranges
+
+    def copy_matches(self, matches, output):
+        """Write the blocks found in the seed."""
+        with open(self.seed, "rb") as seed:
+            for block, offset in sorted(matches.items()):
+                start, end = self.control.block_range(block)
+                seed.seek(offset)
+                # a match running past the end of the seed matched zeros
+                output.write(start, seed.read(end - start).ljust(end - start, b"\0"))
+
+    def _fetch(self, ranges, output):
+        """Download the missing ranges into the output file in parallel."""
+        progress = None
+        if self.progress_factory:
+            progress = self.progress_factory(sum(end - start for start, end in ranges))
+
+        url = self.control.url or self.url
+        self._stop.clear()
+        workers = max(1, min(len(ranges), self.jobs))
+        try:
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._fetch_range, url, start, end, output, progress
+                    )
+                    for start, end in ranges
+                ]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+                except BaseException:
+                    self._stop.set()
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            if progress:
+                progress.close()
+
+    def _fetch_range(self, url, start, end, output, progress):
+        """Download one range into the output file.
+
+        Args:
+            url: string, URL of the ISO
+            start: integer, first byte
+            end: integer, end of the range, exclusive
+            output: OutputFile object to write to
+            progress: tqdm-like object or None
+        """
+        headers = {"Range": "bytes=%s-%s" % (start, end - 1)}
+        response = self.session.get(url, headers=headers, stream=True)
+        if response.status_code != 206:
+            raise DownloadError(
+                "HTTP %s for range %s-%s of %s"
+                % (response.status_code, start, end - 1, url)
+            )
+
+        received = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if self._stop.is_set():
+                response.close()
+                return
+            output.write(start + received, chunk)
+            received += len(chunk)
+            if progress:
+                with self._lock:
+                    progress.update(len(chunk))
+            if self.limiter:
+                self.limiter.consume(len(chunk))
+
+        if received != end - start:
+            raise DownloadError(
+                "Short read for range %s-%s of %s" % (start, end - 1, url)
+            )